@@ -0,0 +1,112 @@
+"""
+    JSON file I/O for tools and output writers that does not stall the event loop
+    - read_json / write_json are for synchronous code; read_json_async / write_json_async do the same work in a worker
+      thread, so an async flow keeps serving its other sessions while a large file is read or written
+    - write_json streams the encoding (JSONEncoder.iterencode) into a temporary file next to the target, fsyncs it and
+      renames it over the target: a reader sees the old file or the new one, never a partial one, and a large output is
+      never built as one string in memory
+    - read_json_async decodes the items of a top-level array or object one at a time, so the worker thread gives the
+      GIL back to the event loop between items instead of holding it for one long json.loads call
+    - A cancelled read_json_async / write_json_async returns immediately, the thread finishes its file in the background
+"""
+import asyncio
+import json
+import os
+import re
+import uuid
+
+CHUNK_SIZE = 1 << 20 # characters read at a time
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"[ \t\n\r]*")
+
+
+def read_json(path):
+    """Read a JSON file."""
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def write_json(path, data, indent=None, default=None):
+    """
+    Write data to a JSON file atomically, encoding it in chunks.
+    The parent directory is created if needed; on any error the previous file (if any) is left untouched.
+
+    Args:
+        path (str): The file to write.
+        data: The JSON serializable data; it must not be modified while it is written.
+        indent (int): Passed to json.JSONEncoder, like default.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = f"{path}.{uuid.uuid4().hex}.tmp" # same directory, so the rename cannot cross file systems
+    try:
+        with open(temporary, "x", encoding="utf-8") as file:
+            file.writelines(json.JSONEncoder(indent=indent, default=default).iterencode(data))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def loads_by_item(text):
+    """
+    json.loads that decodes the items of a top-level array or object one at a time.
+    Other values (strings, numbers, ...) are decoded in one call.
+    """
+    index = _whitespace.match(text, 0).end()
+    if text.startswith("[", index):
+        result, close = [], "]"
+    elif text.startswith("{", index):
+        result, close = {}, "}"
+    else:
+        return json.loads(text)
+
+    index = _whitespace.match(text, index + 1).end()
+    if text.startswith(close, index):
+        index += 1
+    else:
+        while True:
+            if close == "}":
+                if not text.startswith('"', index):
+                    raise json.JSONDecodeError("Expecting property name enclosed in double quotes", text, index)
+                key, index = _decoder.raw_decode(text, index)
+                index = _whitespace.match(text, index).end()
+                if not text.startswith(":", index):
+                    raise json.JSONDecodeError("Expecting ':' delimiter", text, index)
+                index = _whitespace.match(text, index + 1).end()
+                result[key], index = _decoder.raw_decode(text, index)
+            else:
+                item, index = _decoder.raw_decode(text, index)
+                result.append(item)
+            index = _whitespace.match(text, index).end()
+            if text.startswith(close, index):
+                index += 1
+                break
+            if not text.startswith(",", index):
+                raise json.JSONDecodeError("Expecting ',' delimiter", text, index)
+            index = _whitespace.match(text, index + 1).end()
+
+    if _whitespace.match(text, index).end() != len(text):
+        raise json.JSONDecodeError("Extra data", text, index)
+    return result
+
+
+def _read_json_by_item(path):
+    with open(path, "r", encoding="utf-8") as file:
+        # Read (and decode from UTF-8) in chunks too: one read of a large file holds the GIL while it is decoded
+        return loads_by_item("".join(iter(lambda: file.read(CHUNK_SIZE), "")))
+
+
+async def read_json_async(path):
+    """Read a JSON file in a worker thread."""
+    return await asyncio.to_thread(_read_json_by_item, path)
+
+
+async def write_json_async(path, data, indent=None, default=None):
+    """write_json in a worker thread."""
+    await asyncio.to_thread(write_json, path, data, indent, default)
@@ -0,0 +1,171 @@
+"""
+    Bounded backpressure queue between a model stream and its consumer
+    - A producer task reads the upstream stream into a queue of at most `capacity` chunks, so upstream reads
+      are decoupled from a slow consumer (e.g. a slow web client) up to that many chunks
+    - When the queue is full, the slow consumer policy decides what happens:
+        block     the upstream read waits for the consumer (the previous behavior, with a buffer)
+        coalesce  content deltas are merged into the last queued chunk, so the upstream keeps being read
+                  and the consumer gets bigger deltas; other chunks (tool calls, finish, usage) still block
+        drop      the consumer stops getting intermediate deltas: the rest of the stream is read without waiting
+                  and delivered at the end, with consecutive content deltas merged into one chunk
+    - No content is lost with any policy; only the number and size of the chunks change
+    - Metrics: queue depth (stream_queue_depth), time the upstream read waited (stream_queue_stall_seconds)
+      and merged chunks (stream_queue_merged_chunks_total)
+    - Closing the stream cancels the producer and closes the upstream stream (see streams.aclose_stream)
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from dotenv import load_dotenv
+import metrics
+from streams import aclose_stream
+
+POLICIES = ("block", "coalesce", "drop")
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+
+def _content_delta(chunk):
+    """The delta of a chunk that only carries content, or None if the chunk carries anything else."""
+    if len(chunk.choices) != 1 or getattr(chunk, "usage", None) is not None:
+        return None
+    choice = chunk.choices[0]
+    delta = choice.delta
+    if choice.finish_reason is not None or delta is None or delta.content is None or delta.tool_calls or delta.role:
+        return None
+    return delta
+
+
+class BoundedStream:
+    """
+    Async iterator over an upstream stream of completion chunks, through a bounded queue.
+
+    Args:
+        stream: The upstream async stream of ChatCompletionChunk.
+        capacity (int): Chunks buffered before the policy applies.
+        policy (str): One of POLICIES.
+        **labels: Metric labels, e.g. flow.
+    """
+
+    def __init__(self, stream, capacity=64, policy="block", **labels):
+        if policy not in POLICIES:
+            raise ValueError("Unknown slow consumer policy: " + str(policy))
+        self._stream = stream
+        self.capacity = max(1, capacity)
+        self.policy = policy
+        self._labels = dict(labels, policy=policy)
+        self._queue = deque()
+        self._held = [] # drop policy: chunks read after the queue overflowed, delivered at the end
+        self._overflowed = False
+        self._merged = None # the last merged chunk copy, which can be merged into in place
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._done = False
+        self._error = None
+        self._producer = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._producer is None:
+            self._producer = asyncio.create_task(self._produce())
+        while not self._queue:
+            if self._done:
+                if self._error is not None:
+                    error, self._error = self._error, None
+                    raise error
+                raise StopAsyncIteration
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        chunk = self._queue.popleft()
+        self._not_full.set()
+        return chunk
+
+    async def _produce(self):
+        try:
+            async for chunk in self._stream:
+                await self._put(chunk)
+        except Exception as e:
+            self._error = e # raised to the consumer after the queued chunks
+        finally:
+            self._queue.extend(self._held)
+            self._held = []
+            self._done = True
+            self._not_empty.set()
+
+    async def _put(self, chunk):
+        if self._overflowed:
+            self._append_merged(self._held, chunk)
+            return
+        if len(self._queue) >= self.capacity:
+            if self.policy == "coalesce" and self._merge(self._queue, chunk):
+                return
+            if self.policy == "drop":
+                self._overflowed = True
+                self._append_merged(self._held, chunk)
+                return
+            start = time.perf_counter()
+            while len(self._queue) >= self.capacity:
+                self._not_full.clear()
+                await self._not_full.wait()
+            metrics.observe("stream_queue_stall_seconds", time.perf_counter() - start, **self._labels)
+        self._queue.append(chunk)
+        metrics.observe("stream_queue_depth", len(self._queue), DEPTH_BUCKETS, **self._labels)
+        self._not_empty.set()
+
+    def _append_merged(self, chunks, chunk):
+        if not self._merge(chunks, chunk):
+            chunks.append(chunk)
+
+    def _merge(self, chunks, chunk):
+        """Merge a content delta into the last chunk of chunks, if both only carry content."""
+        delta = _content_delta(chunk)
+        if delta is None or not chunks or _content_delta(chunks[-1]) is None:
+            return False
+        last = chunks[-1]
+        if last.choices[0].index != chunk.choices[0].index:
+            return False
+        if last is not self._merged:
+            # Copy before merging: the upstream chunk may still be referenced (e.g. by a cassette recording)
+            last = chunks[-1] = self._merged = last.model_copy(deep=True)
+        last.choices[0].delta.content += delta.content
+        metrics.increment("stream_queue_merged_chunks_total", **self._labels)
+        return True
+
+    async def aclose(self):
+        """Stop reading: cancel the producer and close the upstream stream."""
+        if self._producer is not None and not self._producer.done():
+            self._producer.cancel()
+            await asyncio.gather(self._producer, return_exceptions=True)
+        self._done = True
+        self._queue.clear()
+        await aclose_stream(self._stream)
+
+
+class StreamQueue:
+    """
+    Settings of the queue put between a model stream and its consumer.
+
+    Args:
+        capacity (int): Chunks buffered before the policy applies.
+        policy (str): The slow consumer policy, one of POLICIES.
+    """
+
+    def __init__(self, capacity=64, policy="block"):
+        if policy not in POLICIES:
+            raise ValueError("Unknown slow consumer policy: " + str(policy))
+        self.capacity = capacity
+        self.policy = policy
+
+    @classmethod
+    def from_env(cls):
+        """Read STREAM_QUEUE_CAPACITY (default 64) and STREAM_QUEUE_POLICY (default block)."""
+        load_dotenv()
+        return cls(
+            capacity=int(os.getenv("STREAM_QUEUE_CAPACITY", "64") or 64),
+            policy=os.getenv("STREAM_QUEUE_POLICY", "block") or "block",
+        )
+
+    def wrap(self, stream, **labels):
+        return BoundedStream(stream, self.capacity, self.policy, **labels)
@@ -0,0 +1,63 @@
+"""
+    Benchmark of the slow consumer policies of the stream queue (see backpressure.py)
+    - A fast upstream (a synthetic completion stream, one token every --token-delay seconds) is read by a slow
+      consumer (--consumer-delay seconds per chunk, like the paced SSE stream of the chat server)
+    - For every policy, reports when the upstream was fully read (how long it was held up), when the consumer
+      got the last chunk, the chunks it received, and checks that no content was lost
+
+    Usage: python bench_backpressure.py [--tokens 400] [--capacity 32] [--token-delay 0.001] [--consumer-delay 0.01]
+"""
+import argparse
+import asyncio
+import time
+import metrics
+from backpressure import POLICIES, BoundedStream
+from openai.types.chat import ChatCompletionChunk
+
+
+async def upstream(tokens, token_delay, read):
+    for i in range(tokens):
+        await asyncio.sleep(token_delay)
+        yield ChatCompletionChunk(
+            id="chatcmpl-bench", model="bench", created=0, object="chat.completion.chunk",
+            choices=[{"index": 0, "delta": {"content": f"token{i} "}, "finish_reason": None}],
+        )
+    read["upstream_done"] = time.perf_counter()
+
+
+def stall_seconds(policy):
+    histogram = metrics._histograms.get(("stream_queue_stall_seconds", metrics._label_key({"flow": "bench", "policy": policy})))
+    return histogram.sum if histogram else 0.0
+
+
+async def run(policy, args):
+    read = {}
+    stream = BoundedStream(upstream(args.tokens, args.token_delay, read), args.capacity, policy, flow="bench")
+    start = time.perf_counter()
+    chunks, content = 0, ""
+    async for chunk in stream:
+        chunks += 1
+        content += chunk.choices[0].delta.content
+        await asyncio.sleep(args.consumer_delay)
+    end = time.perf_counter()
+    expected = "".join(f"token{i} " for i in range(args.tokens))
+    return read["upstream_done"] - start, end - start, chunks, content == expected
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the slow consumer policies of the stream queue")
+    parser.add_argument("--tokens", type=int, default=400)
+    parser.add_argument("--capacity", type=int, default=32)
+    parser.add_argument("--token-delay", type=float, default=0.001)
+    parser.add_argument("--consumer-delay", type=float, default=0.01)
+    args = parser.parse_args()
+
+    metrics.enable()
+    print(f"{args.tokens} tokens, queue capacity {args.capacity}")
+    print(f"  {'policy':<9} {'upstream read (s)':>18} {'consumer done (s)':>18} {'chunks':>7} {'stalls (s)':>11} {'content':>8}")
+    for policy in POLICIES:
+        upstream_read, consumer_done, chunks, intact = asyncio.run(run(policy, args))
+        print(
+            f"  {policy:<9} {upstream_read:>18.2f} {consumer_done:>18.2f} {chunks:>7} "
+            f"{stall_seconds(policy):>11.2f} {'ok' if intact else 'LOST':>8}"
+        )
@@ -0,0 +1,103 @@
+"""
+    Benchmark the chunk processing of the streaming examples by replaying a cassette
+    - Records a cassette of the load test conversations first if it does not exist (or with --record),
+      against the mock server by default or the backend configured in .env (--backend env)
+    - Replays it through send_chat_request (func_async_streaming_chat_server.py) and
+      get_tool_calls (func_get_weather_streaming.py) as fast as possible, so only our own code is measured
+
+    Usage: python bench_cassette_replay.py [--cassette path] [--record] [--backend mock|env] [--iterations 200]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import time
+import openai
+import cassettes
+import func_async_streaming_chat_server as chat_server
+import func_get_weather_streaming as weather_streaming
+from load_test import SCRIPTS
+from mock_server import MockChatServer
+
+DEFAULT_CASSETTE = "output/cassettes/load_test.jsonl.gz"
+
+
+async def run_scripts():
+    """Run every load test conversation through send_chat_request; returns the number of chunks consumed."""
+    chunks = 0
+    for script in SCRIPTS:
+        messages = chat_server.init_messages()
+        for prompt in script:
+            messages.append({"role": "user", "content": prompt})
+            content = ""
+            async for chunk in await chat_server.send_chat_request(messages):
+                chunks += 1
+                if chunk.choices and chunk.choices[0].delta is not None and chunk.choices[0].delta.content:
+                    content += chunk.choices[0].delta.content
+            if messages[-1].get("role") == "tool":
+                messages.append({"role": "assistant", "content": content})
+    return chunks
+
+
+async def record(path, backend):
+    if os.path.exists(path):
+        os.remove(path)
+    mock = None
+    client = chat_server.client
+    if backend == "mock":
+        mock = await MockChatServer(ttft=0.05, token_delay=0.002).start()
+        client = openai.AsyncOpenAI(base_url=mock.base_url, api_key="mock", max_retries=0)
+        chat_server.DEPLOYMENT_NAME = mock.model
+    chat_server.client = cassettes.RecordingClient(client, path)
+    try:
+        await run_scripts()
+    finally:
+        if mock is not None:
+            await client.close()
+            await mock.close()
+    print(f"Recorded {len(cassettes.load_cassette(path))} calls to {path} ({os.path.getsize(path)} bytes)")
+
+
+async def bench_send_chat_request(path, iterations):
+    replay = cassettes.AsyncReplayClient(path, strict=True)
+    chat_server.client = replay
+    chat_server.DEPLOYMENT_NAME = replay.interactions[0]["request"]["model"]
+    chunks = await run_scripts() # warm up
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await run_scripts()
+    elapsed = time.perf_counter() - start
+    turns = sum(len(script) for script in SCRIPTS) * iterations
+    print(
+        f"send_chat_request: {turns / elapsed:10.0f} turns/sec  "
+        f"{chunks * iterations / elapsed:10.0f} chunks/sec"
+    )
+
+
+def bench_get_tool_calls(path, iterations):
+    replay = cassettes.ReplayClient(path, strict=True)
+    requests = [i["request"] for i in replay.interactions if i["stream"] and i["request"].get("tools")]
+    weather_streaming.DEPLOYMENT_NAME = requests[0]["model"]
+    chunks = sum(len(replay.find(request)["chunks"]) for request in requests)
+    with contextlib.redirect_stdout(io.StringIO()): # get_tool_calls prints the streamed content
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for request in requests:
+                weather_streaming.get_tool_calls(replay.chat.completions.create(**request), request["tools"])
+        elapsed = time.perf_counter() - start
+    print(f"get_tool_calls:    {len(requests) * iterations / elapsed:10.0f} calls/sec  {chunks * iterations / elapsed:10.0f} chunks/sec")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the streaming examples by replaying a cassette")
+    parser.add_argument("--cassette", default=DEFAULT_CASSETTE)
+    parser.add_argument("--record", action="store_true", help="record the cassette even if it exists")
+    parser.add_argument("--backend", choices=["mock", "env"], default="mock", help="backend to record from")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.record or not os.path.exists(args.cassette):
+        asyncio.run(record(args.cassette, args.backend))
+    asyncio.run(bench_send_chat_request(args.cassette, args.iterations))
+    bench_get_tool_calls(args.cassette, args.iterations)
@@ -0,0 +1,54 @@
+"""
+    Prompt size and speed of search_conversation_history (see history_search.py) as the conversation history grows
+    - The bundled history (data/conversation_history.json) is repeated to N messages and written to a temporary file,
+      growing it in steps; at every step the file is read again but the index only adds the appended messages
+    - Reports the tokens of the tool output (TSV, as sent to the model) for the whole history versus the top-k
+      search results, the time to index the appended messages, and the search latency
+    - Tokens are counted with tiktoken when it is installed, otherwise estimated at ~4 characters per token
+
+    Usage: python bench_history_search.py [--sizes 18,1000,10000,100000] [-k 5]
+"""
+import argparse
+import os
+import tempfile
+import time
+import async_io
+from history_search import HistorySearch
+from tool_encoding import ToolOutputEncoder, count_tokens
+
+QUERIES = ["colleges for computer science", "GPA and grades", "study prep material"]
+
+
+def grow(history, size):
+    return [{**history[i % len(history)], "timestamp": f"message {i}"} for i in range(size)]
+
+
+def main(args):
+    history = async_io.read_json("data/conversation_history.json")
+    encoder = ToolOutputEncoder("tsv")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "history.json")
+        search = HistorySearch(path)
+        print(f"top {args.k} results of {len(QUERIES)} queries; tokens of the tool output")
+        print(f"  {'messages':>9} {'full history':>13} {'search':>7} {'read + index new (ms)':>22} {'search (ms)':>12}")
+        for size in args.sizes:
+            records = grow(history, size)
+            async_io.write_json(path, records)
+            start = time.perf_counter()
+            search.refresh()
+            indexed = time.perf_counter() - start
+            start = time.perf_counter()
+            results = [search.search(query, args.k) for query in QUERIES]
+            searched = (time.perf_counter() - start) / len(QUERIES)
+            search_tokens = sum(count_tokens(encoder.encode(result))[0] for result in results) / len(QUERIES)
+            print(
+                f"  {size:>9} {count_tokens(encoder.encode(records))[0]:>13} {search_tokens:>7.0f}"
+                f" {indexed * 1000:>22.1f} {searched * 1000:>12.2f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the conversation history search against sending the whole history")
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")], default=[18, 1000, 10000, 100000])
+    parser.add_argument("-k", type=int, default=5)
+    main(parser.parse_args())
@@ -0,0 +1,83 @@
+"""
+    Benchmark of the location lookup engine used by get_current_weather
+    - Builds indexes of 1k, 10k and 100k synthetic cities and measures
+      exact lookups, qualified lookups ("City, Country") and free-text matching of multi-city questions
+    - Compared against the previous approach: a chain of substring tests, one per known city
+
+    Usage: python bench_locations.py [--sizes 1000 10000 100000] [--iterations 20000]
+"""
+import argparse
+import random
+import time
+from locations import City, LocationIndex
+
+SYLLABLES = ["ka", "lo", "mi", "ra", "ton", "ville", "ber", "san", "port", "ia", "den", "mar", "no", "sta", "vik", "ford"]
+COUNTRIES = ["US", "FR", "JP", "DE", "BR", "IN", "CA", "AU"]
+
+
+def synthetic_cities(count, seed=0):
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < count:
+        words = [
+            "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+            for _ in range(rng.choice((1, 1, 1, 2)))
+        ]
+        names.add(" ".join(words))
+    return [
+        City(name, "", rng.choice(COUNTRIES), rng.randint(1_000, 10_000_000), str(rng.randint(-10, 40)))
+        for name in sorted(names)
+    ]
+
+
+def substring_lookup(cities):
+    """The previous approach: test every known city name against the location, in order."""
+    lowered = [(city.name.lower(), city) for city in cities]
+
+    def lookup(location):
+        location = location.lower()
+        for name, city in lowered:
+            if name in location:
+                return city
+        return None
+
+    return lookup
+
+
+def bench(function, queries, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        function(queries[i % len(queries)])
+    return (time.perf_counter() - start) / iterations * 1e6 # microseconds per call
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the location lookup engine")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--iterations", type=int, default=20_000)
+    args = parser.parse_args()
+
+    print(f"{'cities':>8} {'build (s)':>10} {'exact (us)':>11} {'qualified (us)':>15} {'free text (us)':>15} {'substring (us)':>15}")
+    for size in args.sizes:
+        cities = synthetic_cities(size)
+        start = time.perf_counter()
+        index = LocationIndex(cities)
+        build = time.perf_counter() - start
+
+        rng = random.Random(1)
+        sample = rng.sample(cities, 100)
+        exact = [city.name.lower() for city in sample]
+        qualified = [f"{city.name}, {city.country}" for city in sample]
+        questions = [
+            f"What's the weather like in {a.name}, {b.name} and {c.name} today?"
+            for a, b, c in zip(sample, sample[1:], sample[2:])
+        ]
+        # The substring chain is linear in the number of cities, so it gets fewer iterations
+        substring_iterations = max(10, args.iterations * 1_000 // size // 10)
+
+        print(
+            f"{size:>8} {build:>10.2f} {bench(index.lookup, exact, args.iterations):>11.2f} "
+            f"{bench(index.lookup, qualified, args.iterations):>15.2f} "
+            f"{bench(index.find_all, questions, args.iterations):>15.2f} "
+            f"{bench(substring_lookup(cities), exact, substring_iterations):>15.2f}"
+        )
@@ -0,0 +1,77 @@
+"""
+    First-turn latency of func_async_streaming_chat_server.py with and without prewarming (see prewarm.py)
+    - Every run is a fresh Python process, so the first turn pays for all the one-time setup
+    - Each process imports the flow, optionally runs the prewarm phase, then times its first and second turn
+      (a weather question: streamed completion, tool call, location lookup)
+    - Runs against the mock server by default (a local connection, no TLS), or the backend in .env (--backend env)
+
+    Usage: python bench_prewarm.py [--runs 5] [--backend mock|env]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from mock_server import MockChatServer
+
+QUESTION = "What's the weather like in Tokyo?"
+
+
+async def child(args):
+    import openai
+    import func_async_streaming_chat_server as chat_server
+    if args.base_url:
+        chat_server.client = openai.AsyncOpenAI(base_url=args.base_url, api_key="mock")
+        chat_server.DEPLOYMENT_NAME = "gpt-4o-mock"
+    chat_server.prewarm.enabled = args.prewarm
+
+    start = time.perf_counter()
+    await chat_server.prewarm.run(verbose=False)
+    prewarm_time = time.perf_counter() - start
+
+    turns = []
+    for _ in range(2):
+        messages = chat_server.init_messages()
+        messages.append({"role": "user", "content": QUESTION})
+        start = time.perf_counter()
+        async for _ in await chat_server.send_chat_request(messages):
+            pass
+        turns.append(time.perf_counter() - start)
+    print(json.dumps({"prewarm": prewarm_time, "first": turns[0], "second": turns[1]}))
+
+
+async def run_child(prewarm, base_url):
+    command = [sys.executable, __file__, "--child"] + (["--prewarm"] if prewarm else []) + (["--base-url", base_url] if base_url else [])
+    process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE)
+    stdout, _ = await process.communicate()
+    return json.loads(stdout.decode().strip().splitlines()[-1])
+
+
+async def main(args):
+    mock = None
+    base_url = None
+    if args.backend == "mock":
+        mock = await MockChatServer(ttft=0.05, token_delay=0.001).start()
+        base_url = mock.base_url
+
+    print(f"{args.runs} fresh processes each; median times in ms")
+    print(f"  {'prewarm':<8} {'prewarm phase':>14} {'first turn':>11} {'second turn':>12}")
+    for prewarm in (False, True):
+        results = [await run_child(prewarm, base_url) for _ in range(args.runs)]
+        median = {key: statistics.median(result[key] for result in results) * 1000 for key in results[0]}
+        print(f"  {'on' if prewarm else 'off':<8} {median['prewarm']:>14.1f} {median['first']:>11.1f} {median['second']:>12.1f}")
+
+    if mock is not None:
+        await mock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the first-turn latency with and without prewarming")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--backend", choices=["mock", "env"], default="mock")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--prewarm", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    asyncio.run(child(args) if args.child else main(args))
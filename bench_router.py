@@ -0,0 +1,159 @@
+"""
+    Benchmark of the multi-backend router (see router.py) with local stand-in servers (see mock_server.py)
+    - Three mock backends: "fast" (50 ms to first token), "slow" (400 ms) and "down" (answers every request with a 500)
+    - Sends the same streamed requests through the router and through a random pick of a backend (the baseline),
+      and reports the calls per backend, the errors seen by the caller and the time to first token
+    - Structured outputs through the router: beta.chat.completions.parse and stream (as in func_structured_outputs.py)
+      over "fast" and "down", checking that every call is parsed and the failed attempts are retried
+    - Then brings "down" back up and shows its circuit closing again after the cool down (half open probe)
+
+    Usage: python bench_router.py [--requests 100] [--concurrency 10] [--cooldown 1]
+"""
+import argparse
+import asyncio
+import random
+import time
+import openai
+from pydantic import BaseModel
+from mock_server import MockChatServer
+from router import AsyncRouterClient, Backend
+from load_test import percentile
+
+MESSAGES = [{"role": "user", "content": "Hello! What can you help me with?"}]
+
+
+class MenuItem(BaseModel):
+    category: str
+    item: str
+    price: str = None
+
+
+class Menu(BaseModel):
+    items: list[MenuItem]
+
+
+async def streamed_call(client, model):
+    """One streamed call; returns its time to first token, or None if it failed."""
+    start = time.perf_counter()
+    try:
+        stream = await client.chat.completions.create(model=model, messages=MESSAGES, stream=True)
+        ttft = None
+        async for _ in stream:
+            if ttft is None:
+                ttft = time.perf_counter() - start
+        return ttft
+    except openai.APIError:
+        return None
+
+
+async def parsed_call(client, model):
+    """One beta.chat.completions.parse call; returns the parsed menu, or None if it failed."""
+    try:
+        response = await client.beta.chat.completions.parse(model=model, messages=MESSAGES, response_format=Menu)
+        return response.choices[0].message.parsed
+    except openai.APIError:
+        return None
+
+
+async def streamed_parse_call(client, model):
+    """One beta.chat.completions.stream call; returns the final parsed menu, or None if it failed."""
+    try:
+        async with client.beta.chat.completions.stream(model=model, messages=MESSAGES, response_format=Menu) as stream:
+            async for _ in stream:
+                pass
+            return (await stream.get_final_completion()).choices[0].message.parsed
+    except openai.APIError:
+        return None
+
+
+async def run_calls(call, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited():
+        async with semaphore:
+            return await call()
+
+    return await asyncio.gather(*(limited() for _ in range(requests)))
+
+
+def report(name, results, counts):
+    ttfts = [ttft for ttft in results if ttft is not None]
+    print(
+        f"  {name:<8} {' '.join(f'{count:>5}' for count in counts)}   errors {len(results) - len(ttfts):>3}"
+        f"   ttft p50 {percentile(ttfts, 50) * 1000:>6.0f} ms  p95 {percentile(ttfts, 95) * 1000:>6.0f} ms"
+    )
+
+
+async def main(args):
+    servers = {
+        "fast": MockChatServer(ttft=0.05, token_delay=0.001),
+        "slow": MockChatServer(ttft=0.4, token_delay=0.001),
+        "down": MockChatServer(ttft=0.05, token_delay=0.001, error_rate=1.0),
+    }
+    for server in servers.values():
+        await server.start()
+
+    def clients():
+        return {name: openai.AsyncOpenAI(base_url=server.base_url, api_key="mock", max_retries=0) for name, server in servers.items()}
+
+    def requests_per_server():
+        return [server.requests for server in servers.values()]
+
+    print(f"{args.requests} streamed calls, {args.concurrency} at a time")
+    print(f"  {'':<8} {' '.join(f'{name:>5}' for name in servers)}")
+
+    # Baseline: a random backend per call
+    baseline_clients = clients()
+    rng = random.Random(0)
+    before = requests_per_server()
+    results = await run_calls(lambda: streamed_call(baseline_clients[rng.choice(list(servers))], "mock"), args.requests, args.concurrency)
+    report("random", results, [after - b for after, b in zip(requests_per_server(), before)])
+
+    # Router
+    router_client = AsyncRouterClient(
+        [Backend(name, client, "mock", cooldown=args.cooldown) for name, client in clients().items()], seed=0
+    )
+    before = requests_per_server()
+    results = await run_calls(lambda: streamed_call(router_client, "routed"), args.requests, args.concurrency)
+    report("router", results, [after - b for after, b in zip(requests_per_server(), before)])
+
+    print("\nBackend stats:")
+    for stats in router_client.stats():
+        print(f"  {stats}")
+
+    # Structured outputs: parse and stream are routed too; a call sent to "down" is retried on "fast"
+    structured_client = AsyncRouterClient(
+        [Backend(name, clients()[name], "mock", cooldown=args.cooldown) for name in ("fast", "down")], seed=0
+    )
+    print(f"\nStructured outputs through the router (fast and down):")
+    for name, call in [("parse", parsed_call), ("stream", streamed_parse_call)]:
+        before = requests_per_server()
+        results = await run_calls(lambda: call(structured_client, "routed"), args.requests // 5, args.concurrency)
+        counts = [after - b for after, b in zip(requests_per_server(), before)]
+        parsed = sum(isinstance(result, Menu) for result in results)
+        print(f"  {name:<8} {' '.join(f'{count:>5}' for count in counts)}   parsed {parsed}/{len(results)}")
+    await structured_client.close()
+
+    # Recovery: "down" comes back, its circuit closes after the cool down
+    servers["down"].error_rate = 0.0
+    await asyncio.sleep(args.cooldown)
+    before = requests_per_server()
+    results = await run_calls(lambda: streamed_call(router_client, "routed"), args.requests, args.concurrency)
+    print(f"\nAfter \"down\" recovered:")
+    report("router", results, [after - b for after, b in zip(requests_per_server(), before)])
+    for stats in router_client.stats():
+        print(f"  {stats}")
+
+    await router_client.close()
+    for client in baseline_clients.values():
+        await client.close()
+    for server in servers.values():
+        await server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the multi-backend router against local mock servers")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--cooldown", type=float, default=1.0, help="seconds before an open circuit lets a probe through")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,57 @@
+"""
+    Benchmark of singleflight coalescing (see singleflight.py) against the mock server (see mock_server.py)
+    - N sessions send the same first turn at the same time, streamed and complete, with and without coalescing
+    - Reports the upstream calls the mock server received, the calls saved, the wall time,
+      and checks that every session got the same answer
+
+    Usage: python bench_singleflight.py [--sessions 50]
+"""
+import argparse
+import asyncio
+import time
+import openai
+from mock_server import MockChatServer
+from singleflight import CoalescingClient
+
+MESSAGES = [
+    {"role": "system", "content": "You are a helpful assistant."},
+    {"role": "user", "content": "Hello! What can you help me with?"},
+]
+
+
+async def session(client, model, stream):
+    if not stream:
+        response = await client.chat.completions.create(model=model, messages=MESSAGES, temperature=0)
+        return response.choices[0].message.content
+    response = await client.chat.completions.create(model=model, messages=MESSAGES, temperature=0, stream=True)
+    content = ""
+    async for chunk in response:
+        if chunk.choices and chunk.choices[0].delta.content:
+            content += chunk.choices[0].delta.content
+    return content
+
+
+async def main(args):
+    async with MockChatServer(ttft=0.2, token_delay=0.01) as mock:
+        print(f"{args.sessions} sessions sending the same first turn")
+        print(f"  {'mode':<9} {'coalescing':<11} {'upstream calls':>15} {'saved':>6} {'wall (s)':>9} {'same answer':>12}")
+        for stream in (True, False):
+            for coalesce in (False, True):
+                base = openai.AsyncOpenAI(base_url=mock.base_url, api_key="mock", max_retries=0)
+                client = CoalescingClient(base) if coalesce else base
+                before = mock.requests
+                start = time.perf_counter()
+                answers = await asyncio.gather(*(session(client, mock.model, stream) for _ in range(args.sessions)))
+                elapsed = time.perf_counter() - start
+                saved = client.calls_saved if coalesce else 0
+                print(
+                    f"  {'streamed' if stream else 'complete':<9} {'on' if coalesce else 'off':<11} "
+                    f"{mock.requests - before:>15} {saved:>6} {elapsed:>9.2f} {'yes' if len(set(answers)) == 1 else 'NO':>12}"
+                )
+                await base.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark singleflight coalescing of identical requests")
+    parser.add_argument("--sessions", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
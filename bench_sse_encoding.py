@@ -0,0 +1,66 @@
+import json
+import time
+from openai.types.chat import ChatCompletionChunk
+from func_async_streaming_chat_server import format_stream_response
+from sse_encoding import JSON_BACKEND, SSEStreamEncoder, get_json_dumps
+
+"""
+    Benchmark: SSE frame encoding
+    - Compares format_stream_response + json.dumps against the precomputed envelope encoder
+    - Reports chunks/sec for each path over a synthetic stream of content deltas
+"""
+
+NUM_CHUNKS = 200_000
+
+
+def make_chunks(n):
+    words = "The current weather in Tokyo is 10 degrees Celsius with light rain .".split()
+    return [
+        ChatCompletionChunk.model_validate(
+            {
+                "id": "chatcmpl-bench",
+                "model": "gpt-4o",
+                "created": 1700000000,
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": {"content": words[i % len(words)] + " "}, "finish_reason": None}],
+            }
+        )
+        for i in range(n)
+    ]
+
+
+def bench_format_stream_response(chunks):
+    start = time.perf_counter()
+    for chunk in chunks:
+        payload = format_stream_response(chunk)
+        frame = ("data: " + json.dumps(payload) + "\n\n").encode("utf-8")
+    return time.perf_counter() - start
+
+
+def bench_encoder(chunks, backend=None):
+    encoder = SSEStreamEncoder(dumps=get_json_dumps(backend))
+    start = time.perf_counter()
+    for chunk in chunks:
+        frame = encoder.encode(chunk)
+    return time.perf_counter() - start
+
+
+def report(name, elapsed, baseline=None):
+    line = f"{name:<40} {NUM_CHUNKS / elapsed:>14,.0f} chunks/sec"
+    if baseline:
+        line += f"   ({baseline / elapsed:.2f}x)"
+    print(line)
+
+
+if __name__ == "__main__":
+    chunks = make_chunks(NUM_CHUNKS)
+
+    # Sanity check: both paths must produce the same payload
+    sample = chunks[0]
+    assert json.loads(SSEStreamEncoder().encode(sample)[len(b"data: "):]) == format_stream_response(sample)
+
+    baseline = bench_format_stream_response(chunks)
+    report("format_stream_response + json.dumps", baseline)
+    report("SSEStreamEncoder (json)", bench_encoder(chunks, "json"), baseline)
+    if JSON_BACKEND == "orjson":
+        report("SSEStreamEncoder (orjson)", bench_encoder(chunks, "orjson"), baseline)
@@ -0,0 +1,56 @@
+"""
+    Microbenchmark of the timezone index used by get_current_time
+    - Lookups/sec for zone names, city names, aliases, "City, Country" and prefixes
+    - Compared against the previous approach: pytz.timezone(location) and datetime.now(timezone) on every call
+
+    Usage: python bench_timezones.py [--iterations 200000]
+"""
+import argparse
+import time
+from datetime import datetime
+import pytz
+from timezones import TimezoneIndex
+
+QUERIES = {
+    "zone names": ["America/New_York", "Asia/Bangkok", "Europe/London", "Asia/Tokyo"],
+    "city names": ["new york", "Bangkok", "LONDON", "Tokyo"],
+    "aliases": ["San Francisco", "nyc", "Mumbai", "Beijing"],
+    "city, country": ["Paris, France", "Tokyo, Japan", "Berlin, Germany", "Sydney, Australia"],
+    "prefixes": ["bangk", "johannesb", "reykj", "honol"],
+}
+
+
+def bench(function, queries, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        function(queries[i % len(queries)])
+    return iterations / (time.perf_counter() - start)
+
+
+def pytz_current_time(location):
+    return datetime.now(pytz.timezone(location)).strftime("%I:%M:%S %p")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the timezone index")
+    parser.add_argument("--iterations", type=int, default=200_000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = TimezoneIndex()
+    print(f"Index: {len(index.zones)} names, built in {(time.perf_counter() - start) * 1000:.1f} ms\n")
+
+    print(f"{'resolve':<16} {'lookups/sec':>12}")
+    for name, queries in QUERIES.items():
+        print(f"{name:<16} {bench(index.resolve, queries, args.iterations):12.0f}")
+
+    print(f"\n{'current time':<16} {'calls/sec':>12}")
+    zones = QUERIES["zone names"]
+    baseline = bench(pytz_current_time, zones, args.iterations)
+    indexed = bench(lambda location: index.now(location).strftime("%I:%M:%S %p"), zones, args.iterations)
+    print(f"{'pytz per call':<16} {baseline:12.0f}")
+    print(f"{'index':<16} {indexed:12.0f}  ({indexed / baseline:.1f}x)")
+
+    locations = [location for queries in QUERIES.values() for location in queries]
+    batches = bench(lambda _: index.now_many(locations), [None], args.iterations // len(locations))
+    print(f"{'index, batch':<16} {batches * len(locations):12.0f}  ({len(locations)} locations per call)")
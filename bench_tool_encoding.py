@@ -0,0 +1,55 @@
+"""
+    Token savings of the tool output encoders on the bundled data files
+    - Stock data (data/stock_data.csv): one index as get_stock_market_data returns it, and the whole file
+    - Conversation history (data/conversation_history.json) as get_conversation_history returns it
+    - Compared against the previous encodings: DataFrame.to_dict JSON and json.dumps of the records
+    - Tokens are counted with tiktoken when it is installed, otherwise estimated at ~4 characters per token
+
+    Usage: python bench_tool_encoding.py [--model gpt-4o]
+"""
+import argparse
+import json
+import pandas as pd
+from tool_encoding import ToolOutputEncoder, count_tokens, to_records
+
+ENCODERS = {
+    "json": ToolOutputEncoder("json"),
+    "records": ToolOutputEncoder("records"),
+    "csv": ToolOutputEncoder("csv"),
+    "tsv": ToolOutputEncoder("tsv"),
+    "csv, 2 digits": ToolOutputEncoder("csv", digits=2),
+    "tsv, user+message": ToolOutputEncoder("tsv", columns=["user", "message"]),
+}
+
+
+def datasets():
+    stock_data = pd.read_csv("./data/stock_data.csv")
+    sp500 = stock_data[stock_data["Index"] == "S&P 500"].drop(columns=["Index"])
+    with open("data/conversation_history.json", "r") as file:
+        history = json.load(file)
+    return [
+        ("stock data, S&P 500", sp500, json.dumps(sp500.to_dict())),
+        ("stock data, all indices", stock_data, json.dumps(stock_data.to_dict())),
+        ("conversation history", history, json.dumps(history)),
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the token savings of the tool output encoders")
+    parser.add_argument("--model", default="gpt-4o")
+    args = parser.parse_args()
+
+    exact = True
+    for name, data, baseline in datasets():
+        baseline_tokens, exact = count_tokens(baseline, args.model)
+        print(f"\n{name}")
+        print(f"  {'encoding':<20} {'chars':>7} {'tokens':>7} {'saved':>7}")
+        print(f"  {'previous (JSON)':<20} {len(baseline):>7} {baseline_tokens:>7} {'':>7}")
+        for encoding, encoder in ENCODERS.items():
+            if encoder.columns and not set(encoder.columns) <= set(to_records(data)[1]):
+                continue # the column selection is specific to another dataset
+            encoded = encoder.encode(data)
+            tokens, _ = count_tokens(encoded, args.model)
+            print(f"  {encoding:<20} {len(encoded):>7} {tokens:>7} {1 - tokens / baseline_tokens:>7.0%}")
+    if not exact:
+        print("\nTokens are estimated (~4 characters per token); install tiktoken for exact counts.")
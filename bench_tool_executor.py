@@ -0,0 +1,78 @@
+"""
+    Benchmark of the tool executor (see tool_executor.py)
+    - Runs a batch of concurrent CPU-bound tool calls (a rolling statistics pass over synthetic stock prices)
+      inline, in threads and in processes, while measuring the event loop lag a chat server would see
+    - Then shows a slow I/O-bound tool hitting its timeout, and its bulkhead rejecting calls it cannot serve in time
+
+    Usage: python bench_tool_executor.py [--calls 8] [--rows 200000]
+"""
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+import pandas as pd
+from tool_executor import ToolExecutor, ToolSpec
+
+
+def stock_statistics(rows, seed):
+    """A CPU-bound tool: rolling statistics over a synthetic price series."""
+    rng = np.random.default_rng(seed)
+    prices = pd.Series(100 + rng.standard_normal(rows).cumsum())
+    total = 0.0
+    for window in (5, 20, 50, 200):
+        total += prices.rolling(window).std().mean()
+    return json.dumps({"rows": rows, "volatility": round(total, 4)})
+
+
+def slow_lookup(seconds):
+    """An I/O-bound tool that takes too long."""
+    time.sleep(seconds)
+    return json.dumps({"slept": seconds})
+
+
+async def measure_lag(stop, interval=0.005):
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def run_batch(executor, calls, rows):
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(measure_lag(stop))
+    await asyncio.sleep(0.02) # let the monitor start
+    start = time.perf_counter()
+    await asyncio.gather(*(executor.run("stock_statistics", stock_statistics, {"rows": rows, "seed": i}) for i in range(calls)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    return elapsed, await monitor
+
+
+async def main(args):
+    print(f"{args.calls} concurrent stock_statistics calls, {args.rows} rows each")
+    print(f"  {'kind':<8} {'wall (s)':>9} {'worst loop lag (ms)':>20}")
+    for kind in ("inline", "thread", "process"):
+        executor = ToolExecutor({"stock_statistics": ToolSpec(kind)})
+        await executor.run("stock_statistics", stock_statistics, {"rows": 1000, "seed": 0}) # start the pool
+        elapsed, lag = await run_batch(executor, args.calls, args.rows)
+        executor.shutdown()
+        print(f"  {kind:<8} {elapsed:>9.2f} {lag * 1000:>20.1f}")
+
+    print("\nslow_lookup: thread, timeout 0.2 s, at most 2 concurrent calls; 4 calls sleeping 1 s")
+    executor = ToolExecutor({"slow_lookup": ToolSpec("thread", timeout=0.2, max_concurrency=2)})
+    start = time.perf_counter()
+    results = await asyncio.gather(*(executor.run("slow_lookup", slow_lookup, {"seconds": 1}) for _ in range(4)))
+    print(f"  returned after {time.perf_counter() - start:.2f} s")
+    for result in results:
+        print("  " + result)
+    executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the tool executor")
+    parser.add_argument("--calls", type=int, default=8)
+    parser.add_argument("--rows", type=int, default=200_000)
+    asyncio.run(main(parser.parse_args()))
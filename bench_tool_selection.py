@@ -0,0 +1,127 @@
+"""
+    Tokens saved by per-request tool selection (see tool_selection.py)
+    - The catalog is the tools of func_sequential_calls.py (read from its source, without running the example),
+      grown with stand-in tools of a typical assistant up to --tools tools
+    - For scripted questions, each with the tool(s) it needs, reports the tokens of the tool schemas sent with and
+      without selection, how often the needed tools were kept (recall) and how often it fell back to the full set
+    - Also replays a sequence (stock data, then the calculator) to show recently called tools being kept
+
+    Usage: python bench_tool_selection.py [-k 3] [--tools 5,20,40]
+"""
+import argparse
+import ast
+from tool_selection import ToolSelector
+
+QUESTIONS = [
+    ("How much did S&P 500 change between July 12 and July 13? Use the calculator.", {"get_stock_market_data"}),
+    ("What time is it in Tokyo right now?", {"get_current_time"}),
+    ("What is the current time in Paris, London and New York?", {"get_current_times"}),
+    ("What is 1234 * 5678?", {"calculator"}),
+    ("Compute the percentage change (close - open) / open * 100 for these prices", {"batch_calculator"}),
+    ("Show me the NASDAQ Composite data", {"get_stock_market_data"}),
+    ("Send an email to my manager saying I'll be late", {"send_email"}),
+    ("What's the weather forecast for Seattle this weekend?", {"get_weather_forecast"}),
+    ("Translate 'good morning' into Spanish", {"translate_text"}),
+    ("Book a meeting room for tomorrow at 10am", {"book_meeting_room"}),
+]
+
+# (name, description, {parameter: description})
+STAND_IN_TOOLS = [
+    ("send_email", "Send an email message to one or more recipients", {"to": "Email addresses of the recipients", "subject": "The subject line", "body": "The message text"}),
+    ("get_weather_forecast", "Get the weather forecast for a city for the next days", {"city": "The city name", "days": "Number of days to forecast"}),
+    ("translate_text", "Translate text into another language", {"text": "The text to translate", "language": "The target language, e.g. Spanish"}),
+    ("book_meeting_room", "Book a meeting room for a date and time", {"room": "The room name", "start": "Start date and time", "duration": "Duration in minutes"}),
+    ("search_web", "Search the web and return the top results with their links", {"query": "The search query"}),
+    ("create_calendar_event", "Create an event in the user's calendar", {"title": "The event title", "start": "Start date and time", "attendees": "Email addresses of the attendees"}),
+    ("list_calendar_events", "List the events of the user's calendar between two dates", {"start": "First date", "end": "Last date"}),
+    ("get_exchange_rate", "Get the exchange rate between two currencies", {"base": "Currency code, e.g. USD", "quote": "Currency code, e.g. EUR"}),
+    ("convert_units", "Convert a quantity between units of length, weight, volume or temperature", {"value": "The quantity", "from_unit": "The unit of the value", "to_unit": "The unit to convert to"}),
+    ("get_news_headlines", "Get the latest news headlines on a topic", {"topic": "The news topic"}),
+    ("create_reminder", "Create a reminder that notifies the user at a given time", {"text": "What to remind", "at": "Date and time of the reminder"}),
+    ("search_documents", "Full-text search over the user's documents and files", {"query": "Words to search for"}),
+    ("summarize_document", "Summarize a document from the user's files", {"document_id": "The document to summarize"}),
+    ("get_flight_status", "Get the status, gate and delay of a flight", {"flight_number": "Airline code and number, e.g. UA 100"}),
+    ("find_restaurants", "Find restaurants near a location, by cuisine and price", {"location": "Address or neighborhood", "cuisine": "Type of food"}),
+    ("get_directions", "Get driving, transit or walking directions between two places", {"origin": "Start address", "destination": "Destination address", "mode": "driving, transit or walking"}),
+    ("create_support_ticket", "Open a support ticket for an IT problem", {"title": "Short summary", "description": "What happened"}),
+    ("get_order_status", "Get the shipping status of an order", {"order_id": "The order number"}),
+    ("lookup_employee", "Look up a colleague's contact details, team and manager", {"name": "The employee name"}),
+    ("get_account_balance", "Get the balance of one of the user's bank accounts", {"account": "Checking or savings"}),
+    ("transfer_money", "Transfer money between the user's bank accounts", {"from_account": "Source account", "to_account": "Destination account", "amount": "Amount to transfer"}),
+    ("play_music", "Play a song, album, artist or playlist", {"query": "What to play"}),
+    ("set_timer", "Start a countdown timer", {"minutes": "Duration of the timer in minutes"}),
+    ("get_definition", "Get the dictionary definition of a word", {"word": "The word to define"}),
+    ("generate_image", "Generate an image from a text prompt", {"prompt": "Description of the image"}),
+    ("run_sql_query", "Run a read-only SQL query on the analytics database", {"sql": "The SELECT statement"}),
+    ("get_traffic", "Get the current traffic conditions on a route", {"route": "Road or highway name"}),
+    ("create_task", "Add a task to the user's to-do list", {"title": "The task", "due": "Due date"}),
+    ("get_holidays", "List the public holidays of a country in a year", {"country": "The country", "year": "The year"}),
+    ("check_spelling", "Check and correct the spelling and grammar of a text", {"text": "The text to check"}),
+    ("get_sports_scores", "Get the latest scores of a team or league", {"team": "Team or league name"}),
+    ("find_nearby_places", "Find places such as pharmacies, gas stations or ATMs near a location", {"location": "Address", "kind": "Kind of place"}),
+    ("get_air_quality", "Get the air quality index of a city", {"city": "The city name"}),
+    ("share_file", "Share a file with other people", {"file": "The file name", "with": "Email addresses to share with"}),
+    ("get_package_tracking", "Track a parcel with its carrier tracking number", {"tracking_number": "The carrier tracking number"}),
+]
+
+
+def example_tools():
+    """The tools returned by get_tools() in func_sequential_calls.py, read from its source."""
+    with open("func_sequential_calls.py", "r") as file:
+        tree = ast.parse(file.read())
+    get_tools = next(node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name == "get_tools")
+    return ast.literal_eval(get_tools.body[-1].value)
+
+
+def stand_in_tool(name, description, parameters):
+    return {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": description,
+            "parameters": {
+                "type": "object",
+                "properties": {parameter: {"type": "string", "description": text} for parameter, text in parameters.items()},
+                "required": list(parameters),
+            },
+        },
+    }
+
+
+def main(args):
+    tools = example_tools() + [stand_in_tool(*tool) for tool in STAND_IN_TOOLS]
+    print(f"{len(QUESTIONS)} questions, top {args.k} tools per request")
+    print(f"  {'tools':>6} {'all (tokens)':>13} {'selected':>9} {'saved':>6} {'recall':>7} {'fallbacks':>10}")
+    for size in args.tools:
+        catalog = tools[:size]
+        names = {tool["function"]["name"] for tool in catalog}
+        selector = ToolSelector(k=args.k)
+        found = needed = 0
+        for question, expected in QUESTIONS:
+            if not expected <= names:
+                continue
+            selected = selector.select(catalog, [{"role": "user", "content": question}])
+            needed += 1
+            found += expected <= {tool["function"]["name"] for tool in selected}
+        saved = selector.full_tokens - selector.selected_tokens
+        print(
+            f"  {size:>6} {selector.full_tokens:>13} {selector.selected_tokens:>9} {saved / selector.full_tokens:>6.0%}"
+            f" {found / needed:>7.0%} {selector.fallbacks:>10}"
+        )
+
+    # A sequence: after get_stock_market_data, the follow-up request still offers it and the calculators
+    selector = ToolSelector(k=args.k)
+    messages = [
+        {"role": "user", "content": QUESTIONS[0][0]},
+        {"role": "assistant", "content": None, "function_call": {"name": "get_stock_market_data", "arguments": "{}"}},
+        {"role": "function", "name": "get_stock_market_data", "content": "Date,Open,High,Low,Close"},
+    ]
+    selected = [tool["function"]["name"] for tool in selector.select(tools, messages)]
+    print(f"\nFollow-up request after get_stock_market_data, {len(tools)} tools: {', '.join(selected)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the tokens saved by per-request tool selection")
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--tools", type=lambda value: [int(size) for size in value.split(",")], default=[5, 20, 40])
+    main(parser.parse_args())
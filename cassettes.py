@@ -0,0 +1,353 @@
+"""
+    Record / replay cassettes of chat completion calls
+    - RecordingClient wraps a client and appends every request with its response (or streamed chunks and their
+      timing) to a cassette: a gzip compressed JSON lines file, one interaction per line
+    - ReplayClient / AsyncReplayClient serve a cassette through the same chat.completions.create interface,
+      so the examples (get_tool_calls, send_chat_request, ...) run offline and deterministically
+    - Replay runs as fast as possible by default, or at the recorded timing scaled by `speed`
+
+    Configuration (environment variables, also read from .env), see from_env:
+        CASSETTE_MODE=record|replay   Record the calls of an example, or replay them instead of calling the API
+        CASSETTE_FILE=path            The cassette file (default output/cassettes/cassette.jsonl.gz)
+        CASSETTE_SPEED=x              Replay at x times the recorded speed; 0 replays as fast as possible (default)
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import openai
+from dotenv import load_dotenv
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+DEFAULT_CASSETTE_FILE = "output/cassettes/cassette.jsonl.gz"
+
+
+class CassetteMissError(LookupError):
+    """Raised in strict replay when a request was not recorded in the cassette."""
+
+
+def _to_json(obj):
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(mode="json", exclude_unset=True)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def request_key(request):
+    """Stable hash of a request's parameters, used to match a replayed request to its recording."""
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), default=_to_json)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def load_cassette(path):
+    """
+    Load the interactions of a cassette.
+
+    Returns:
+        list: One dict per recorded call with the keys key, request, stream, and either
+            chunks ([[seconds since the request, chunk], ...]) or response and latency.
+    """
+    interactions = []
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                interactions.append(json.loads(line))
+    return interactions
+
+
+class _CassetteWriter:
+    """Appends interactions to a cassette; every interaction is its own gzip member, so the file stays readable."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, interaction):
+        line = json.dumps(interaction, separators=(",", ":"), default=_to_json) + "\n"
+        with self._lock, gzip.open(self.path, "at", encoding="utf-8") as file:
+            file.write(line)
+
+
+"""
+    Recording
+"""
+class _RecordingStream:
+    """Passes the chunks of a stream through and records them; written once the stream ends or is closed."""
+
+    def __init__(self, stream, writer, interaction, start):
+        self._stream = stream
+        self._writer = writer
+        self._interaction = interaction
+        self._start = start
+        self._saved = False
+
+    def _record(self, chunk):
+        self._interaction["chunks"].append(
+            [round(time.perf_counter() - self._start, 6), chunk.model_dump(mode="json", exclude_unset=True)]
+        )
+
+    def _save(self, complete):
+        if not self._saved:
+            self._saved = True
+            self._interaction["complete"] = complete
+            self._writer.write(self._interaction)
+
+    def __iter__(self):
+        for chunk in self._stream:
+            self._record(chunk)
+            yield chunk
+        self._save(complete=True)
+
+    def close(self):
+        self._save(complete=False)
+        self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class _AsyncRecordingStream(_RecordingStream):
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._record(chunk)
+            yield chunk
+        self._save(complete=True)
+
+    async def close(self):
+        self._save(complete=False)
+        await self._stream.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+class _RecordingCompletions:
+    def __init__(self, completions, writer, asynchronous):
+        self._completions = completions
+        self._writer = writer
+        self._asynchronous = asynchronous
+
+    def create(self, **kwargs):
+        if self._asynchronous:
+            return self._create_async(**kwargs)
+        start = time.perf_counter()
+        return self._wrap(self._completions.create(**kwargs), kwargs, start)
+
+    async def _create_async(self, **kwargs):
+        start = time.perf_counter()
+        return self._wrap(await self._completions.create(**kwargs), kwargs, start)
+
+    def _wrap(self, result, request, start):
+        # Snapshot the request now, the caller keeps appending to its messages list
+        request = json.loads(json.dumps(request, default=_to_json))
+        interaction = {"key": request_key(request), "request": request, "stream": bool(request.get("stream"))}
+        if not interaction["stream"]:
+            interaction["latency"] = round(time.perf_counter() - start, 6)
+            interaction["response"] = result.model_dump(mode="json", exclude_unset=True)
+            self._writer.write(interaction)
+            return result
+        interaction["chunks"] = []
+        stream_class = _AsyncRecordingStream if self._asynchronous else _RecordingStream
+        return stream_class(result, self._writer, interaction, start)
+
+
+class _Namespace:
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+class RecordingClient:
+    """
+    Wraps a (sync or async) OpenAI client and records its chat completion calls to a cassette.
+
+    Args:
+        client: The client to record.
+        path (str): The cassette file; interactions are appended.
+    """
+
+    def __init__(self, client, path=DEFAULT_CASSETTE_FILE):
+        self.client = client
+        self.path = path
+        # AsyncOpenAI includes AsyncAzureOpenAI; stand-in clients such as AsyncRouterClient declare it
+        asynchronous = isinstance(client, openai.AsyncOpenAI) or getattr(client, "asynchronous", False)
+        completions = _RecordingCompletions(client.chat.completions, _CassetteWriter(path), asynchronous)
+        self.chat = _Namespace(completions=completions)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+"""
+    Replay
+"""
+class ReplayStream:
+    """A recorded stream; iterate it like the client's stream."""
+
+    def __init__(self, chunks, speed=None):
+        self._chunks = chunks
+        self._speed = speed
+        self._closed = False
+
+    def _delay(self, offset, start):
+        return offset / self._speed - (time.perf_counter() - start)
+
+    def __iter__(self):
+        start = time.perf_counter()
+        for offset, chunk in self._chunks:
+            if self._closed:
+                return
+            if self._speed:
+                delay = self._delay(offset, start)
+                if delay > 0:
+                    time.sleep(delay)
+            yield chunk
+
+    def close(self):
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class AsyncReplayStream(ReplayStream):
+    async def __aiter__(self):
+        start = time.perf_counter()
+        for offset, chunk in self._chunks:
+            if self._closed:
+                return
+            if self._speed:
+                delay = self._delay(offset, start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield chunk
+
+    async def close(self):
+        self._closed = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+class _ReplayCompletions:
+    def __init__(self, replay):
+        self._replay = replay
+
+    def create(self, **kwargs):
+        return self._replay._create(kwargs)
+
+
+class ReplayClient:
+    """
+    Serves the chat completion calls recorded in a cassette.
+
+    Requests are matched to recordings by their parameters; identical requests cycle through their recordings.
+    A request that was not recorded gets the next recording in order, or raises CassetteMissError when strict.
+
+    Args:
+        path (str): The cassette file.
+        speed (float, optional): Replay at this multiple of the recorded timing; None or 0 replays as fast as possible.
+        strict (bool): Raise CassetteMissError for requests that were not recorded.
+    """
+
+    stream_class = ReplayStream
+
+    def __init__(self, path=DEFAULT_CASSETTE_FILE, speed=None, strict=False):
+        self.path = path
+        self.speed = speed or None
+        self.strict = strict
+        self.interactions = load_cassette(path)
+        self.hits = 0
+        self.misses = 0
+        self._by_key = {}
+        self._plays = {}
+        self._next = 0
+        for interaction in self.interactions:
+            # Validate once up front, so a replay costs no more than iterating the recorded objects
+            if interaction["stream"]:
+                interaction["chunks"] = [
+                    (offset, ChatCompletionChunk.model_validate(chunk)) for offset, chunk in interaction["chunks"]
+                ]
+            else:
+                interaction["response"] = ChatCompletion.model_validate(interaction["response"])
+            self._by_key.setdefault(interaction["key"], []).append(interaction)
+        self.chat = _Namespace(completions=_ReplayCompletions(self))
+
+    def find(self, request):
+        """Return the recorded interaction to replay for the request."""
+        key = request_key(request)
+        recordings = self._by_key.get(key)
+        if recordings:
+            self.hits += 1
+            plays = self._plays.get(key, 0)
+            self._plays[key] = plays + 1
+            return recordings[plays % len(recordings)]
+        self.misses += 1
+        if self.strict or not self.interactions:
+            raise CassetteMissError(f"No recording in {self.path} for request {key}")
+        interaction = self.interactions[self._next % len(self.interactions)]
+        self._next += 1
+        return interaction
+
+    def _create(self, request):
+        interaction = self.find(request)
+        if interaction["stream"]:
+            return self.stream_class(interaction["chunks"], self.speed)
+        if self.speed:
+            time.sleep(interaction["latency"] / self.speed)
+        return interaction["response"]
+
+
+class AsyncReplayClient(ReplayClient):
+    """Async version of ReplayClient, a stand-in for openai.AsyncOpenAI."""
+
+    stream_class = AsyncReplayStream
+
+    async def _create_async(self, request):
+        interaction = self.find(request)
+        if interaction["stream"]:
+            return self.stream_class(interaction["chunks"], self.speed)
+        if self.speed:
+            await asyncio.sleep(interaction["latency"] / self.speed)
+        return interaction["response"]
+
+    def _create(self, request):
+        return self._create_async(request)
+
+
+def from_env(client, asynchronous=False):
+    """
+    Wrap the client of an example according to CASSETTE_MODE.
+
+    Args:
+        client: The client configured by the example (may be None when replaying without API settings).
+        asynchronous (bool): Whether the example uses the async client, to pick the replay client.
+
+    Returns:
+        The client unchanged, a RecordingClient, or a (Async)ReplayClient.
+    """
+    load_dotenv()
+    mode = os.getenv("CASSETTE_MODE", "").lower()
+    path = os.getenv("CASSETTE_FILE") or DEFAULT_CASSETTE_FILE
+    if mode == "record":
+        return RecordingClient(client, path)
+    if mode == "replay":
+        replay_class = AsyncReplayClient if asynchronous else ReplayClient
+        return replay_class(path, speed=float(os.getenv("CASSETTE_SPEED") or 0))
+    return client
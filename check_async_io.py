@@ -0,0 +1,104 @@
+"""
+    Self-check of the JSON file I/O of async_io.py
+    - Writes and reads back a large conversation history (by default 200k records, tens of MB) while a task measures
+      the event loop lag, once with plain json.dump / json.load called on the loop and once with
+      write_json_async / read_json_async, and the history search of the async chat example (search_async, which
+      indexes the file the first time it is searched)
+    - Checks that the async calls keep the worst loop lag under --max-lag, that the data round-trips unchanged,
+      and that a write that fails part-way leaves the previous file in place and no temporary file behind
+
+    Usage: python check_async_io.py [--records 200000] [--max-lag 50]
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import async_io
+from history_search import HistorySearch
+
+
+def make_history(records):
+    return [
+        {
+            "user": "User" if i % 2 == 0 else "Assistant",
+            "message": f"Message {i}: what is the weather like in Tokyo, and should I bring an umbrella tomorrow?",
+            "timestamp": f"2024-06-{1 + i % 28:02d}T{i % 24:02d}:{i % 60:02d}:00Z",
+        }
+        for i in range(records)
+    ]
+
+
+async def measure_lag(stop, interval=0.001):
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def with_lag(operation):
+    """Run operation() while measuring the event loop lag; returns (result, seconds, worst lag)."""
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(measure_lag(stop))
+    await asyncio.sleep(0.01) # let the monitor start
+    start = time.perf_counter()
+    result = await operation()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    return result, elapsed, await monitor
+
+
+async def blocking_write(path, data):
+    with open(path, "w") as file:
+        json.dump(data, file, indent=4)
+
+
+async def blocking_read(path):
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+async def main(args):
+    history = make_history(args.records)
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "history.json")
+        print(f"{args.records} records")
+        print(f"  {'operation':<22} {'seconds':>8} {'worst loop lag (ms)':>20}")
+        results = {}
+        for name, operation in [
+            ("blocking write", lambda: blocking_write(path, history)),
+            ("blocking read", lambda: blocking_read(path)),
+            ("write_json_async", lambda: async_io.write_json_async(path, history, indent=4)),
+            ("read_json_async", lambda: async_io.read_json_async(path)),
+            ("search_async", lambda: HistorySearch(path).search_async("umbrella in Tokyo")),
+        ]:
+            results[name], elapsed, lag = await with_lag(operation)
+            print(f"  {name:<22} {elapsed:>8.2f} {lag * 1000:>20.1f}")
+            if name.endswith("async") and lag * 1000 > args.max_lag:
+                print(f"FAIL {name}: worst loop lag over {args.max_lag} ms")
+                failures += 1
+        print(f"  file size {os.path.getsize(path) / 1e6:.1f} MB")
+
+        checks = {"round trip": results["read_json_async"] == history}
+        # A write that fails part-way (an object json cannot encode at the end) must leave the previous file untouched
+        try:
+            await async_io.write_json_async(path, history[:10] + [object()], indent=4)
+        except TypeError:
+            pass
+        checks["failed write keeps the previous file"] = async_io.read_json(path) == history
+        checks["no temporary file left"] = os.listdir(directory) == ["history.json"]
+        for check, ok in checks.items():
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {check}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that async_io keeps the event loop responsive on large files")
+    parser.add_argument("--records", type=int, default=200_000)
+    parser.add_argument("--max-lag", type=float, default=50.0, help="worst acceptable loop lag in ms")
+    raise SystemExit(1 if asyncio.run(main(parser.parse_args())) else 0)
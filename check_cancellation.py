@@ -0,0 +1,133 @@
+"""
+    Self-check of the cancellation propagation of func_async_streaming_chat_server.py
+    - Drives stream_chat_request_sse against the mock server (see mock_server.py) and simulates a client
+      that disconnects at different points of a turn:
+        during the initial model stream    the consuming task is cancelled while the answer streams in
+        during a tool call                  the consuming task is cancelled while a slow tool runs
+        during the follow-up stream         the client stops reading and closes the generator
+    - After each disconnect, checks that the tool was cancelled, the mock server saw its stream aborted,
+      no HTTP connection is left busy in the client's pool, and no asyncio task was leaked
+
+    Usage: python check_cancellation.py
+"""
+import asyncio
+import openai
+import func_async_streaming_chat_server as chat_server
+from mock_server import MockChatServer
+from tool_executor import ToolExecutor, ToolSpec
+
+
+class SlowWeatherTool:
+    """A get_current_weather that takes `delay` seconds and records whether it was cancelled."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.started = asyncio.Event()
+        self.cancelled = False
+
+    async def __call__(self, location, unit="fahrenheit"):
+        self.started.set()
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return chat_server.get_current_weather(location, unit)
+
+
+def busy_connections(client):
+    """HTTP connections of the client's pool that are neither idle nor closed (None if the pool is not reachable)."""
+    pool = getattr(getattr(getattr(client, "_client", None), "_transport", None), "_pool", None)
+    if pool is None:
+        return None
+    return sum(1 for connection in pool.connections if not connection.is_idle() and not connection.is_closed())
+
+
+def leaked_tasks(mock):
+    return {task for task in asyncio.all_tasks() if task is not asyncio.current_task() and task not in mock._connections}
+
+
+async def read_frames(messages, frames):
+    """Consume the SSE stream of a turn, appending every frame to frames."""
+    async_generator = await chat_server.stream_chat_request_sse(messages)
+    try:
+        async for frame in async_generator:
+            frames.append(frame)
+    finally:
+        await async_generator.aclose()
+
+
+async def disconnect_during_initial_stream(mock):
+    messages = chat_server.init_messages()
+    messages.append({"role": "user", "content": "Tell me a long story " + "and then some more " * 20})
+    consumer = asyncio.create_task(read_frames(messages, []))
+    await asyncio.sleep(mock.ttft + 10 * mock.token_delay) # the initial answer is streaming in
+    consumer.cancel()
+    await asyncio.gather(consumer, return_exceptions=True)
+    return None
+
+
+async def disconnect_during_tool_call(mock):
+    tool = SlowWeatherTool(delay=30)
+    chat_server.get_available_functions = lambda: {"get_current_weather": tool}
+    messages = chat_server.init_messages()
+    messages.append({"role": "user", "content": "What's the weather like in Tokyo?"})
+    consumer = asyncio.create_task(read_frames(messages, []))
+    await asyncio.wait_for(tool.started.wait(), 10)
+    consumer.cancel()
+    await asyncio.gather(consumer, return_exceptions=True)
+    return tool.cancelled
+
+
+async def disconnect_during_followup_stream(mock):
+    # A plain (not direct return) tool, so the answer is streamed by a follow-up completion
+    chat_server.get_available_functions = lambda: {"get_current_weather": chat_server.get_current_weather}
+    messages = chat_server.init_messages()
+    messages.append({"role": "user", "content": "What's the weather like in Tokyo, Paris and San Francisco?"})
+    async_generator = await chat_server.stream_chat_request_sse(messages)
+    await anext(async_generator) # the first frame of the follow-up answer
+    await async_generator.aclose() # the client stops reading
+    return None
+
+
+SCENARIOS = [
+    ("disconnect during the initial stream", disconnect_during_initial_stream, True),
+    ("disconnect during a tool call", disconnect_during_tool_call, False),
+    ("disconnect during the follow-up stream", disconnect_during_followup_stream, True),
+]
+
+
+async def main():
+    get_available_functions = chat_server.get_available_functions
+    # The tools of the scenarios are async; run the real tool inline
+    chat_server.tool_executor = ToolExecutor({"get_current_weather": ToolSpec("async")}, default_spec=ToolSpec("inline"))
+    failures = 0
+    async with MockChatServer(ttft=0.05, token_delay=0.05) as mock:
+        chat_server.DEPLOYMENT_NAME = mock.model
+        for name, scenario, aborts_stream in SCENARIOS:
+            chat_server.client = client = openai.AsyncOpenAI(base_url=mock.base_url, api_key="mock", max_retries=0)
+            chat_server.get_available_functions = get_available_functions
+            if scenario is disconnect_during_followup_stream:
+                chat_server.tool_executor.specs = {}
+            aborted_before = mock.aborted_streams
+
+            tool_cancelled = await scenario(mock)
+            await asyncio.sleep(3 * mock.token_delay) # let the mock server notice the disconnect
+
+            checks = {
+                "stream aborted upstream": not aborts_stream or mock.aborted_streams > aborted_before,
+                "no open upstream stream": mock.open_streams == 0,
+                "no busy pooled connection": busy_connections(client) in (0, None),
+                "no leaked task": not leaked_tasks(mock),
+            }
+            if tool_cancelled is not None:
+                checks["tool cancelled"] = tool_cancelled
+            failed = [check for check, ok in checks.items() if not ok]
+            failures += bool(failed)
+            print(f"{'FAIL' if failed else 'ok  '} {name}" + (": " + ", ".join(failed) if failed else ""))
+            await client.close()
+    return failures
+
+
+if __name__ == "__main__":
+    raise SystemExit(1 if asyncio.run(main()) else 0)
@@ -1,12 +1,24 @@
 import os
 import json
 import asyncio
+import functools
 import openai
 from typing import Any, Tuple
 from typing import Tuple
 from dotenv import load_dotenv
+import metrics
+from profiling import TurnProfiler
+from usage import STREAM_OPTIONS, ledger
+from streaming_json import ToolArgumentsError, ToolCallAccumulator
+from streams import aclose_stream
+from locations import get_index as get_location_index
+from router import ROUTED_MODEL, AsyncRouterClient
+from tool_executor import ToolExecutor, ToolSpec
+from history_search import HistorySearch
+from tool_encoding import ToolOutputEncoder
+from prewarm import Prewarm, warm_client
 
-# Setup the OpenAI client to use either Azure, OpenAI or Ollama API
+# Setup the OpenAI client to use either Azure, OpenAI or Ollama API, or to route across several of them
 load_dotenv()
 API_HOST = os.getenv("API_HOST")
 
@@ -26,22 +38,41 @@ elif API_HOST == "ollama":
         api_key="nokeyneeded",
     )
     DEPLOYMENT_NAME = os.getenv("OLLAMA_MODEL")
+elif API_HOST == "router": # several backends, see router.py
+    client = AsyncRouterClient.from_env()
+    DEPLOYMENT_NAME = ROUTED_MODEL
+
+FLOW = "async_streaming_chat" # label for the metrics recorded by this example
+profiler = TurnProfiler.from_env() # profiles selected turns, see profiling.py
+
+# How each tool is executed: the weather lookup loads its dataset on first use, so it runs in a thread,
+# with a timeout and at most 8 concurrent calls; the history search is a coroutine that reads the history file
+# in a worker thread (see async_io.py); see tool_executor.py
+TOOL_SPECS = {
+    "get_current_weather": ToolSpec("thread", timeout=5, max_concurrency=8),
+    "search_conversation_history": ToolSpec("async", timeout=5),
+}
+tool_executor = ToolExecutor(TOOL_SPECS)
 
 # Example function hard coded to return the same weather
 # In production, this could be your backend API or an external API
 def get_current_weather(location, unit="fahrenheit"):
     """Get the current weather in a given location"""
-    if "tokyo" in location.lower():
-        return json.dumps({"location": "Tokyo", "temperature": "10", "unit": unit})
-    elif "san francisco" in location.lower():
-        return json.dumps(
-            {"location": "San Francisco", "temperature": "72", "unit": unit}
-        )
-    elif "paris" in location.lower():
-        return json.dumps({"location": "Paris", "temperature": "22", "unit": unit})
-    else:
+    # Look up the city in the local dataset (data/cities.csv), see locations.py
+    city = get_location_index().lookup(location)
+    if city is None:
         return json.dumps({"location": location, "temperature": "unknown"})
+    return json.dumps({"location": city.name, "temperature": city.temperature, "unit": unit})
 
+# Search over a demo conversation history (see history_search.py); the results are sent as TSV (see tool_encoding.py)
+history_search = HistorySearch("data/conversation_history.json")
+history_encoder = ToolOutputEncoder("tsv")
+
+async def search_conversation_history(query, k=5):
+    """Search the conversation history for the messages relevant to a query"""
+    return history_encoder.encode(await history_search.search_async(query, k))
+
+@functools.lru_cache(maxsize=None) # built once and reused by every request
 def get_tools():
     return [
         {
@@ -68,11 +99,29 @@ def get_tools():
                     "required": ["location"],
                 },
             },
-        }
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "search_conversation_history",
+                "description": "Returns the messages of the conversation history most relevant to a query, best first.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "query": {"type": "string", "description": "The topic to search for, e.g. colleges for computer science"},
+                        "k": {"type": "integer", "description": "The number of messages to return, 5 by default"},
+                    },
+                    "required": ["query"],
+                },
+            },
+        },
     ]
 
 def get_available_functions():
-    return { "get_current_weather": get_current_weather }
+    return {
+        "get_current_weather": get_current_weather,
+        "search_conversation_history": search_conversation_history,
+    }
 
 def init_messages():
     return [
@@ -81,6 +130,7 @@ def init_messages():
             "content": """
                 You are a helpful assistant.
                 You have access to a function that can get the current weather in a given location.
+                You can also search the user's earlier conversation history when they ask about a past discussion.
                 Determine a reasonable Unit of Measurement (Celsius or Fahrenheit) for the temperature based on the location.
             """
         }
@@ -108,44 +158,57 @@ async def chat(messages) -> Tuple[Any, bool]:
     user_input = get_user_input()
     if not user_input:
         return False
+    if profiler.handle_command(user_input):
+        return True
+    if user_input == "/usage":
+        print(ledger.report())
+        return True
     messages.append({"role": "user", "content": user_input})
 
+    async with profiler.turn(), metrics.span("turn", flow=FLOW), ledger.turn(profiler.session_id):
+        return await respond(messages)
+
+async def respond(messages) -> bool:
     # Step 1: send the conversation and available functions to the model
+    timer = metrics.stream_timer("completion", flow=FLOW, call="initial")
+    metrics.increment("round_trips_total", flow=FLOW)
     stream_response = await client.chat.completions.create(
         model=DEPLOYMENT_NAME,
         messages=messages,
         tools=get_tools(),
         tool_choice="auto",  # auto is default, but we'll be explicit
         temperature=0,  # Adjust the variance by changing the temperature value (default is 0.8)
-        stream=True
+        stream=True,
+        stream_options=STREAM_OPTIONS, # the last chunk carries the token usage
     )
 
     print("Assistant:> ", end="")
     
-    tool_calls = [] # Accumulator for tool calls to process later
+    accumulator = ToolCallAccumulator(get_tools()) # Accumulator for tool calls to process later; validated while streaming
     full_delta_content = "" # Accumulator for the full assistant's content
 
-    async for chunk in stream_response:
-        delta = chunk.choices[0].delta if chunk.choices and chunk.choices[0].delta is not None else None
-
-        if delta and delta.content:
-            full_delta_content += delta.content
-            await asyncio.sleep(0.1)
-            print(delta.content, end="", flush=True)
-            
-        elif delta and delta.tool_calls:
-            tc_chunk_list = delta.tool_calls
-            for tc_chunk in tc_chunk_list:
-                if len(tool_calls) <= tc_chunk.index:
-                    tool_calls.append({"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
-                tc = tool_calls[tc_chunk.index]
-
-                if tc_chunk.id:
-                    tc["id"] += tc_chunk.id
-                if tc_chunk.function.name:
-                    tc["function"]["name"] += tc_chunk.function.name
-                if tc_chunk.function.arguments:
-                    tc["function"]["arguments"] += tc_chunk.function.arguments
+    try:
+        async for chunk in stream_response:
+            timer.observe_chunk(chunk)
+            ledger.record_chunk(chunk, FLOW, "initial", DEPLOYMENT_NAME)
+            delta = chunk.choices[0].delta if chunk.choices and chunk.choices[0].delta is not None else None
+
+            if delta and delta.content:
+                full_delta_content += delta.content
+                await asyncio.sleep(0.1)
+                print(delta.content, end="", flush=True)
+
+            elif delta and delta.tool_calls:
+                accumulator.add(delta.tool_calls)
+        timer.finish()
+        tool_calls = accumulator.finish()
+    except ToolArgumentsError as e:
+        await aclose_stream(stream_response) # stop paying for the rest of the generation
+        error = "Invalid tool call arguments: " + str(e)
+        print(error)
+        # Record the turn's reply (what was printed, and the rejected call) so the next turn still alternates
+        messages.append({ "role": "assistant", "content": (full_delta_content + "\n" + error).lstrip() })
+        return True
 
 
     # Step 2: check if the model wanted to call a function
@@ -163,7 +226,8 @@ async def chat(messages) -> Tuple[Any, bool]:
             # Step 3: call the function with arguments if any
             function_to_call = available_functions[function_name]
             function_args = json.loads(tool_call['function']['arguments'])
-            function_response = function_to_call(**function_args)
+            async with metrics.span("tool", flow=FLOW, tool=function_name):
+                function_response = await tool_executor.run(function_name, function_to_call, function_args)
 
             # Step 4: send the info for each function call and function response to the model
             messages.append(
@@ -175,11 +239,14 @@ async def chat(messages) -> Tuple[Any, bool]:
                 }
             )  # extend conversation with function response
 
+        timer2 = metrics.stream_timer("completion", flow=FLOW, call="followup")
+        metrics.increment("round_trips_total", flow=FLOW)
         stream_response2 = await client.chat.completions.create(
             model=DEPLOYMENT_NAME,
             messages=messages,
             temperature=0,  # Adjust the variance by changing the temperature value (default is 0.8)
             stream=True,
+            stream_options=STREAM_OPTIONS,
         )
 
         async def print_stream_chunks(stream):
@@ -188,7 +255,7 @@ async def chat(messages) -> Tuple[Any, bool]:
                     print(chunk.choices[0].delta.content, end="", flush=True)
                     await asyncio.sleep(0.1)
 
-        await print_stream_chunks(stream_response2)
+        await print_stream_chunks(metrics.time_async_stream(ledger.track_async_stream(stream_response2, FLOW, "followup", DEPLOYMENT_NAME), timer2))
 
         print("")
         return True
@@ -200,7 +267,14 @@ async def chat(messages) -> Tuple[Any, bool]:
 # Initialize the messages
 messages = init_messages()
 
+# With PREWARM=1, connect to the backend and load the tool data before the first prompt, see prewarm.py
+prewarm = Prewarm.from_env()
+prewarm.add("connection", lambda: warm_client(client))
+prewarm.add("locations", get_location_index)
+prewarm.add("tool schemas", get_tools)
+
 async def main() -> None:
+    await prewarm.run()
 
     chatting = True
     while chatting:
@@ -1,19 +1,37 @@
 import os
 import json
 import asyncio
+import functools
 import openai
 from typing import Any, Tuple
 from dotenv import load_dotenv
+import metrics
+import cassettes
+import singleflight
+from profiling import TurnProfiler
+from usage import STREAM_OPTIONS, ledger
+from streaming_json import ToolArgumentsError, ToolCallAccumulator
+from sse_encoding import SSE_DONE_FRAME, SSEStreamEncoder, decode_sse_frame
+from utils import direct_return, direct_return_chunk, is_direct_return, render_direct_return
+from locations import get_index as get_location_index
+from router import ROUTED_MODEL, AsyncRouterClient
+from backpressure import StreamQueue
+from tool_executor import ToolExecutor, ToolSpec, is_tool_error
+from prewarm import Prewarm, warm_client
+from streams import aclose_stream
 
 """
     Initialize the client
-    - Setup the client to use either Azure, OpenAI or Ollama API
+    - Setup the client to use either Azure, OpenAI or Ollama API, or to route across several of them (see router.py)
     - Uses the Async client to handle asynchronous requests
     - Uses the environment variables
 """
 load_dotenv()
 API_HOST = os.getenv("API_HOST")
 
+client = None
+DEPLOYMENT_NAME = None
+
 if API_HOST == "azure":
     client = openai.AsyncAzureOpenAI(
         azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
@@ -30,6 +48,31 @@ elif API_HOST == "ollama":
         api_key="nokeyneeded",
     )
     DEPLOYMENT_NAME = os.getenv("OLLAMA_MODEL")
+elif API_HOST == "router": # several backends, see router.py
+    client = AsyncRouterClient.from_env()
+    DEPLOYMENT_NAME = ROUTED_MODEL
+
+client = cassettes.from_env(client, asynchronous=True) # optionally record or replay the calls, see cassettes.py
+client = singleflight.from_env(client) # optionally share identical in-flight calls across sessions, see singleflight.py
+
+FLOW = "async_streaming_chat_server" # label for the metrics recorded by this example
+profiler = TurnProfiler.from_env() # profiles selected turns, see profiling.py
+
+"""
+    Tool execution
+    - Tools run according to their ToolSpec (see tool_executor.py), so a slow tool never blocks the server's event loop
+    - get_current_weather runs in a thread, with a 5 second timeout and at most 8 concurrent calls;
+      a timeout is returned to the model as a structured error instead of hanging the turn
+"""
+TOOL_SPECS = {"get_current_weather": ToolSpec("thread", timeout=5, max_concurrency=8)}
+tool_executor = ToolExecutor(TOOL_SPECS)
+
+"""
+    Stream queue
+    - A bounded queue between the model stream and the client, so a slow client does not stall the upstream read
+    - Its capacity and slow client policy (block, coalesce or drop) are set in .env, see backpressure.py
+"""
+stream_queue = StreamQueue.from_env()
 
 """
     Get the current weather
@@ -38,16 +81,11 @@ elif API_HOST == "ollama":
 """
 def get_current_weather(location, unit="fahrenheit"):
     """Get the current weather in a given location"""
-    if "tokyo" in location.lower():
-        return json.dumps({"location": "Tokyo", "temperature": "10", "unit": unit})
-    elif "san francisco" in location.lower():
-        return json.dumps(
-            {"location": "San Francisco", "temperature": "72", "unit": unit}
-        )
-    elif "paris" in location.lower():
-        return json.dumps({"location": "Paris", "temperature": "22", "unit": unit})
-    else:
+    # Look up the city in the local dataset (data/cities.csv), see locations.py
+    city = get_location_index().lookup(location)
+    if city is None:
         return json.dumps({"location": location, "temperature": "unknown"})
+    return json.dumps({"location": city.name, "temperature": city.temperature, "unit": unit})
 
 """
     Initialize messages
@@ -70,7 +108,9 @@ def init_messages():
     Get tools
     - Returns the tools available to the model. 
     - In this case, it's a single function to get the current weather
+    - Built once and reused by every request
 """
+@functools.lru_cache(maxsize=None)
 def get_tools():
     return [
         {
@@ -100,12 +140,25 @@ def get_tools():
         }
     ]
 
+"""
+    Format the weather
+    - Renders the output of get_current_weather as the final answer of a turn
+"""
+def format_weather(output, args):
+    weather = json.loads(output)
+    if weather["temperature"] == "unknown":
+        return f"Sorry, I don't have the current weather for {weather['location']}."
+    unit = "°F" if weather["unit"] == "fahrenheit" else "°C"
+    return f"The current temperature in {weather['location']} is {weather['temperature']}{unit}."
+
 """
     Get available functions
     - This function returns a dictionary of available functions
+    - The weather is the final answer, so get_current_weather is registered in direct return mode:
+      its output is rendered with format_weather, without a second completion
 """
 def get_available_functions():
-    return { "get_current_weather": get_current_weather }
+    return { "get_current_weather": direct_return(get_current_weather, format_weather) }
 
 """
     Get user input
@@ -133,10 +186,15 @@ def get_user_input() -> str:
     - Handle asynchronous responses
     - Handle streaming responses
     - Handle tool calls
+    - Validate tool arguments while streaming; raises ToolArgumentsError as soon as they can no longer be valid
+    - If the request is cancelled (e.g. the client disconnected), the running tool is cancelled
+      and the upstream stream is closed, releasing its connection
 """
 async def send_chat_request(messages):
     
     # Step 1: send the conversation and available functions to the model
+    timer1 = metrics.stream_timer("completion", flow=FLOW, call="initial")
+    metrics.increment("round_trips_total", flow=FLOW)
     stream_response1 = await client.chat.completions.create(
         model=DEPLOYMENT_NAME,
         messages=messages,
@@ -145,35 +203,32 @@ async def send_chat_request(messages):
         temperature=0.1,
         top_p=0.95,
         max_tokens=4096,
-        stream=True
+        stream=True,
+        stream_options=STREAM_OPTIONS, # the last chunk carries the token usage
     )
 
-    # Convert the stream response to a list
-    stream_response1_list = [item async for item in stream_response1]
-    
-    tool_calls = [] # Accumulator for tool calls to process later; 
+    stream_response1_list = [] # Buffered chunks to replay if the model answered directly
+    accumulator = ToolCallAccumulator(get_tools()) # Accumulator for tool calls to process later; validated while streaming
     full_delta_content = "" # Accumulator for delta content to process later
 
     # Process the stream response for tool calls and delta content
-    for chunk in stream_response1_list:
-        delta = chunk.choices[0].delta if chunk.choices and chunk.choices[0].delta is not None else None
-
-        if delta and delta.content:
-            full_delta_content += delta.content
-            
-        elif delta and delta.tool_calls:
-            tc_chunk_list = delta.tool_calls
-            for tc_chunk in tc_chunk_list:
-                if len(tool_calls) <= tc_chunk.index:
-                    tool_calls.append({"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
-                tc = tool_calls[tc_chunk.index]
-
-                if tc_chunk.id:
-                    tc["id"] += tc_chunk.id
-                if tc_chunk.function.name:
-                    tc["function"]["name"] += tc_chunk.function.name
-                if tc_chunk.function.arguments:
-                    tc["function"]["arguments"] += tc_chunk.function.arguments
+    try:
+        async for chunk in stream_response1:
+            stream_response1_list.append(chunk)
+            timer1.observe_chunk(chunk)
+            ledger.record_chunk(chunk, FLOW, "initial", DEPLOYMENT_NAME, singleflight.is_shared(stream_response1))
+            delta = chunk.choices[0].delta if chunk.choices and chunk.choices[0].delta is not None else None
+
+            if delta and delta.content:
+                full_delta_content += delta.content
+
+            elif delta and delta.tool_calls:
+                accumulator.add(delta.tool_calls)
+        timer1.finish()
+        tool_calls = accumulator.finish()
+    except (ToolArgumentsError, asyncio.CancelledError):
+        await aclose_stream(stream_response1) # stop paying for the rest of the generation
+        raise
 
     # Step 2: check if the model wanted to call a function
     if not tool_calls and full_delta_content:
@@ -191,6 +246,7 @@ async def send_chat_request(messages):
         
         # Map of function names to the actual functions
         available_functions = get_available_functions() 
+        tool_results = [] # (function, output, args) for each tool call, to render a direct return
 
         for tool_call in tool_calls:
 
@@ -202,7 +258,9 @@ async def send_chat_request(messages):
             # Step 3: call the function with arguments if any
             function_to_call = available_functions[function_name]
             function_args = json.loads(tool_call['function']['arguments'])
-            function_response = function_to_call(**function_args)
+            async with metrics.span("tool", flow=FLOW, tool=function_name):
+                function_response = await tool_executor.run(function_name, function_to_call, function_args)
+            tool_results.append((function_to_call, function_response, function_args))
 
             # Step 4: send the info for each function call and function response to the model
             messages.append(
@@ -214,6 +272,20 @@ async def send_chat_request(messages):
                 }
             )  # extend conversation with function response
 
+        # Direct return: when every tool's output is the final answer, render it instead of a second completion
+        # (tool errors, e.g. timeouts, are left to the model to explain)
+        if all(is_direct_return(function) and not is_tool_error(output) for function, output, _ in tool_results):
+            metrics.increment("direct_returns_total", flow=FLOW)
+            content = render_direct_return(tool_results)
+            messages.append({ "role": "assistant", "content": content })
+
+            async def direct_return_stream():
+                yield direct_return_chunk(content, DEPLOYMENT_NAME)
+
+            return direct_return_stream()
+
+        timer2 = metrics.stream_timer("completion", flow=FLOW, call="followup")
+        metrics.increment("round_trips_total", flow=FLOW)
         stream_response2 = await client.chat.completions.create(
             model=DEPLOYMENT_NAME,
             messages=messages,
@@ -221,8 +293,9 @@ async def send_chat_request(messages):
             top_p=0.95,
             max_tokens=4096,
             stream=True,
+            stream_options=STREAM_OPTIONS,
         )
-        return stream_response2
+        return metrics.time_async_stream(ledger.track_async_stream(stream_response2, FLOW, "followup", DEPLOYMENT_NAME), timer2)
 
 """
     Format the response for the stream
@@ -268,16 +341,45 @@ def format_stream_response(chatCompletionChunk):
 
 """
     Stream the chat request
-    - Sends the chat request to the model and waits for the response
-    - Returns an async generator to stream the response
+    - Returns an async generator that sends the chat request to the model and streams the response
+    - The request is only sent when the generator is first iterated, so a client that never reads sends nothing
+    - Disconnects propagate upstream: cancelling the consuming task cancels the running tool or model call,
+      and closing the generator closes the model stream, releasing its connection
+    - The model stream is read through the stream queue, so the pacing below does not hold up the upstream read
 """
 async def stream_chat_request(messages):
-    response = await send_chat_request(messages)
-    
+
+    async def generate():
+        response = stream_queue.wrap(await send_chat_request(messages), flow=FLOW)
+        try:
+            async for completionChunk in response:
+                await asyncio.sleep(0.1) # smooth out the stream
+                yield format_stream_response(completionChunk)
+        finally:
+            await aclose_stream(response)
+
+    return generate()
+
+"""
+    Stream the chat request as Server-Sent Events
+    - Same as stream_chat_request, but yields ready-to-send SSE frames (bytes) instead of dicts
+    - The stream envelope (id, model, created, object) is serialized once per stream
+    - Chunks without content are skipped and the stream ends with a [DONE] frame
+"""
+async def stream_chat_request_sse(messages):
+    encoder = SSEStreamEncoder()
+
     async def generate():
-        async for completionChunk in response:
-            await asyncio.sleep(0.1) # smooth out the stream
-            yield format_stream_response(completionChunk)
+        response = stream_queue.wrap(await send_chat_request(messages), flow=FLOW)
+        try:
+            async for completionChunk in response:
+                frame = encoder.encode(completionChunk)
+                if frame:
+                    await asyncio.sleep(0.1) # smooth out the stream
+                    yield frame
+        finally:
+            await aclose_stream(response)
+        yield SSE_DONE_FRAME
 
     return generate()
 
@@ -288,10 +390,31 @@ async def stream_chat_request(messages):
     - In this example, we simply print the response to the console instead as this is a standalone script
 """
 async def process_chat_response(async_generator):
-    async for result in async_generator:
-        content = result.get('choices', [{}])[0].get('messages', [{}])[0].get('content')
-        if content:
-            print(content, end="")
+    try:
+        async for result in async_generator:
+            content = result.get('choices', [{}])[0].get('messages', [{}])[0].get('content')
+            if content:
+                print(content, end="")
+    finally:
+        await async_generator.aclose()
+    print()
+
+"""
+    Process the SSE chat response
+    - The client side counterpart of stream_chat_request_sse
+    - Decodes each SSE frame and prints the assistant content
+"""
+async def process_sse_response(async_generator):
+    try:
+        async for frame in async_generator:
+            result = decode_sse_frame(frame)
+            if result is None:
+                break
+            message = result["choices"][0]["messages"][0]
+            if message["role"] == "assistant":
+                print(message["content"], end="")
+    finally:
+        await async_generator.aclose()
     print()
 
 
@@ -306,21 +429,41 @@ async def chat(messages) -> Tuple[Any, bool]:
     user_input = get_user_input()
     if not user_input:
         return False
+    if profiler.handle_command(user_input):
+        return True
+    if user_input == "/usage":
+        print(ledger.report())
+        return True
     messages.append({"role": "user", "content": user_input})
 
-    # Send the chat request
-    async_generator = await stream_chat_request(messages)
-    
-    # Assistant's response
-    print("Assistant:> ", end="")
-    await process_chat_response(async_generator) # Process the chat response
+    async with profiler.turn(), metrics.span("turn", flow=FLOW), ledger.turn(profiler.session_id):
+        # Send the chat request; it is sent when the response is first read
+        async_generator = await stream_chat_request_sse(messages)
+
+        # Assistant's response
+        print("Assistant:> ", end="")
+        try:
+            await process_sse_response(async_generator) # Process the chat response
+        except ToolArgumentsError as e:
+            print("Invalid tool call arguments: " + str(e))
 
     return True
 
 # Initialize the messages
 messages = init_messages()
 
+"""
+    Prewarm
+    - With PREWARM=1, main() opens the connection to the backend, loads the location index and builds
+      the tool schemas in parallel before the first prompt, instead of during the first turn (see prewarm.py)
+"""
+prewarm = Prewarm.from_env()
+prewarm.add("connection", lambda: warm_client(client))
+prewarm.add("locations", get_location_index)
+prewarm.add("tool schemas", get_tools)
+
 async def main() -> None:
+    await prewarm.run()
 
     chatting = True
     while chatting:
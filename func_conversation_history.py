@@ -2,11 +2,21 @@ import os
 import json
 import openai
 from dotenv import load_dotenv
+import async_io
+import metrics
+from history_search import HistorySearch
+import singleflight
+from pagination import Paginator
+from tool_encoding import ToolOutputEncoder
+from usage import ledger
 
 # Setup the OpenAI client to use either Azure, OpenAI or Ollama API
 load_dotenv()
 API_HOST = os.getenv("API_HOST")
 
+client = None
+DEPLOYMENT_NAME = None
+
 if API_HOST == "azure":
     client = openai.AzureOpenAI(
         azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
@@ -24,6 +34,12 @@ elif API_HOST == "ollama":
     )
     DEPLOYMENT_NAME = os.getenv("OLLAMA_MODEL")
 
+client = singleflight.from_env(client) # optionally share identical in-flight calls across sessions, see singleflight.py
+
+FLOW = "conversation_history" # label for the metrics recorded by this example
+
+HISTORY_FILE = "data/conversation_history.json"
+
 # Example function hard coded to return the expected response from a db call
 # In production, this could be your backend API or an external API
 def get_conversation_history():
@@ -31,9 +47,8 @@ def get_conversation_history():
     # Assume the conversation history is retrieved from a data source such as CosmosDB or a storage account
     # Possibly all parameters for user id from the user input, api/query requirements, etc. could be passed here.
     # In this example, we'll use a demo conversation history JSON
-    with open("data/conversation_history.json", "r") as file:
-        conversation_history = json.load(file)
-    return json.dumps(conversation_history)
+    conversation_history = async_io.read_json(HISTORY_FILE)
+    return conversation_history # encoded for the model with the tool's output encoder
 
 def summarize_conversation_history():
     """Summarize the conversation history"""
@@ -46,8 +61,30 @@ def generate_prompt_suggestions():
     # Possibly all parameters for user id from the user input, api/query requirements, etc. could be passed here.
     return get_conversation_history()
 
+# Questions about one topic only need the relevant messages, not the whole history (see history_search.py)
+# - The index is built as messages are appended to the history, and searched in memory
+history_search = HistorySearch(HISTORY_FILE)
+
+def search_conversation_history(query, k=5):
+    """Search the conversation history for the messages relevant to a query"""
+    return history_search.search(query, k)
+
 
 
+"""
+    Tool output encoders
+    - The conversation history is a list of records, so it is sent as TSV instead of JSON, without repeating the keys
+    - Prompt suggestions only need who said what, so the timestamps are left out
+"""
+TOOL_OUTPUT_ENCODERS = {
+    "summarize_conversation_history": ToolOutputEncoder("tsv"),
+    "generate_prompt_suggestions": ToolOutputEncoder("tsv", columns=["user", "message"]),
+    "search_conversation_history": ToolOutputEncoder("tsv"),
+}
+
+# As the history grows, it is sent a page at a time; the model calls fetch_more for the next page (see pagination.py)
+paginator = Paginator(max_chars=2000)
+
 def run_conversation():
     # Step 1: send the conversation and available functions to the model
     messages = [
@@ -68,6 +105,9 @@ def run_conversation():
                     Provides prompt suggestions based on the conversation history, return a json array, with one to 5 word suggestions. 
                     Limit the suggestions to 6 total.
                     Always include these first: ["Review academic dashboard" , "Apply for classes", "Practice an exam question"]
+                - search_conversation_history,
+                    Searches the conversation history for the messages about one topic, e.g. "colleges for computer science".
+                    Use it instead of the full history when the question is about a specific topic.
             """
         },
         {
@@ -92,29 +132,51 @@ def run_conversation():
                 "description": "Provides prompt suggestions based on the conversation history.",
                 "parameters": {"type": "object", "properties": {}},
             },
-        }
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "search_conversation_history",
+                "description": "Returns the messages of the conversation history most relevant to a query, best first.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "query": {"type": "string", "description": "The topic to search for, e.g. colleges for computer science"},
+                        "k": {"type": "integer", "description": "The number of messages to return, 5 by default"},
+                    },
+                    "required": ["query"],
+                },
+            },
+        },
     ]
+    available_functions = {
+        "summarize_conversation_history": summarize_conversation_history,
+        "generate_prompt_suggestions": generate_prompt_suggestions,
+        "search_conversation_history": search_conversation_history,
+    } 
+    tools, available_functions = paginator.register(tools, available_functions) # adds fetch_more
     
-    response = client.chat.completions.create(
-        model=DEPLOYMENT_NAME,
-        response_format={ "type": "json_object" },
-        messages=messages,
-        tools=tools,
-        tool_choice="auto",  # auto is default, but we'll be explicit
-        temperature=0,  # Adjust the variance by changing the temperature value (default is 0.8)
-    )
+    metrics.increment("round_trips_total", flow=FLOW)
+    with metrics.span("completion", flow=FLOW, call="initial"):
+        response = client.chat.completions.create(
+            model=DEPLOYMENT_NAME,
+            response_format={ "type": "json_object" },
+            messages=messages,
+            tools=tools,
+            tool_choice="auto",  # auto is default, but we'll be explicit
+            temperature=0,  # Adjust the variance by changing the temperature value (default is 0.8)
+        )
+    ledger.record(response.usage, response.model, FLOW, "initial", singleflight.is_shared(response))
 
     response_message = response.choices[0].message
     tool_calls = response_message.tool_calls
 
     # Step 2: check if the model wanted to call a function
-    if tool_calls:
+    # - Repeat while it calls functions, e.g. fetch_more for the next page of a paginated result
+    second_response = None
+    while tool_calls:
         
         messages.append(response_message)  # extend conversation with assistant's reply
-        available_functions = {
-            "summarize_conversation_history": summarize_conversation_history,
-            "generate_prompt_suggestions": generate_prompt_suggestions,
-        } 
         
         for tool_call in tool_calls:
 
@@ -126,7 +188,10 @@ def run_conversation():
             # Step 3: call the function with arguments if any
             function_to_call = available_functions[function_name]
             function_args = json.loads(tool_call.function.arguments)
-            function_response = function_to_call(**function_args)
+            with metrics.span("tool", flow=FLOW, tool=function_name):
+                function_response = paginator.paginate(
+                    function_to_call(**function_args), TOOL_OUTPUT_ENCODERS.get(function_name)
+                )
     
             # Step 4: send the info for each function call and function response to the model
             messages.append(
@@ -138,16 +203,25 @@ def run_conversation():
                 }
             )  # extend conversation with function response
             
-        second_response = client.chat.completions.create(
-            model=DEPLOYMENT_NAME,
-            response_format={ "type": "json_object" },
-            messages=messages,
-        )  # get a new response from the model where it can see the function response
-        return second_response
+        metrics.increment("round_trips_total", flow=FLOW)
+        with metrics.span("completion", flow=FLOW, call="followup"):
+            second_response = client.chat.completions.create(
+                model=DEPLOYMENT_NAME,
+                response_format={ "type": "json_object" },
+                messages=messages,
+                tools=tools,
+                tool_choice="auto",
+            )  # get a new response from the model where it can see the function response
+        ledger.record(second_response.usage, second_response.model, FLOW, "followup", singleflight.is_shared(second_response))
+        response_message = second_response.choices[0].message
+        tool_calls = response_message.tool_calls
+
+    return second_response
     
 
 # print(run_conversation())
-result = run_conversation()
+with metrics.span("turn", flow=FLOW):
+    result = run_conversation()
 
 # from pprint import pprint
 # pprint(vars(result))
@@ -155,9 +229,6 @@ result = run_conversation()
 message_content = result.choices[0].message.content
 print(message_content)
 
-# Ensure the output directory exists
-os.makedirs('output', exist_ok=True)
-
 # Write message_content to a JSON file with formatted indentation
-with open('output/conversation_history_chat_output.json', 'w') as file:
-    json.dump(json.loads(message_content), file, indent=4)
+# (atomically, creating the output directory if needed; see async_io.py)
+async_io.write_json('output/conversation_history_chat_output.json', json.loads(message_content), indent=4)
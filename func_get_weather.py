@@ -1,23 +1,31 @@
 import json
+import metrics
+from usage import ledger
 from utils import get_function_and_args, setup_client
+from locations import get_index as get_location_index
 
 # Set up the OpenAI client, get the deployment name
 client, DEPLOYMENT_NAME = setup_client()
 
+FLOW = "get_weather" # label for the metrics recorded by this example
+
 # Example function hard coded to return the same weather
 # In production, this could be your backend API or an external API
 def get_current_weather(location, unit="fahrenheit"):
     """Get the current weather in a given location"""
-    if "tokyo" in location.lower():
-        return json.dumps({"location": "Tokyo", "temperature": "10", "unit": unit})
-    elif "san francisco" in location.lower():
-        return json.dumps(
-            {"location": "San Francisco", "temperature": "72", "unit": unit}
-        )
-    elif "paris" in location.lower():
-        return json.dumps({"location": "Paris", "temperature": "22", "unit": unit})
-    else:
+    # Look up the city in the local dataset (data/cities.csv), see locations.py
+    city = get_location_index().lookup(location)
+    if city is None:
         return json.dumps({"location": location, "temperature": "unknown"})
+    return json.dumps({"location": city.name, "temperature": city.temperature, "unit": unit})
+
+# Batch version: the weather in many locations in one tool call
+def get_current_weathers(locations, unit="fahrenheit"):
+    cities = get_location_index().lookup_many(locations)
+    return json.dumps({
+        location: {"location": city.name, "temperature": city.temperature, "unit": unit} if city is not None else {"location": location, "temperature": "unknown"}
+        for location, city in zip(locations, cities)
+    })
 
 
 def run_conversation():
@@ -27,7 +35,7 @@ def run_conversation():
             "role": "system", 
             "content": """
                 You are a helpful assistant.
-                You have access to a function that can get the current weather in a given location.
+                You have access to functions that can get the current weather in a given location, or in several locations at once.
                 Determine a reasonable Unit of Measurement (Celsius or Fahrenheit) for the temperature based on the location.
             """
         },
@@ -61,15 +69,41 @@ def run_conversation():
                     "required": ["location"],
                 },
             },
-        }
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "get_current_weathers",
+                "description": "Get the current weather in several locations at once",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "locations": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "The locations, in the same format as get_current_weather, e.g. San Francisco, CA",
+                        },
+                        "unit": {
+                            "type": "string",
+                            "description": "Unit of Measurement (Celsius or Fahrenheit) for the temperatures",
+                            "enum": ["celsius", "fahrenheit"]
+                        },
+                    },
+                    "required": ["locations"],
+                },
+            },
+        },
     ]
-    response = client.chat.completions.create(
-        model=DEPLOYMENT_NAME,
-        messages=messages,
-        tools=tools,
-        tool_choice="auto",  # auto is default, but we'll be explicit
-        temperature=0,  # Adjust the variance by changing the temperature value (default is 0.8)
-    )
+    metrics.increment("round_trips_total", flow=FLOW)
+    with metrics.span("completion", flow=FLOW, call="initial"):
+        response = client.chat.completions.create(
+            model=DEPLOYMENT_NAME,
+            messages=messages,
+            tools=tools,
+            tool_choice="auto",  # auto is default, but we'll be explicit
+            temperature=0,  # Adjust the variance by changing the temperature value (default is 0.8)
+        )
+    ledger.record(response.usage, response.model, FLOW, "initial")
 
     response_message = response.choices[0].message
     tool_calls = response_message.tool_calls
@@ -80,7 +114,8 @@ def run_conversation():
         messages.append(response_message)  # extend conversation with assistant's reply
         available_functions = {
             "get_current_weather": get_current_weather,
-        }  # only one function in this example, but you can have multiple
+            "get_current_weathers": get_current_weathers,
+        }
         
         for tool_call in tool_calls:
 
@@ -92,7 +127,8 @@ def run_conversation():
             function_to_call, function_args = get_function_and_args(tool_call, available_functions)
             
             # call the function
-            function_response = function_to_call(**function_args)
+            with metrics.span("tool", flow=FLOW, tool=function_name):
+                function_response = function_to_call(**function_args)
 
             # Step 4: send the info for each function call and function response to the model
             messages.append(
@@ -104,15 +140,19 @@ def run_conversation():
                 }
             )  # extend conversation with function response
 
-        second_response = client.chat.completions.create(
-            model=DEPLOYMENT_NAME,
-            messages=messages,
-            temperature=0,  # Adjust the variance by changing the temperature value (default is 0.8)
-        )  # get a new response from the model where it can see the function response
+        metrics.increment("round_trips_total", flow=FLOW)
+        with metrics.span("completion", flow=FLOW, call="followup"):
+            second_response = client.chat.completions.create(
+                model=DEPLOYMENT_NAME,
+                messages=messages,
+                temperature=0,  # Adjust the variance by changing the temperature value (default is 0.8)
+            )  # get a new response from the model where it can see the function response
+        ledger.record(second_response.usage, second_response.model, FLOW, "followup")
         return second_response
     
 
-result = run_conversation()
+with metrics.span("turn", flow=FLOW):
+    result = run_conversation()
 
 message_content = result.choices[0].message.content
 print(message_content)
@@ -3,11 +3,19 @@ import json
 import asyncio
 import openai
 from dotenv import load_dotenv
+import metrics
+import cassettes
+from usage import STREAM_OPTIONS, ledger
+from streaming_json import ToolArgumentsError, ToolCallAccumulator
+from locations import get_index as get_location_index
 
 # Setup the OpenAI client to use either Azure, OpenAI or Ollama API
 load_dotenv()
 API_HOST = os.getenv("API_HOST")
 
+client = None
+DEPLOYMENT_NAME = None
+
 if API_HOST == "azure":
     client = openai.AzureOpenAI(
         azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
@@ -25,47 +33,52 @@ elif API_HOST == "ollama":
     )
     DEPLOYMENT_NAME = os.getenv("OLLAMA_MODEL")
 
+client = cassettes.from_env(client) # optionally record or replay the calls, see cassettes.py
+
+FLOW = "get_weather_streaming" # label for the metrics recorded by this example
+
 # Example function hard coded to return the same weather
 # In production, this could be your backend API or an external API
 def get_current_weather(location, unit="fahrenheit"):
     """Get the current weather in a given location"""
-    if "tokyo" in location.lower():
-        return json.dumps({"location": "Tokyo", "temperature": "10", "unit": unit})
-    elif "san francisco" in location.lower():
-        return json.dumps(
-            {"location": "San Francisco", "temperature": "72", "unit": unit}
-        )
-    elif "paris" in location.lower():
-        return json.dumps({"location": "Paris", "temperature": "22", "unit": unit})
-    else:
+    # Look up the city in the local dataset (data/cities.csv), see locations.py
+    city = get_location_index().lookup(location)
+    if city is None:
         return json.dumps({"location": location, "temperature": "unknown"})
+    return json.dumps({"location": city.name, "temperature": city.temperature, "unit": unit})
 
 
-def get_tool_calls(stream):
-    tool_calls = []
-    delta = None
+def get_tool_calls(stream, tools=None, timer=None):
+    """
+    Print the streamed content and accumulate the streamed tool calls.
+    When tools are given, the tool arguments are validated against the tool schemas while streaming,
+    and the stream is closed as soon as the arguments can no longer be valid.
+    When a metrics stream timer is given, it records the timing of the stream.
 
-    for chunk in stream:
-        delta = chunk.choices[0].delta if chunk.choices and chunk.choices[0].delta is not None else None
-        # print(delta)
+    Raises:
+        ToolArgumentsError: If a tool call is malformed or violates its tool's schema.
+    """
+    accumulator = ToolCallAccumulator(tools)
+    timer = timer or metrics.stream_timer("completion", flow=FLOW)
+    delta = None
 
-        if delta and delta.content:
-            print(delta.content, end="", flush=True)
+    try:
+        for chunk in stream:
+            timer.observe_chunk(chunk)
+            ledger.record_chunk(chunk, FLOW, "initial", DEPLOYMENT_NAME)
+            delta = chunk.choices[0].delta if chunk.choices and chunk.choices[0].delta is not None else None
+            # print(delta)
 
-        elif delta and delta.tool_calls:
-            tc_chunk_list = delta.tool_calls
-            for tc_chunk in tc_chunk_list:
-                if len(tool_calls) <= tc_chunk.index:
-                    tool_calls.append({"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
-                tc = tool_calls[tc_chunk.index]
+            if delta and delta.content:
+                print(delta.content, end="", flush=True)
 
-                if tc_chunk.id:
-                    tc["id"] += tc_chunk.id
-                if tc_chunk.function.name:
-                    tc["function"]["name"] += tc_chunk.function.name
-                if tc_chunk.function.arguments:
-                    tc["function"]["arguments"] += tc_chunk.function.arguments
-    return tool_calls
+            elif delta and delta.tool_calls:
+                accumulator.add(delta.tool_calls)
+        timer.finish()
+        return accumulator.finish()
+    except ToolArgumentsError:
+        stream.close() # stop paying for the rest of the generation
+        raise
 
 def run_conversation():
     # Step 1: send the conversation and available functions to the model
@@ -110,20 +123,26 @@ def run_conversation():
             },
         }
     ]
+    timer = metrics.stream_timer("completion", flow=FLOW, call="initial")
+    metrics.increment("round_trips_total", flow=FLOW)
     stream = client.chat.completions.create(
         model=DEPLOYMENT_NAME,
         messages=messages,
         tools=tools,
         tool_choice="auto",  # auto is default, but we'll be explicit
         temperature=0,  # Adjust the variance by changing the temperature value (default is 0.8)
-        stream=True
+        stream=True,
+        stream_options=STREAM_OPTIONS, # the last chunk carries the token usage
     )
 
     available_functions = {
         "get_current_weather": get_current_weather,
     }  # only one function in this example, but you can have multiple
     
-    tool_calls = get_tool_calls(stream)
+    try:
+        tool_calls = get_tool_calls(stream, tools, timer)
+    except ToolArgumentsError as e:
+        return "Invalid tool call arguments: " + str(e)
 
     # Step 2: check if the model wanted to call a function
     if tool_calls:
@@ -144,7 +163,8 @@ def run_conversation():
             # Step 3: call the function with arguments if any
             function_to_call = available_functions[function_name]
             function_args = json.loads(tool_call['function']['arguments'])
-            function_response = function_to_call(**function_args)
+            with metrics.span("tool", flow=FLOW, tool=function_name):
+                function_response = function_to_call(**function_args)
 
             # Step 4: send the info for each function call and function response to the model
             messages.append(
@@ -156,10 +176,13 @@ def run_conversation():
                 }
             )  # extend conversation with function response
 
+        timer = metrics.stream_timer("completion", flow=FLOW, call="followup")
+        metrics.increment("round_trips_total", flow=FLOW)
         stream = client.chat.completions.create(
             model=DEPLOYMENT_NAME,
             messages=messages,
             stream=True,
+            stream_options=STREAM_OPTIONS,
         )
 
         async def print_stream_chunks(stream):
@@ -168,7 +191,9 @@ def run_conversation():
                     print(chunk.choices[0].delta.content, end="", flush=True)
                     await asyncio.sleep(0.1)
 
-        asyncio.run(print_stream_chunks(stream))
+        asyncio.run(print_stream_chunks(metrics.time_stream(ledger.track_stream(stream, FLOW, "followup", DEPLOYMENT_NAME), timer)))
 
-result = run_conversation()
+if __name__ == "__main__":
+    with metrics.span("turn", flow=FLOW):
+        result = run_conversation()
 
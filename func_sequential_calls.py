@@ -1,25 +1,43 @@
+import functools
 import json
 import math
 import pandas as pd
-import pytz
-from datetime import datetime
+import metrics
+from timezones import get_index as get_timezone_index
+from pagination import Paginator
+from tool_encoding import ToolOutputEncoder
+from tool_selection import ToolSelector
+from usage import ledger
+from vector_math import batch_calculate, evaluate_expression
 from utils import check_args, setup_client
+from prewarm import Prewarm, warm_client
 
 # Set up the OpenAI client, get the deployment name
 client, DEPLOYMENT_NAME = setup_client()
 
+FLOW = "sequential_calls" # label for the metrics recorded by this example
+
 def get_current_time(location):
-    try:
-        # Get the timezone for the city
-        timezone = pytz.timezone(location)
+    # Resolve the location (zone, city, country or alias) to its cached timezone, see timezones.py
+    now = get_timezone_index().now(location)
+    if now is None:
+        return "Sorry, I couldn't find the timezone for that location."
 
-        # Get the current time in the timezone
-        now = datetime.now(timezone)
-        current_time = now.strftime("%I:%M:%S %p")
+    return now.strftime("%I:%M:%S %p")
 
-        return current_time
-    except:
-        return "Sorry, I couldn't find the timezone for that location."
+# Batch version: the current time in many locations in one tool call
+def get_current_times(locations):
+    times = get_timezone_index().now_many(locations)
+    return json.dumps({
+        location: now.strftime("%I:%M:%S %p") if now is not None else "Unknown location"
+        for location, now in times.items()
+    })
+
+@functools.lru_cache(maxsize=None)
+def load_stock_data():
+    """Read the stock CSV once and split it by index (without the Index column)."""
+    data = pd.read_csv("./data/stock_data.csv")
+    return {index: rows.drop(columns=["Index"]) for index, rows in data.groupby("Index", sort=False)}
 
 def get_stock_market_data(index):
     available_indices = [
@@ -32,22 +50,13 @@ def get_stock_market_data(index):
     if index not in available_indices:
         return "Invalid index. Please choose from 'S&P 500', 'NASDAQ Composite', 'Dow Jones Industrial Average', 'Financial Times Stock Exchange 100 Index'."
 
-    # Read the CSV file
-    data = pd.read_csv("./data/stock_data.csv")
+    # The rows of the given index, loaded once (see load_stock_data)
+    data_filtered = load_stock_data().get(index)
+    if data_filtered is None:
+        return "No data for " + index
 
-    # Filter data for the given index
-    data_filtered = data[data["Index"] == index]
-
-    # Remove 'Index' column
-    data_filtered = data_filtered.drop(columns=["Index"])
-
-    # Convert the DataFrame into a dictionary
-    hist_dict = data_filtered.to_dict()
-
-    for key, value_dict in hist_dict.items():
-        hist_dict[key] = {k: v for k, v in value_dict.items()}
-
-    return json.dumps(hist_dict)
+    # Return the table as is; it is encoded for the model with the tool's output encoder
+    return data_filtered
 
 def calculator(num1, num2, operator):
     if operator == "+":
@@ -65,6 +74,19 @@ def calculator(num1, num2, operator):
     else:
         return "Invalid operator"
 
+# Batch calculator: many operations, or one expression over arrays, in a single tool call (see vector_math.py)
+def batch_calculator(num1=None, num2=None, operator=None, expression=None, variables=None):
+    try:
+        if expression is not None:
+            results = evaluate_expression(expression, variables)
+        elif num1 is not None and operator is not None:
+            results = batch_calculate(num1, num2 if num2 is not None else 0, operator)
+        else:
+            return "Provide either an expression, or num1, num2 and operator arrays."
+    except (TypeError, ValueError) as e: # arguments of the wrong type or shape, as generated by the model
+        return "Invalid calculation: " + str(e)
+    return json.dumps({"results": results})
+
 """
     Get tools
     - Returns the tools available to the model. 
@@ -82,13 +104,31 @@ def get_tools():
                     "properties": {
                         "location": {
                             "type": "string",
-                            "description": "The location name. The pytz is used to get the timezone for that location. Location names should be in a format like America/New_York, Asia/Bangkok, Europe/London",
+                            "description": "The location name: a timezone like America/New_York, Asia/Bangkok, Europe/London, or a city or country name like Tokyo, Paris, France",
                         }
                     },
                     "required": ["location"],
                 },
             },
         },
+        {
+            "type": "function",
+            "function": {
+                "name": "get_current_times",
+                "description": "Get the current time in several locations at once",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "locations": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "The location names, in the same formats as get_current_time",
+                        }
+                    },
+                    "required": ["locations"],
+                },
+            },
+        },
         {
             "type": "function",
             "function": {
@@ -130,6 +170,35 @@ def get_tools():
                 },
             },
         },
+        {
+            "type": "function",
+            "function": {
+                "name": "batch_calculator",
+                "description": "Perform many calculations in one call. Either pass arrays num1, num2 and operator (the i-th result is num1[i] operator num2[i]), or an arithmetic expression such as (close - open) / open * 100 with the variables it uses; a variable given as an array yields one result per element. Returns all results at once.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "num1": {"type": "array", "items": {"type": "number"}},
+                        "num2": {"type": "array", "items": {"type": "number"}},
+                        "operator": {
+                            "type": "array",
+                            "items": {"type": "string", "enum": ["+", "-", "*", "/", "**", "sqrt"]},
+                        },
+                        "expression": {
+                            "type": "string",
+                            "description": "Numbers, variables, + - * / // % ** and parentheses, and the functions sqrt, abs, exp, log, log10, round, min, max",
+                        },
+                        "variables": {
+                            "type": "object",
+                            "description": "Values of the variables in the expression, numbers or arrays of numbers",
+                            "additionalProperties": {
+                                "anyOf": [{"type": "number"}, {"type": "array", "items": {"type": "number"}}]
+                            },
+                        },
+                    },
+                },
+            },
+        },
     ]
 
 """
@@ -139,19 +208,39 @@ def get_tools():
 def get_available_functions():
     return {
         "get_current_time": get_current_time,
+        "get_current_times": get_current_times,
         "get_stock_market_data": get_stock_market_data,
         "calculator": calculator,
+        "batch_calculator": batch_calculator,
     }
 
+"""
+    Tool output encoders
+    - How each tool's output is encoded for the model (see tool_encoding.py); other tools default to compact JSON
+    - The stock data is a table, so it is sent as CSV with the prices rounded to cents
+"""
+TOOL_OUTPUT_ENCODERS = {
+    "get_stock_market_data": ToolOutputEncoder("csv", digits=2),
+}
+
+# Large tool outputs are sent a page at a time; the model calls fetch_more for the next page (see pagination.py)
+paginator = Paginator(max_chars=2000)
+
+# With TOOL_SELECTION_K=n, every request only carries the n tools most relevant to it (see tool_selection.py)
+tool_selector = ToolSelector.from_env()
+
 def run_multiturn_conversation(messages, tools, available_functions):
     # Step 1: send the conversation and available functions to GPT
-    response = client.chat.completions.create(
-        model=DEPLOYMENT_NAME,
-        messages=messages,
-        tools=tools,
-        tool_choice="auto",  # auto is default, but we'll be explicit
-        temperature=0,  # Adjust the variance by changing the temperature value (default is 0.8)
-    )
+    metrics.increment("round_trips_total", flow=FLOW)
+    with metrics.span("completion", flow=FLOW, call="initial"):
+        response = client.chat.completions.create(
+            model=DEPLOYMENT_NAME,
+            messages=messages,
+            tools=tool_selector.select(tools, messages),
+            tool_choice="auto",  # auto is default, but we'll be explicit
+            temperature=0,  # Adjust the variance by changing the temperature value (default is 0.8)
+        )
+    ledger.record(response.usage, response.model, FLOW, "initial")
 
     # Step 2: check if GPT wanted to call a function
     while response.choices[0].finish_reason == "tool_calls":
@@ -175,7 +264,10 @@ def run_multiturn_conversation(messages, tools, available_functions):
             return "Invalid number of arguments for function: " + function_name
         
         # call the function
-        function_response = function_to_call(**function_args)
+        with metrics.span("tool", flow=FLOW, tool=function_name):
+            function_response = paginator.paginate(
+                function_to_call(**function_args), TOOL_OUTPUT_ENCODERS.get(function_name)
+            )
 
         print("Output of function call:")
         print(function_response)
@@ -209,13 +301,16 @@ def run_multiturn_conversation(messages, tools, available_functions):
             print(message)
         print()
 
-        response = client.chat.completions.create(
-        model=DEPLOYMENT_NAME,
-        messages=messages,
-        tools=tools,
-        tool_choice="auto",  # auto is default, but we'll be explicit
-        temperature=0,  # Adjust the variance by changing the temperature value (default is 0.8)
-        )  # get a new response from GPT where it can see the function response
+        metrics.increment("round_trips_total", flow=FLOW)
+        with metrics.span("completion", flow=FLOW, call="followup"):
+            response = client.chat.completions.create(
+            model=DEPLOYMENT_NAME,
+            messages=messages,
+            tools=tool_selector.select(tools, messages),
+            tool_choice="auto",  # auto is default, but we'll be explicit
+            temperature=0,  # Adjust the variance by changing the temperature value (default is 0.8)
+            )  # get a new response from GPT where it can see the function response
+        ledger.record(response.usage, response.model, FLOW, "followup")
 
     return response
 
@@ -234,9 +329,19 @@ next_messages.append(
     }
 )
 
-assistant_response = run_multiturn_conversation(
-    next_messages, get_tools(), get_available_functions()
-)
+# With PREWARM=1, connect to the backend and load the tool data in parallel before the first request, see prewarm.py
+prewarm = Prewarm.from_env()
+prewarm.add("connection", warm_client, client)
+prewarm.add("stock data", load_stock_data)
+prewarm.add("timezones", get_timezone_index)
+prewarm.run_sync()
+
+with metrics.span("turn", flow=FLOW):
+    assistant_response = run_multiturn_conversation(
+        next_messages, *paginator.register(get_tools(), get_available_functions())
+    )
 print("Final Response:")
 print(assistant_response.choices[0].message)
 print("Conversation complete!")
+print(ledger.report())
+print(tool_selector.report())
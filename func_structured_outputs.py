@@ -1,12 +1,21 @@
 import openai
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from typing import List
-from utils import setup_client
+from utils import setup_async_client, setup_client
+from streaming_json import IncrementalJSONParser, JSONStreamError
+import singleflight
+import async_io
+import asyncio
 import os
-import json
+import time
 
 # Set up the OpenAI client, get the deployment name
 client, DEPLOYMENT_NAME = setup_client()
+# The async client is used to parse the sections of large menus concurrently
+async_client, _ = setup_async_client()
+# Optionally share identical in-flight calls, e.g. identical menus or sections parsed at the same time (see singleflight.py)
+client = singleflight.from_env(client)
+async_client = singleflight.from_env(async_client)
 
 class CoffeeMenuItem(BaseModel):
     category: str
@@ -27,9 +36,9 @@ def print_parsed_menu(parsed_menu):
             print(f"Price: {item.price}")
             print()  # Add a blank line between items
 
-def parse_menu_with_gpt4o(raw_text, model_deployment_name):
-    """Parse the raw text into structured JSON using GPT-4o."""
-    prompt = f"""
+def build_menu_prompt(raw_text):
+    """Build the menu parsing prompt for the raw text."""
+    return f"""
     You are a menu parser. Convert the following raw text from a coffee menu into structured JSON with the fields:
     - category
     - item
@@ -41,6 +50,10 @@ def parse_menu_with_gpt4o(raw_text, model_deployment_name):
     {raw_text}
     ---
     """
+
+def parse_menu_with_gpt4o(raw_text, model_deployment_name):
+    """Parse the raw text into structured JSON using GPT-4o."""
+    prompt = build_menu_prompt(raw_text)
     try:
         response = client.beta.chat.completions.parse(
             model=model_deployment_name,
@@ -60,6 +73,145 @@ def parse_menu_with_gpt4o(raw_text, model_deployment_name):
         print(f"Problematic prompt: {prompt}")
         return None
 
+class MenuItemCollector:
+    """Parser listener that validates each element of the "items" array as soon as it closes."""
+
+    def __init__(self):
+        self.ready = []
+
+    def end_value(self, path, value):
+        if len(path) == 2 and path[0] == "items":
+            self.ready.append(CoffeeMenuItem.model_validate(value))
+
+def stream_menu_items_with_gpt4o(raw_text, model_deployment_name):
+    """
+    Stream the parsed menu, yielding each CoffeeMenuItem as soon as it has been generated.
+    - Uses the same prompt and response_format as parse_menu_with_gpt4o
+    - The JSON is parsed incrementally, so the first items are available while the rest of the menu is still being generated
+
+    Raises:
+        JSONStreamError: If the generated JSON is invalid, or was cut off before the end of the menu.
+        ValidationError: If a generated item does not match CoffeeMenuItem.
+        In both cases the stream is closed first, so the rest of the generation is not paid for.
+    """
+    prompt = build_menu_prompt(raw_text)
+    collector = MenuItemCollector()
+    parser = IncrementalJSONParser(collector)
+    try:
+        with client.beta.chat.completions.stream(
+            model=model_deployment_name,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0,
+            response_format=CoffeeMenu
+        ) as stream:
+            for event in stream:
+                if event.type != "content.delta":
+                    continue
+                parser.feed(event.delta)
+                while collector.ready:
+                    yield collector.ready.pop(0)
+            parser.close() # a truncated menu is an error, not a shorter menu
+            while collector.ready:
+                yield collector.ready.pop(0)
+
+    except openai.LengthFinishReasonError as e:
+        raise JSONStreamError(f"The menu was cut off: {e}") from e
+    except openai.ContentFilterFinishReasonError as e:
+        print(f"Content filter error: {e}")
+        print(f"Problematic prompt: {prompt}")
+
+def split_menu_sections(raw_text):
+    """
+    Split the raw menu text into sections by category header.
+    - A header is any non-empty line that is not a list item (e.g. "Espresso Drinks", "Cold Brews")
+    - Each section holds its header and the item lines that follow it
+
+    Returns:
+        list: The text of each section, in menu order.
+    """
+    sections = []
+    current = []
+    has_items = False
+    for line in raw_text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            continue
+        is_item = stripped[0] in "-*\u2022"
+        if not is_item and has_items:
+            # A header after item lines starts the next section
+            sections.append("\n".join(current))
+            current = []
+            has_items = False
+        current.append(stripped)
+        has_items = has_items or is_item
+    if current:
+        sections.append("\n".join(current))
+    return sections
+
+async def parse_menu_section_async(section_text, model_deployment_name):
+    """Parse a single menu section into a CoffeeMenu using the async client."""
+    prompt = build_menu_prompt(section_text)
+    try:
+        response = await async_client.beta.chat.completions.parse(
+            model=model_deployment_name,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0,
+            response_format=CoffeeMenu
+        )
+        return response.choices[0].message.parsed
+
+    except openai.ContentFilterFinishReasonError as e:
+        print(f"Content filter error: {e}")
+        print(f"Problematic prompt: {prompt}")
+        return None
+
+def merge_menus(menus):
+    """
+    Merge the parsed sections into a single CoffeeMenu.
+    Items are deduplicated on (category, item), keeping the first occurrence in menu order.
+    """
+    seen = set()
+    items = []
+    for menu in menus:
+        if not menu:
+            continue
+        for item in menu.items:
+            key = (item.category.strip().lower(), item.item.strip().lower())
+            if key not in seen:
+                seen.add(key)
+                items.append(item)
+    return CoffeeMenu(items=items)
+
+async def parse_menu_by_section_async(raw_text, model_deployment_name):
+    """
+    Map-reduce parsing for large menus.
+    - Map: every section is parsed concurrently through the async client
+    - Reduce: the section results are merged and deduplicated
+    - A failed section is reported and skipped instead of failing the whole menu
+    """
+    sections = split_menu_sections(raw_text)
+    results = await asyncio.gather(
+        *(parse_menu_section_async(section, model_deployment_name) for section in sections),
+        return_exceptions=True,
+    )
+    menus = []
+    for section, result in zip(sections, results):
+        if isinstance(result, Exception):
+            print(f"Failed to parse section {section.splitlines()[0]!r}: {result}")
+            continue
+        menus.append(result)
+    return merge_menus(menus)
+
+def parse_menu_by_section(raw_text, model_deployment_name):
+    """Synchronous entry point for parse_menu_by_section_async."""
+    return asyncio.run(parse_menu_by_section_async(raw_text, model_deployment_name))
+
 # Example usage
 sample_raw_text = """
 Espresso Drinks
@@ -89,12 +241,27 @@ print("    items: List[CoffeeMenuItem]")
 print("\nParsing the following raw text:")
 print(sample_raw_text)
 
+start = time.perf_counter()
 parsed_menu = parse_menu_with_gpt4o(sample_raw_text, DEPLOYMENT_NAME)
+single_call_seconds = time.perf_counter() - start
 
 print("\nParsed menu in structured JSON based on the pydantic classes:")
 print_parsed_menu(parsed_menu)
 
 # Save the parsed menu to a JSON file
 if parsed_menu:
-    with open('output/structured_outputs_parsed_menu.json', 'w') as file:
-        json.dump(parsed_menu.dict(), file, indent=4)
+    async_io.write_json('output/structured_outputs_parsed_menu.json', parsed_menu.dict(), indent=4)
+
+print("\nStreaming the parsed menu items as they are generated:")
+try:
+    for item in stream_menu_items_with_gpt4o(sample_raw_text, DEPLOYMENT_NAME):
+        print(f"- {item.category}: {item.item} ({item.price})")
+except (JSONStreamError, ValidationError) as e:
+    print(f"Invalid streamed menu: {e}")
+
+print("\nParsing the menu by section (map-reduce):")
+start = time.perf_counter()
+sectioned_menu = parse_menu_by_section(sample_raw_text, DEPLOYMENT_NAME)
+sectioned_seconds = time.perf_counter() - start
+print(f"Sections: {len(split_menu_sections(sample_raw_text))}, items: {len(sectioned_menu.items)}")
+print(f"Single call: {single_call_seconds:.2f}s, by section: {sectioned_seconds:.2f}s, speedup: {single_call_seconds / sectioned_seconds:.2f}x")
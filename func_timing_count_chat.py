@@ -1,24 +1,29 @@
+import argparse
 import os
+import time
 import asyncio
 import json
 import openai
 from datetime import datetime, timedelta
 from enum import Enum
 from dotenv import load_dotenv
+import metrics
+from usage import ledger
 
 # Setup the OpenAI client to use either Azure, OpenAI or Ollama API
+# - Uses the Async client so that a turn never blocks the event loop shared by all users
 load_dotenv()
 API_HOST = os.getenv("API_HOST")
 
 if API_HOST == "azure":
-    client = openai.AzureOpenAI(
+    client = openai.AsyncAzureOpenAI(
         azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
         api_key=os.getenv("AZURE_OPENAI_API_KEY"),
         api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
     )
     DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME")
 elif API_HOST == "openai":
-    client = openai.OpenAI(api_key=os.getenv("OPENAI_KEY"))
+    client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_KEY"))
     DEPLOYMENT_NAME = os.getenv("OPENAI_MODEL")
 elif API_HOST == "ollama":
     client = openai.AsyncOpenAI(
@@ -27,6 +32,8 @@ elif API_HOST == "ollama":
     )
     DEPLOYMENT_NAME = os.getenv("OLLAMA_MODEL")
 
+FLOW = "timing_count_chat" # label for the metrics recorded by this example
+
 # User type and User class
 class UserType(Enum):
     FREE = 0
@@ -34,15 +41,83 @@ class UserType(Enum):
     PREMIUM = 2
 
 class User:
-    def __init__(self, user_type):
+    def __init__(self, user_type, name="User"):
         self.type = user_type
+        self.name = name
+
+
+"""
+    Input sources
+    - An input source is an async callable returning the next user input ("" ends the chat)
+    - console_input reads from the terminal in a worker thread, so the event loop keeps running while waiting
+    - scripted_input replays a list of inputs, used to simulate many users
+"""
+async def console_input() -> str:
+    try:
+        user_input = await asyncio.to_thread(input, "User:> ")
+    except (KeyboardInterrupt, EOFError):
+        return ""
+    if user_input == "exit":
+        return ""
+    return user_input
+
+def scripted_input(lines, think_time=0.0):
+    remaining = iter(lines)
+
+    async def next_input() -> str:
+        if think_time:
+            await asyncio.sleep(think_time)
+        return next(remaining, "")
+
+    return next_input
+
+
+"""
+    Chat session
+    - Holds the state of one user's conversation: messages and the question counter
+    - Every user has their own session, so concurrent users never share a counter
+"""
+class ChatSession:
+    def __init__(self, user, input_source=console_input, output=print, last_suggestion_date=None):
+        self.user = user
+        self.input_source = input_source
+        self.output = output
+        self.question_counter = 0
+        self.messages = init_messages(user, last_suggestion_date or datetime(2022, 1, 1))
+
+
+def init_messages(user, last_suggestion_date):
+    today = datetime.now() # is the current date
+
+    # Initial messages to start the conversation
+    messages = []
+    messages.append(
+        {
+            "role": "system",
+            "content": """
+                You are a helpful assistant.
+                When the user explicitly asks a question [three times] meaning the question_counter has reached 3, tell the user: "You are awesome!".
 
+                # Tools available:
+                - increment_question_counter,
+                  This function increments the times a user has asked a question. It returns the current count for the question_counter.
+            """
+        }
+    )
 
-# Function to increment the question counter
-def increment_question_counter():
-    global question_counter
-    question_counter += 1
-    return str(question_counter)
+    # Augment the system prompt if meeting frequency criteria
+    if user.type == UserType.PREMIUM and today - last_suggestion_date >= timedelta(weeks=1):
+        # update the last_suggestion_date in the db to today, then augment the system prompt:
+        messages[0]["content"] += "Tell the user at the start of chat: You are super awesome!"
+
+    return messages
+
+
+# Function to increment the question counter of the session's user
+# - There is no await between reading and writing the counter, so the increment is atomic on the event loop
+def increment_question_counter(session):
+    session.question_counter += 1
+    return str(session.question_counter)
 
 
 # List of tools available to the model
@@ -58,35 +133,36 @@ def get_tools():
         }
     ]
 
-async def chat(messages) -> bool:
-    try:
-        user_input = input("User:> ")
-    except KeyboardInterrupt:
-        print("\n\nExiting chat...")
-        return False
-    except EOFError:
-        print("\n\nExiting chat...")
+async def chat(session) -> bool:
+    user_input = await session.input_source()
+    if not user_input:
+        session.output("\n\nExiting chat...")
         return False
 
-    if user_input == "exit":
-        print("\n\nExiting chat...")
-        return False
+    session.messages.append({"role": "user", "content": user_input})
+
+    async with metrics.span("turn", flow=FLOW), ledger.turn(session.user.name):
+        return await respond(session)
 
-    messages.append({"role": "user", "content": user_input})
+async def respond(session) -> bool:
+    messages = session.messages
 
     # Step 1: send the conversation and available functions to the model
-    response = client.chat.completions.create(
-        model=DEPLOYMENT_NAME,
-        messages=messages,
-        tools=get_tools(),
-        tool_choice="auto",  # auto is default, but we'll be explicit
-        temperature=1,
-        max_tokens=400,
-        top_p=0.95,
-        frequency_penalty=0,
-        presence_penalty=0,
-        stop=None,
-    )
+    metrics.increment("round_trips_total", flow=FLOW)
+    async with metrics.span("completion", flow=FLOW, call="initial"):
+        response = await client.chat.completions.create(
+            model=DEPLOYMENT_NAME,
+            messages=messages,
+            tools=get_tools(),
+            tool_choice="auto",  # auto is default, but we'll be explicit
+            temperature=1,
+            max_tokens=400,
+            top_p=0.95,
+            frequency_penalty=0,
+            presence_penalty=0,
+            stop=None,
+        )
+    ledger.record(response.usage, response.model, FLOW, "initial")
 
     response_message = response.choices[0].message
     tool_calls = response_message.tool_calls
@@ -95,23 +171,24 @@ async def chat(messages) -> bool:
     if not tool_calls:
         bot_response = response_message.content
         messages.append({"role": "assistant", "content": bot_response})
-        print(f"Assistant:> {bot_response}")
+        session.output(f"Assistant:> {bot_response}")
 
     else:
         messages.append(response_message)  # extend conversation with assistant's reply
         available_functions = { "increment_question_counter": increment_question_counter }
-        
+
         for tool_call in tool_calls:
 
             # Note: the JSON response may not always be valid; be sure to handle errors
             function_name = tool_call.function.name
             if function_name not in available_functions:
                 return "Function " + function_name + " does not exist"
-        
-            # Step 3: call the function with arguments if any
+
+            # Step 3: call the function with the session and arguments if any
             function_to_call = available_functions[function_name]
             function_args = json.loads(tool_call.function.arguments)
-            function_response = function_to_call(**function_args)
+            with metrics.span("tool", flow=FLOW, tool=function_name):
+                function_response = function_to_call(session, **function_args)
 
             # Step 4: send the info for each tool call and its response to the model
             messages.append(
@@ -123,51 +200,83 @@ async def chat(messages) -> bool:
                 }
             )  # extend conversation with function response
 
-        second_response = client.chat.completions.create(
-            model=DEPLOYMENT_NAME,
-            messages=messages,
-        )  # get a new response from the model where it can see the function response
+        metrics.increment("round_trips_total", flow=FLOW)
+        async with metrics.span("completion", flow=FLOW, call="followup"):
+            second_response = await client.chat.completions.create(
+                model=DEPLOYMENT_NAME,
+                messages=messages,
+            )  # get a new response from the model where it can see the function response
+        ledger.record(second_response.usage, second_response.model, FLOW, "followup")
         second_response_message = second_response.choices[0].message
         second_bot_response = second_response_message.content
         messages.append({"role": "assistant", "content": second_bot_response})
-        print(f"Assistant:> {second_bot_response}")
+        session.output(f"Assistant:> {second_bot_response}")
 
     return True
 
-question_counter = 0
+async def run_session(session) -> None:
+    chatting = True
+    while chatting:
+        chatting = await chat(session)
 
-async def main() -> None:
-    # Set up prior to chat
-    global question_counter
-    user = User(UserType.PREMIUM)
-    today = datetime.now() # is the current date
-    last_suggestion_date = datetime(2022, 1, 1)  # Replace with actual date from database or backend
 
-    # Initial messages to start the conversation
-    messages = []
-    messages.append(
-        {
-            "role": "system",
-            "content": """
-                You are a helpful assistant.
-                When the user explicitly asks a question [three times] meaning the question_counter has reached 3, tell the user: "You are awesome!".
+"""
+    Simulate many users chatting concurrently
+    - Every user gets a session with scripted questions
+    - A heartbeat task measures the event loop lag (how late it wakes up) while the users chat
+    - Usage: python func_timing_count_chat.py --users 20
+"""
+async def measure_loop_lag(samples, interval=0.01):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - start - interval)
 
-                # Tools available:
-                - increment_question_counter,
-                  This function increments the times a user has asked a question. It returns the current count for the question_counter.
-            """
-        }
-    )
+async def simulate_users(num_users, questions=None, think_time=0.1) -> None:
+    questions = questions or [
+        "What is the capital of France?",
+        "How far is the moon from the earth?",
+        "Why is the sky blue?",
+    ]
+    sessions = [
+        ChatSession(
+            User(UserType.PREMIUM if i % 2 == 0 else UserType.BASIC, name=f"user{i}"),
+            input_source=scripted_input(questions, think_time),
+            output=lambda text: None, # keep the console quiet; the counters are printed below
+        )
+        for i in range(num_users)
+    ]
 
-    # Augment the system prompt if meeting frequency criteria
-    if user.type == UserType.PREMIUM and today - last_suggestion_date >= timedelta(weeks=1):
-        # update the last_suggestion_date in the db to today, then augment the system prompt:
-        messages[0]["content"] += "Tell the user at the start of chat: You are super awesome!"
+    lag_samples = []
+    monitor = asyncio.create_task(measure_loop_lag(lag_samples))
+    start = time.perf_counter()
+    await asyncio.gather(*(run_session(session) for session in sessions))
+    elapsed = time.perf_counter() - start
+    monitor.cancel()
 
-    chatting = True
-    while chatting:
-        chatting = await chat(messages)
+    lag_samples.sort()
+    p99 = lag_samples[int(len(lag_samples) * 0.99) - 1] if lag_samples else 0.0
+    turns = num_users * len(questions)
+    print(f"Simulated {num_users} users, {turns} turns in {elapsed:.2f}s ({turns / elapsed:.1f} turns/sec)")
+    print(f"Event loop lag: p99 {p99 * 1000:.1f} ms, max {max(lag_samples, default=0.0) * 1000:.1f} ms")
+    for session in sessions:
+        print(f"  {session.user.name}: question_counter={session.question_counter}")
+
+
+async def main() -> None:
+    # Set up prior to chat
+    user = User(UserType.PREMIUM)
+    last_suggestion_date = datetime(2022, 1, 1)  # Replace with actual date from database or backend
+    session = ChatSession(user, last_suggestion_date=last_suggestion_date)
+    await run_session(session)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Chat with the counting assistant, or simulate many users chatting")
+    parser.add_argument("--users", type=int, help="simulate this many concurrent users instead of chatting")
+    args = parser.parse_args()
+    if args.users:
+        asyncio.run(simulate_users(args.users))
+    else:
+        asyncio.run(main())
@@ -0,0 +1,178 @@
+"""
+    Full-text search over the conversation history
+    - BM25Index is an inverted index (term -> {document: term frequency}) ranked with Okapi BM25; documents are added
+      one at a time, and the statistics BM25 needs (document count, lengths, document frequencies) are kept up to date,
+      so appending a message never rebuilds the index
+    - Terms are lowercased words with stop words removed and plurals folded (S-stemmer), so "colleges" finds "college"
+    - HistorySearch indexes the messages of a conversation history file; every search first indexes the records
+      appended to the file since the last one (the file is only read again when it changed), and returns the top-k
+      messages with a snippet of at most max_chars around the first matching term; async flows call search_async,
+      which reads, indexes and ranks in worker threads
+    - Used by the search_conversation_history tool of func_conversation_history.py and func_async_streaming_chat.py,
+      which sends the model only the relevant messages instead of the whole history
+"""
+import asyncio
+import heapq
+import math
+import os
+import re
+import threading
+from collections import defaultdict
+import async_io
+
+STOP_WORDS = frozenset(
+    "a an and are as at be but by can do for from had has have i i'm if in is it its me my of on or our so that the "
+    "their them there these they this to was we were what which who will with you your".split()
+)
+
+_word = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+
+def stem(word):
+    """Fold plurals (the S-stemmer): universities -> university, colleges -> college, grades -> grade."""
+    if len(word) > 3:
+        if word.endswith("ies") and not word.endswith(("eies", "aies")):
+            return word[:-3] + "y"
+        if word.endswith("es") and not word.endswith(("aes", "ees", "oes")):
+            return word[:-1]
+        if word.endswith("s") and not word.endswith(("us", "ss")):
+            return word[:-1]
+    return word
+
+
+def tokenize(text):
+    """The search terms of a text."""
+    return [stem(word) for word in _word.findall(text.lower()) if word not in STOP_WORDS]
+
+
+class BM25Index:
+    """
+    An incrementally built inverted index ranked with Okapi BM25.
+
+    Args:
+        k1 (float): Term frequency saturation.
+        b (float): Document length normalization (0: none, 1: full).
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict) # term -> {document id: term frequency}
+        self.lengths = [] # document id -> number of terms
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def add(self, text):
+        """Index a document; returns its id (documents are numbered in the order they are added)."""
+        document = len(self.lengths)
+        terms = tokenize(text)
+        for term in terms:
+            frequencies = self.postings[term]
+            frequencies[document] = frequencies.get(document, 0) + 1
+        self.lengths.append(len(terms))
+        self.total_length += len(terms)
+        return document
+
+    def search(self, query, k=5):
+        """
+        Returns:
+            list: The (score, document id) of the k best matching documents, best first.
+        """
+        if not self.lengths:
+            return []
+        count = len(self.lengths)
+        average_length = self.total_length / count or 1
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            frequencies = self.postings.get(term)
+            if not frequencies:
+                continue
+            idf = math.log(1 + (count - len(frequencies) + 0.5) / (len(frequencies) + 0.5))
+            for document, frequency in frequencies.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[document] / average_length)
+                scores[document] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
+        return [(score, document) for document, score in best]
+
+
+def snippet(text, query, max_chars=200):
+    """The part of text around the first term of the query it contains, at most max_chars long."""
+    if len(text) <= max_chars:
+        return text
+    terms = set(tokenize(query))
+    start = 0
+    for match in _word.finditer(text.lower()):
+        if stem(match.group()) in terms:
+            start = max(0, match.start() - max_chars // 4)
+            break
+    end = min(len(text), start + max_chars)
+    start = max(0, end - max_chars)
+    return ("..." if start > 0 else "") + text[start:end].strip() + ("..." if end < len(text) else "")
+
+
+class HistorySearch:
+    """
+    Search over the messages of a conversation history file (a JSON list of {"timestamp", "user", "message"}).
+
+    Args:
+        path (str): The history file.
+        max_chars (int): The longest snippet returned for a message.
+    """
+
+    def __init__(self, path, max_chars=200):
+        self.path = path
+        self.max_chars = max_chars
+        self.index = BM25Index()
+        self.records = []
+        self._modified = None
+        self._lock = threading.Lock()
+
+    def append(self, record):
+        """Index a record added to the history."""
+        self.records.append(record)
+        self.index.add(record.get("message", ""))
+
+    def refresh(self):
+        """Index the records appended to the file since the last refresh; rebuild if the file was rewritten."""
+        modified = os.stat(self.path).st_mtime_ns
+        if modified != self._modified:
+            self._update(async_io.read_json(self.path), modified)
+
+    async def refresh_async(self):
+        """refresh for async flows: the file is read (see async_io.py) and indexed in worker threads."""
+        modified = os.stat(self.path).st_mtime_ns
+        if modified != self._modified:
+            records = await async_io.read_json_async(self.path)
+            await asyncio.to_thread(self._update, records, modified)
+
+    def _update(self, records, modified):
+        with self._lock:
+            if modified == self._modified: # another refresh read the same file meanwhile
+                return
+            if records[:len(self.records)] != self.records:
+                self.index = BM25Index()
+                self.records = []
+            for record in records[len(self.records):]:
+                self.append(record)
+            self._modified = modified
+
+    def search(self, query, k=5):
+        """
+        Returns:
+            list: The k most relevant records, best first, with the message cut to a snippet and their score.
+        """
+        self.refresh()
+        return self._results(query, k)
+
+    async def search_async(self, query, k=5):
+        """search for async flows: the file is read, indexed and ranked in worker threads, off the event loop."""
+        await self.refresh_async()
+        return await asyncio.to_thread(self._results, query, k)
+
+    def _results(self, query, k):
+        return [
+            {**self.records[document], "message": snippet(self.records[document].get("message", ""), query, self.max_chars), "score": round(score, 3)}
+            for score, document in self.index.search(query, k)
+        ]
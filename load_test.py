@@ -0,0 +1,230 @@
+"""
+    Load test for the streaming chat server flow
+    - Spawns N virtual users, each replaying a scripted conversation through send_chat_request
+      (weather questions trigger tool calls, the stock and general questions do not)
+    - Drives them against the mock server by default, or against the backend configured in .env (--backend env)
+    - Reports throughput, p50/p95/p99 turn latency and time to first token, and the event loop lag over time
+    - The time to first token is the upstream one, of the initial completion of each turn: send_chat_request only
+      returns its stream once the initial stream (and any tool round) is done, so the first token a user sees comes
+      at the end of the turn. The chat client is wrapped to time the first content or tool call chunk of the first
+      completion each virtual user's turn requests, so every turn gives one exact sample
+
+    Usage: python load_test.py --users 50 [--backend mock|env] [--ttft 0.2] [--token-delay 0.01] [--think-time 0.5]
+"""
+import argparse
+import asyncio
+import contextvars
+import statistics
+import time
+import types
+import openai
+import func_async_streaming_chat_server as chat_server
+from mock_server import MockChatServer
+
+SCRIPTS = [
+    [
+        "What's the weather like in Tokyo?",
+        "And in Paris?",
+        "Thanks! Which one is warmer?",
+    ],
+    [
+        "How did the S&P 500 do between July 12 and July 13?",
+        "What's the weather like in San Francisco, Tokyo, and Paris?",
+    ],
+    [
+        "Hello! What can you help me with?",
+        "What's the weather in San Francisco?",
+    ],
+]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of values (0.0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def quantiles(values):
+    """p50, p95 and p99 of a list of values (statistics.quantiles, within the range of the values)."""
+    if len(values) < 2:
+        return [values[0] if values else 0.0] * 3
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return cuts[49], cuts[94], cuts[98]
+
+
+# The time to first token of the current turn of a virtual user (each user runs in its own task, so its own context)
+_turn = contextvars.ContextVar("turn", default=None)
+
+
+class TurnTTFT:
+    def __init__(self):
+        self.requested = False
+        self.ttft = None
+
+
+class _TimedStream:
+    """The initial completion stream of a turn; records the time to its first content or tool call chunk."""
+
+    def __init__(self, stream, turn, start):
+        self._stream = stream
+        self._turn = turn
+        self._start = start
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            delta = chunk.choices[0].delta if chunk.choices else None
+            if self._turn.ttft is None and delta is not None and (delta.content or delta.tool_calls):
+                self._turn.ttft = time.perf_counter() - self._start
+            yield chunk
+
+
+class _TimedCompletions:
+    def __init__(self, completions):
+        self._completions = completions
+
+    async def create(self, **kwargs):
+        turn = _turn.get()
+        if turn is None or turn.requested or not kwargs.get("stream"):
+            return await self._completions.create(**kwargs)
+        turn.requested = True # only the first completion of a turn is the initial one
+        start = time.perf_counter()
+        return _TimedStream(await self._completions.create(**kwargs), turn, start)
+
+
+class TimedClient:
+    """Wraps the chat client of the server flow to time the initial completion of every turn."""
+
+    def __init__(self, client):
+        self._client = client
+        self.chat = types.SimpleNamespace(completions=_TimedCompletions(client.chat.completions))
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class LoadTestResults:
+    def __init__(self):
+        self.turn_latencies = []
+        self.ttfts = [] # upstream time to first token of the initial completion of every turn
+        self.errors = 0
+        self.completed = [] # completion time of every turn, relative to the start
+        self.loop_lag = [] # (time, lag) samples, relative to the start
+
+
+async def virtual_user(user_id, script, results, start, think_time):
+    messages = chat_server.init_messages()
+    for prompt in script:
+        messages.append({"role": "user", "content": prompt})
+        turn = TurnTTFT()
+        _turn.set(turn)
+        turn_start = time.perf_counter()
+        content = ""
+        try:
+            stream = await chat_server.send_chat_request(messages)
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta is not None and chunk.choices[0].delta.content:
+                    content += chunk.choices[0].delta.content
+        except Exception as e:
+            results.errors += 1
+            print(f"user{user_id}: {type(e).__name__}: {e}")
+            return
+        end = time.perf_counter()
+        results.turn_latencies.append(end - turn_start)
+        if turn.ttft is not None:
+            results.ttfts.append(turn.ttft)
+        results.completed.append(end - start)
+
+        # send_chat_request only records the final answer itself when no tools were called
+        if messages[-1].get("role") == "tool":
+            messages.append({"role": "assistant", "content": content})
+        if think_time:
+            await asyncio.sleep(think_time)
+
+
+async def monitor_loop_lag(results, start, interval=0.05):
+    loop = asyncio.get_running_loop()
+    while True:
+        before = loop.time()
+        await asyncio.sleep(interval)
+        results.loop_lag.append((time.perf_counter() - start, loop.time() - before - interval))
+
+
+def print_report(results, num_users, elapsed, bucket=1.0):
+    turns = len(results.turn_latencies)
+    print(f"\nUsers: {num_users}  turns: {turns}  errors: {results.errors}  elapsed: {elapsed:.2f}s")
+    print(f"Throughput: {turns / elapsed:.1f} turns/sec")
+    values = results.turn_latencies
+    print(
+        f"{'Turn latency':<13} p50 {percentile(values, 50) * 1000:8.1f} ms   "
+        f"p95 {percentile(values, 95) * 1000:8.1f} ms   p99 {percentile(values, 99) * 1000:8.1f} ms"
+    )
+    p50, p95, p99 = quantiles(results.ttfts)
+    print(
+        f"{'TTFT':<13} p50 {p50 * 1000:8.1f} ms   p95 {p95 * 1000:8.1f} ms   p99 {p99 * 1000:8.1f} ms"
+        "   (upstream, initial completion)"
+    )
+
+    print("\nOver time:")
+    print(f"{'t (s)':>6} {'turns/s':>8} {'loop lag p99 (ms)':>18} {'loop lag max (ms)':>18}")
+    for i in range(int(elapsed / bucket) + 1):
+        low, high = i * bucket, (i + 1) * bucket
+        completed = sum(1 for t in results.completed if low <= t < high)
+        lags = [lag for t, lag in results.loop_lag if low <= t < high]
+        print(
+            f"{high:6.0f} {completed / bucket:8.1f} "
+            f"{percentile(lags, 99) * 1000:18.1f} {max(lags, default=0.0) * 1000:18.1f}"
+        )
+
+
+async def run_load_test(num_users, backend="mock", ttft=0.2, token_delay=0.01, think_time=0.5):
+    """
+    Run the load test and print the report.
+
+    Returns:
+        LoadTestResults: The raw measurements.
+    """
+    mock = None
+    if backend == "mock":
+        mock = await MockChatServer(ttft=ttft, token_delay=token_delay).start()
+        chat_server.client = openai.AsyncOpenAI(base_url=mock.base_url, api_key="mock", max_retries=0)
+        chat_server.DEPLOYMENT_NAME = mock.model
+        print(f"Using the mock server at {mock.base_url}")
+
+    client = chat_server.client
+    chat_server.client = TimedClient(client)
+
+    results = LoadTestResults()
+    start = time.perf_counter()
+    monitor = asyncio.create_task(monitor_loop_lag(results, start))
+    try:
+        await asyncio.gather(*(
+            virtual_user(i, SCRIPTS[i % len(SCRIPTS)], results, start, think_time)
+            for i in range(num_users)
+        ))
+    finally:
+        elapsed = time.perf_counter() - start
+        monitor.cancel()
+        chat_server.client = client
+        if mock is not None:
+            await mock.close()
+
+    print_report(results, num_users, elapsed)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the streaming chat server flow")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--backend", choices=["mock", "env"], default="mock",
+                        help="mock: start a local mock server, env: use the backend configured in .env")
+    parser.add_argument("--ttft", type=float, default=0.2, help="mock server time to first token (s)")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="mock server delay between tokens (s)")
+    parser.add_argument("--think-time", type=float, default=0.5, help="pause between a user's turns (s)")
+    args = parser.parse_args()
+    asyncio.run(run_load_test(args.users, args.backend, args.ttft, args.token_delay, args.think_time))
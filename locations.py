@@ -0,0 +1,218 @@
+"""
+    Location lookup engine for get_current_weather
+    - Loads the cities from a local dataset (data/cities.csv: city, state, country, aliases, population, temperature)
+    - Exact lookups go through a hash index of normalized names (case, accents and punctuation folded)
+      and aliases; "City, State" / "City, Country" qualifiers pick between cities sharing a name
+    - Free text ("the weather in San Francisco, Tokyo and Paris") is matched with an Aho-Corasick automaton over
+      word tokens, so the cost grows with the length of the text, not the number of cities
+    - Ambiguous names resolve to the most populous city unless qualified
+"""
+import csv
+import re
+import unicodedata
+from collections import deque, namedtuple
+import pytz
+
+DEFAULT_CITIES_FILE = "./data/cities.csv"
+
+City = namedtuple("City", ["name", "state", "country", "population", "temperature"])
+
+_TOKEN = re.compile(r"[^\W_]+")
+
+
+def tokenize(text):
+    """Split text into normalized word tokens: case-folded, without accents and punctuation."""
+    folded = unicodedata.normalize("NFKD", text.casefold())
+    folded = "".join(c for c in folded if not unicodedata.combining(c))
+    return _TOKEN.findall(folded)
+
+
+def normalize(text):
+    return " ".join(tokenize(text))
+
+
+class TokenMatcher:
+    """Aho-Corasick automaton over word tokens; finds every added phrase in a token sequence in one pass."""
+
+    def __init__(self):
+        self.goto = [{}] # node -> {token: node}
+        self.fail = [0]
+        self.phrase = [None] # node -> (phrase, length in tokens) when a phrase ends there
+        self.output = [0] # node -> nearest node on the fail chain (or itself) where a phrase ends
+        self._built = False
+
+    def add(self, tokens, phrase):
+        node = 0
+        for token in tokens:
+            next_node = self.goto[node].get(token)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][token] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+                self.phrase.append(None)
+                self.output.append(0)
+            node = next_node
+        self.phrase[node] = (phrase, len(tokens))
+        self._built = False
+
+    def build(self):
+        queue = deque()
+        for node in self.goto[0].values():
+            self.fail[node] = 0
+            queue.append(node)
+        while queue:
+            node = queue.popleft()
+            self.output[node] = node if self.phrase[node] else self.output[self.fail[node]]
+            for token, child in self.goto[node].items():
+                state = self.fail[node]
+                while state and token not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(token, 0)
+                queue.append(child)
+        self._built = True
+
+    def find(self, tokens):
+        """
+        Find the phrases in a token sequence.
+
+        Returns:
+            list: (start, end, phrase) for every occurrence, end exclusive.
+        """
+        if not self._built:
+            self.build()
+        goto, fail, phrase, output = self.goto, self.fail, self.phrase, self.output
+        matches = []
+        state = 0
+        for position, token in enumerate(tokens):
+            while state and token not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token, 0)
+            node = output[state]
+            while node:
+                found, length = phrase[node]
+                matches.append((position + 1 - length, position + 1, found))
+                node = output[fail[node]]
+        return matches
+
+
+class LocationIndex:
+    """
+    Index of cities by name and alias.
+
+    Args:
+        cities (iterable): City records.
+        aliases (dict, optional): Alternative names, alias -> list of indexes into cities.
+    """
+
+    def __init__(self, cities, aliases=None):
+        self.cities = list(cities)
+        self.names = {} # normalized name or alias -> city ids, most populous first
+        self.qualifiers = [] # city id -> normalized state, country code and country name
+        self.matcher = TokenMatcher()
+
+        for city_id, city in enumerate(self.cities):
+            self._add_name(city.name, city_id)
+            country = city.country.lower()
+            self.qualifiers.append({
+                q for q in (normalize(city.state), country, normalize(pytz.country_names.get(city.country.upper(), "")))
+                if q
+            })
+        for alias, city_ids in (aliases or {}).items():
+            for city_id in city_ids:
+                self._add_name(alias, city_id)
+        for key, city_ids in self.names.items():
+            city_ids.sort(key=lambda city_id: -self.cities[city_id].population)
+            self.matcher.add(key.split(" "), key)
+        self.matcher.build()
+
+    def _add_name(self, name, city_id):
+        key = normalize(name)
+        if key:
+            city_ids = self.names.setdefault(key, [])
+            if city_id not in city_ids:
+                city_ids.append(city_id)
+
+    @classmethod
+    def from_csv(cls, path=DEFAULT_CITIES_FILE):
+        cities, aliases = [], {}
+        with open(path, "r", encoding="utf-8", newline="") as file:
+            for row in csv.DictReader(file):
+                city_id = len(cities)
+                cities.append(City(row["city"], row["state"], row["country"], int(row["population"] or 0), row["temperature"]))
+                for alias in filter(None, (row.get("aliases") or "").split(";")):
+                    aliases.setdefault(alias, []).append(city_id)
+        return cls(cities, aliases)
+
+    def _pick(self, city_ids, qualifier=None):
+        if qualifier:
+            for city_id in city_ids:
+                if qualifier in self.qualifiers[city_id]:
+                    return self.cities[city_id]
+        return self.cities[city_ids[0]]
+
+    def lookup(self, location):
+        """
+        Look up one location.
+
+        Args:
+            location (str): A city name or alias, optionally qualified ("Paris, TX", "London, Canada"),
+                or free text mentioning a city.
+
+        Returns:
+            City: The city, or None if no known city is mentioned.
+        """
+        city_ids = self.names.get(normalize(location))
+        if city_ids:
+            return self._pick(city_ids)
+        if "," in location:
+            name, _, qualifier = location.partition(",")
+            city_ids = self.names.get(normalize(name))
+            if city_ids:
+                return self._pick(city_ids, normalize(qualifier.split(",")[0]))
+        cities = self.find_all(location)
+        return cities[0] if cities else None
+
+    def lookup_many(self, locations):
+        """Look up many locations; returns a list with a City or None per location."""
+        return [self.lookup(location) for location in locations]
+
+    def find_all(self, text):
+        """
+        Find every city mentioned in free text, in order.
+        Overlapping mentions resolve to the longest ("New York City" over "York"), and a state or country
+        right after a name ("Paris, TX") picks between cities sharing that name.
+
+        Returns:
+            list: The cities mentioned.
+        """
+        tokens = tokenize(text)
+        matches = sorted(self.matcher.find(tokens), key=lambda match: (match[0], match[0] - match[1]))
+        cities = []
+        position = 0
+        for start, end, key in matches:
+            if start < position:
+                continue
+            city_ids = self.names[key]
+            qualifier = None
+            if len(city_ids) > 1:
+                for length in (3, 2, 1):
+                    candidate = " ".join(tokens[end:end + length])
+                    if any(candidate in self.qualifiers[city_id] for city_id in city_ids):
+                        qualifier = candidate
+                        end += length
+                        break
+            cities.append(self._pick(city_ids, qualifier))
+            position = end
+        return cities
+
+
+# The index shared by the examples, loaded on first use
+_index = None
+
+
+def get_index():
+    global _index
+    if _index is None:
+        _index = LocationIndex.from_csv()
+    return _index
@@ -0,0 +1,377 @@
+"""
+    Lightweight instrumentation for the chat flows
+    - Spans time a unit of work (a turn, a completion call, a tool call) and nest across async tasks
+    - Counters and histograms aggregate by name and labels
+    - Exporters: Prometheus text format (pull) and JSON lines traces (one line per finished span)
+    - Disabled by default; when disabled every call returns immediately
+
+    Configuration (environment variables, also read from .env):
+        METRICS_ENABLED=1               enable instrumentation
+        METRICS_TRACE_FILE=path         append finished spans as JSON lines
+        METRICS_PROMETHEUS_FILE=path    write the Prometheus text format at exit
+"""
+import atexit
+import bisect
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from streams import aclose_stream
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RATE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+_enabled = False
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_exporters = []
+_span_ids = itertools.count(1)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket upper bounds."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+# Enable / disable
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Clear all recorded counters and histograms."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+# Counters and histograms
+
+def increment(name, value=1, **labels):
+    """Increment the counter name{labels} by value."""
+    if not _enabled:
+        return
+    key = (name, _label_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    """Record value in the histogram name{labels}."""
+    if not _enabled:
+        return
+    key = (name, _label_key(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+
+# Spans
+
+class Span:
+    """
+    Times a unit of work and records it in the histogram "<name>_seconds".
+    Use as a (sync or async) context manager; tags become histogram labels and trace attributes.
+    """
+
+    __slots__ = ("name", "tags", "span_id", "parent_id", "trace_id", "start", "duration", "_token", "_perf")
+
+    def __init__(self, name, tags):
+        self.name = name
+        self.tags = tags
+        self.span_id = next(_span_ids)
+        parent = _current_span.get()
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else self.span_id
+        self.start = None
+        self.duration = None
+        self._token = None
+        self._perf = None
+
+    def set_tag(self, key, value):
+        self.tags[key] = value
+
+    def __enter__(self):
+        self.start = time.time()
+        self._token = _current_span.set(self)
+        self._perf = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._perf
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.tags["error"] = exc_type.__name__
+        observe(self.name + "_seconds", self.duration, **self.tags)
+        for exporter in _exporters:
+            exporter.export_span(self)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration": self.duration,
+            "tags": self.tags,
+        }
+
+
+class _NoopSpan:
+    """Shared span returned while instrumentation is disabled."""
+
+    def set_tag(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name, **tags):
+    """Start a span; use it with `with` or `async with`."""
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, tags)
+
+
+# Streams
+
+class StreamTimer:
+    """
+    Records the timing of a streamed completion:
+    - <name>_seconds: time from the request to the last delta
+    - <name>_ttft_seconds: time from the request to the first content or tool call delta
+    - <name>_inter_token_seconds: gap between consecutive deltas
+    - <name>_tokens_per_second: deltas per second after the first one (one delta is roughly one token)
+    """
+
+    __slots__ = ("name", "labels", "start", "first", "last", "chunks")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.start = time.perf_counter()
+        self.first = None
+        self.last = None
+        self.chunks = 0
+
+    def chunk(self):
+        now = time.perf_counter()
+        if self.first is None:
+            self.first = now
+            observe(self.name + "_ttft_seconds", now - self.start, **self.labels)
+        else:
+            observe(self.name + "_inter_token_seconds", now - self.last, **self.labels)
+        self.last = now
+        self.chunks += 1
+
+    def observe_chunk(self, chatCompletionChunk):
+        """Call chunk() if the ChatCompletionChunk carries a content or tool call delta."""
+        choices = chatCompletionChunk.choices
+        if choices and choices[0].delta is not None and (choices[0].delta.content or choices[0].delta.tool_calls):
+            self.chunk()
+
+    def finish(self):
+        if self.first is None:
+            return
+        observe(self.name + "_seconds", self.last - self.start, **self.labels)
+        generation_time = self.last - self.first
+        if self.chunks > 1 and generation_time > 0:
+            observe(self.name + "_tokens_per_second", (self.chunks - 1) / generation_time, RATE_BUCKETS, **self.labels)
+        increment(self.name + "_chunks_total", self.chunks, **self.labels)
+
+
+class _NoopStreamTimer:
+    def chunk(self):
+        pass
+
+    def observe_chunk(self, chatCompletionChunk):
+        pass
+
+    def finish(self):
+        pass
+
+
+_NOOP_STREAM_TIMER = _NoopStreamTimer()
+
+
+def stream_timer(name, **labels):
+    """Start timing a streamed completion; call chunk() per delta and finish() at the end."""
+    if not _enabled:
+        return _NOOP_STREAM_TIMER
+    return StreamTimer(name, labels)
+
+
+def time_stream(stream, timer):
+    """Wrap a completion stream so its chunks are recorded by timer; returns the stream unchanged when disabled."""
+    if timer is _NOOP_STREAM_TIMER:
+        return stream
+
+    def generate():
+        for chatCompletionChunk in stream:
+            timer.observe_chunk(chatCompletionChunk)
+            yield chatCompletionChunk
+        timer.finish()
+
+    return generate()
+
+
+def time_async_stream(stream, timer):
+    """Async version of time_stream; closing the wrapper closes the stream."""
+    if timer is _NOOP_STREAM_TIMER:
+        return stream
+
+    async def generate():
+        try:
+            async for chatCompletionChunk in stream:
+                timer.observe_chunk(chatCompletionChunk)
+                yield chatCompletionChunk
+            timer.finish()
+        finally:
+            await aclose_stream(stream)
+
+    return generate()
+
+
+# Exporters
+
+def add_exporter(exporter):
+    """Register an exporter; its export_span(span) is called for every finished span."""
+    _exporters.append(exporter)
+
+
+def remove_exporter(exporter):
+    _exporters.remove(exporter)
+
+
+class JSONLinesTraceExporter:
+    """Appends every finished span to a file as one JSON object per line."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export_span(self, span):
+        line = json.dumps(span.to_dict()) + "\n"
+        with self._lock:
+            with open(self.path, "a") as file:
+                file.write(line)
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label_value(v)}"' for k, v in pairs) + "}"
+
+
+def render_prometheus():
+    """
+    Render all counters and histograms in the Prometheus text exposition format.
+
+    Returns:
+        str: The metrics, ready to be served from a /metrics endpoint.
+    """
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted(_histograms.items(), key=lambda item: item[0])
+
+    typed = set()
+    for (name, label_key), value in counters:
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_format_labels(label_key)} {value}")
+
+    for (name, label_key), histogram in histograms:
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(label_key, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(label_key, [('le', '+Inf')])} {histogram.count}")
+        lines.append(f"{name}_sum{_format_labels(label_key)} {histogram.sum}")
+        lines.append(f"{name}_count{_format_labels(label_key)} {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path):
+    """Write the Prometheus text format to a file (e.g. for the node exporter textfile collector)."""
+    with open(path, "w") as file:
+        file.write(render_prometheus())
+
+
+def configure_from_env():
+    """Enable instrumentation and exporters based on the METRICS_* environment variables."""
+    load_dotenv()
+    if os.getenv("METRICS_ENABLED", "").lower() not in ("1", "true", "yes"):
+        return
+    enable()
+    trace_file = os.getenv("METRICS_TRACE_FILE")
+    if trace_file:
+        add_exporter(JSONLinesTraceExporter(trace_file))
+    prometheus_file = os.getenv("METRICS_PROMETHEUS_FILE")
+    if prometheus_file:
+        atexit.register(write_prometheus, prometheus_file)
+
+
+configure_from_env()
@@ -0,0 +1,285 @@
+"""
+    Mock Chat Completions server
+    - A minimal OpenAI compatible HTTP server (POST /v1/chat/completions) built on asyncio streams
+    - Streams Server-Sent Events with a configurable time to first token and inter-token delay
+    - Deterministic replies: weather questions about known cities produce get_current_weather tool calls,
+      tool results are summarized, structured outputs requests (response_format json_schema) get a JSON document
+      matching the schema, anything else is echoed back
+    - Optionally answers a fraction of the requests with 500 errors (error_rate)
+    - Used as the default backend of load_test.py; point any OpenAI client at MockChatServer.base_url
+
+    Usage: python mock_server.py [--port 8000] [--ttft 0.2] [--token-delay 0.01] [--error-rate 0]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+KNOWN_CITIES = {
+    "tokyo": ("Tokyo", "celsius"),
+    "paris": ("Paris", "celsius"),
+    "san francisco": ("San Francisco", "fahrenheit"),
+}
+
+
+def schema_example(schema, definitions):
+    """A small JSON value matching a (structured outputs) JSON schema."""
+    if "$ref" in schema:
+        return schema_example(definitions[schema["$ref"].rsplit("/", 1)[-1]], definitions)
+    if "anyOf" in schema:
+        return schema_example(schema["anyOf"][0], definitions)
+    kind = schema.get("type")
+    if isinstance(kind, list):
+        kind = kind[0]
+    if kind == "object":
+        return {name: schema_example(value, definitions) for name, value in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [schema_example(schema.get("items", {}), definitions)]
+    return {"string": "mock", "integer": 1, "number": 1.0, "boolean": True}.get(kind)
+
+
+class MockChatServer:
+    """
+    Args:
+        host (str): The interface to listen on.
+        port (int): The port to listen on; 0 picks a free port.
+        ttft (float): Seconds before the first streamed chunk (and before a non-streamed reply).
+        token_delay (float): Seconds between streamed chunks.
+        model (str): The model name reported in the responses.
+        error_rate (float): Fraction of the chat completions requests answered with a 500 error, e.g. to test failover.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, ttft=0.2, token_delay=0.01, model="gpt-4o-mock", error_rate=0.0):
+        self.host = host
+        self.port = port
+        self.ttft = ttft
+        self.token_delay = token_delay
+        self.model = model
+        self.error_rate = error_rate
+        self._random = random.Random(0)
+        self.server = None
+        self._connections = {} # connection handler task -> writer, closed on shutdown
+        # Counters, e.g. to check that clients close their streams and connections
+        self.requests = 0
+        self.errors = 0
+        self.open_connections = 0
+        self.open_streams = 0
+        self.completed_streams = 0
+        self.aborted_streams = 0
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            # Keep-alive connections are not closed by server.close(); close them and let their handlers finish
+            for writer in self._connections.values():
+                writer.close()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self.server.wait_closed()
+            self.server = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    # HTTP
+
+    async def _handle_connection(self, reader, writer):
+        self.open_connections += 1
+        self._connections[asyncio.current_task()] = writer
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                if method == "POST" and path.rstrip("/").endswith("/chat/completions"):
+                    self.requests += 1
+                    await self._chat_completions(json.loads(body), writer)
+                else:
+                    await self._send_json(writer, 404, {"error": {"message": "Not found: " + path}})
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.open_connections -= 1
+            self._connections.pop(asyncio.current_task(), None)
+            writer.close()
+
+    async def _send_json(self, writer, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+
+    async def _chat_completions(self, request, writer):
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.errors += 1
+            await self._send_json(writer, 500, {"error": {"message": "Injected error", "type": "server_error"}})
+            return
+        tool_calls, content = self.reply(request)
+        prompt_tokens = sum(len(json.dumps(message)) for message in request.get("messages", [])) // 4
+        completion_id = "chatcmpl-" + uuid.uuid4().hex[:12]
+
+        if not request.get("stream"):
+            await asyncio.sleep(self.ttft)
+            message = {"role": "assistant", "content": content}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            completion_tokens = len(content.split()) if content else len(json.dumps(tool_calls)) // 4
+            await self._send_json(writer, 200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": self.model,
+                "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_calls else "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens},
+            })
+            return
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\nTransfer-Encoding: chunked\r\n\r\n"
+        )
+        self.open_streams += 1
+        try:
+            created = int(time.time())
+            deltas = list(self._deltas(tool_calls, content))
+            await asyncio.sleep(self.ttft)
+            for i, (delta, finish_reason) in enumerate(deltas):
+                if i:
+                    await asyncio.sleep(self.token_delay)
+                await self._send_event(writer, {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": self.model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                })
+            if (request.get("stream_options") or {}).get("include_usage"):
+                completion_tokens = len(deltas)
+                await self._send_event(writer, {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": self.model,
+                    "choices": [],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                              "total_tokens": prompt_tokens + completion_tokens},
+                })
+            await self._send_chunk(writer, b"data: [DONE]\n\n")
+            await self._send_chunk(writer, b"")
+            self.completed_streams += 1
+        except ConnectionError:
+            self.aborted_streams += 1
+            raise
+        finally:
+            self.open_streams -= 1
+
+    async def _send_event(self, writer, payload):
+        await self._send_chunk(writer, b"data: " + json.dumps(payload).encode("utf-8") + b"\n\n")
+
+    async def _send_chunk(self, writer, data):
+        if writer.is_closing():
+            raise ConnectionResetError("Client disconnected")
+        writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+        await writer.drain()
+
+    # Replies
+
+    def reply(self, request):
+        """
+        Decide the reply to a chat completions request.
+
+        Returns:
+            tuple: (tool_calls, content); tool_calls is None for a plain content reply.
+        """
+        messages = request.get("messages", [])
+        last = messages[-1] if messages else {}
+        tool_names = {tool["function"]["name"] for tool in request.get("tools") or []}
+
+        if last.get("role") == "tool":
+            results = [m.get("content", "") for m in messages if m.get("role") == "tool"]
+            return None, "Here is what I found: " + " ".join(str(r) for r in results)
+
+        text = str(last.get("content") or "")
+        if "get_current_weather" in tool_names:
+            cities = [(name, unit) for key, (name, unit) in KNOWN_CITIES.items() if key in text.lower()]
+            if cities:
+                return [
+                    {
+                        "id": "call_" + uuid.uuid4().hex[:12],
+                        "type": "function",
+                        "function": {
+                            "name": "get_current_weather",
+                            "arguments": json.dumps({"location": name, "unit": unit}),
+                        },
+                    }
+                    for name, unit in cities
+                ], None
+        response_format = request.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            schema = response_format["json_schema"]["schema"]
+            return None, json.dumps(schema_example(schema, schema.get("$defs", {})))
+        return None, "This is a mock response to: " + text
+
+    def _deltas(self, tool_calls, content):
+        if tool_calls:
+            for index, tool_call in enumerate(tool_calls):
+                yield {"role": "assistant", "tool_calls": [{
+                    "index": index, "id": tool_call["id"], "type": "function",
+                    "function": {"name": tool_call["function"]["name"], "arguments": ""},
+                }]}, None
+                arguments = tool_call["function"]["arguments"]
+                for start in range(0, len(arguments), 8):
+                    yield {"tool_calls": [{"index": index, "function": {"arguments": arguments[start:start + 8]}}]}, None
+            yield {}, "tool_calls"
+            return
+        yield {"role": "assistant", "content": ""}, None
+        for word in content.split(" "):
+            yield {"content": word + " "}, None
+        yield {}, "stop"
+
+
+async def main(args):
+    server = MockChatServer(port=args.port, ttft=args.ttft, token_delay=args.token_delay, error_rate=args.error_rate)
+    await server.start()
+    print(f"Mock Chat Completions server listening on {server.base_url}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock Chat Completions server")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--ttft", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="seconds between tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500 error")
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,161 @@
+"""
+    Paginated tool outputs
+    - A tool output larger than max_chars is split into pages and stored server-side; the model receives the
+      first page and a cursor, and calls the fetch_more tool with the cursor only when it needs the rest
+    - Tables (DataFrames, lists of records) are paged by rows, every page encoded on its own with the tool's
+      encoder (see tool_encoding.py), so each page keeps its header; other outputs are paged by lines
+    - Pages are only encoded when they are sent, so a large result the model never pages through costs little
+    - Paginator.register adds the fetch_more tool to a flow's tools and available functions
+"""
+import itertools
+from collections import OrderedDict
+from tool_encoding import encode_tool_output, to_records
+
+FETCH_MORE_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "fetch_more",
+        "description": "Fetch the next page of a tool result that was cut off. Only call it when the rest of the result is needed to answer.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "cursor": {"type": "string", "description": "The cursor given at the end of the previous page"},
+            },
+            "required": ["cursor"],
+        },
+    },
+}
+
+FOOTER_RESERVE = 160 # characters kept free on every page for the footer
+
+
+class PageText(str):
+    """A page of a stored result; never paginated again."""
+
+
+class _Pages:
+    """The pages of a stored result, generated on demand and cached."""
+
+    def __init__(self, pages):
+        self._pages = pages # iterator of (page, description)
+        self._cache = []
+
+    def get(self, index):
+        while len(self._cache) <= index:
+            page = next(self._pages, None)
+            if page is None:
+                return None
+            self._cache.append(page)
+        return self._cache[index]
+
+
+class Paginator:
+    """
+    Splits large tool outputs into pages.
+
+    Args:
+        max_chars (int): Outputs longer than this are paginated; every page, footer included, fits in it.
+        max_results (int): Stored results to keep; the oldest are dropped first.
+    """
+
+    def __init__(self, max_chars=2000, max_results=100):
+        self.max_chars = max_chars
+        self.max_results = max_results
+        self.results = OrderedDict() # result id -> _Pages
+        self._ids = itertools.count(1)
+
+    def paginate(self, output, encoder=None):
+        """
+        Encode a tool output, paginating it when it is too large.
+
+        Returns:
+            str: The whole encoded output, or its first page with a cursor for fetch_more.
+        """
+        if isinstance(output, PageText):
+            return output
+        encoded = encode_tool_output(output, encoder)
+        if len(encoded) <= self.max_chars:
+            return encoded
+
+        budget = max(1, self.max_chars - FOOTER_RESERVE)
+        table = to_records(output) if not isinstance(output, str) else None
+        pages = self._table_pages(output, table, encoder, budget, len(encoded)) if table else self._text_pages(encoded, budget)
+
+        result_id = f"r{next(self._ids)}"
+        self.results[result_id] = _Pages(pages)
+        while len(self.results) > self.max_results:
+            self.results.popitem(last=False)
+        return self._page(result_id, 0)
+
+    def _table_pages(self, output, table, encoder, budget, encoded_length):
+        rows, _ = table
+        start = 0
+        estimate = max(1, len(rows) * budget // encoded_length) # rows per page at the average row size
+        while start < len(rows):
+            remaining = len(rows) - start
+            # Bracket the largest number of rows that fits, starting from twice the estimate ...
+            low, high = 1, min(remaining, 2 * estimate)
+            while high < remaining and len(self._encode_rows(output, rows, start, high, encoder)) <= budget:
+                low, high = high, min(remaining, 2 * high)
+            # ... then binary search it (a single row that does not fit still makes a page)
+            while low < high:
+                middle = (low + high + 1) // 2
+                if len(self._encode_rows(output, rows, start, middle, encoder)) <= budget:
+                    low = middle
+                else:
+                    high = middle - 1
+            yield self._encode_rows(output, rows, start, low, encoder), f"rows {start + 1}-{start + low} of {len(rows)}"
+            start += low
+
+    def _encode_rows(self, output, rows, start, count, encoder):
+        # Slice the DataFrame itself rather than its records, so the encoder keeps its column order
+        if hasattr(output, "iloc"):
+            return encode_tool_output(output.iloc[start:start + count], encoder)
+        return encode_tool_output(rows[start:start + count], encoder)
+
+    def _text_pages(self, encoded, budget):
+        page, offset = "", 0
+        for line in encoded.splitlines(keepends=True):
+            while len(line) > budget: # a single line longer than a page
+                if page:
+                    yield from self._text_page(page, offset, encoded)
+                    offset, page = offset + len(page), ""
+                yield from self._text_page(line[:budget], offset, encoded)
+                offset, line = offset + budget, line[budget:]
+            if len(page) + len(line) > budget:
+                yield from self._text_page(page, offset, encoded)
+                offset, page = offset + len(page), ""
+            page += line
+        if page:
+            yield from self._text_page(page, offset, encoded)
+
+    def _text_page(self, page, offset, encoded):
+        yield page, f"characters {offset + 1}-{offset + len(page)} of {len(encoded)}"
+
+    def _page(self, result_id, index):
+        pages = self.results[result_id]
+        page, description = pages.get(index)
+        if pages.get(index + 1) is not None:
+            footer = f'[Page {index + 1}, {description}. For more, call fetch_more with cursor "{result_id}:{index + 1}".]'
+        else:
+            footer = f"[Page {index + 1}, {description}. End of the result.]"
+        return PageText(page.rstrip("\n") + "\n" + footer)
+
+    def fetch_more(self, cursor):
+        """The fetch_more tool: returns the page a cursor points to."""
+        result_id, _, index = cursor.partition(":")
+        if result_id not in self.results:
+            return "Unknown or expired cursor: " + cursor
+        if not index.isdigit() or self.results[result_id].get(int(index)) is None:
+            return "Invalid cursor: " + cursor
+        self.results.move_to_end(result_id)
+        return self._page(result_id, int(index))
+
+    def register(self, tools, available_functions):
+        """
+        Add the fetch_more tool.
+
+        Returns:
+            tuple: (tools, available_functions), new lists / dicts including fetch_more.
+        """
+        return tools + [FETCH_MORE_TOOL], {**available_functions, "fetch_more": self.fetch_more}
@@ -0,0 +1,134 @@
+"""
+    Startup prewarming
+    - The first turn of a chat loop pays for one-time setup: the TCP/TLS connection to the backend, the lazy imports
+      of the client's resources, loading and indexing tool data, and building the tool schemas
+    - Prewarm runs the warm-up steps registered by a flow in parallel before the first prompt (or first server request),
+      and reports how long each took; a failing step is reported, never fatal, the turn then pays for it as before
+    - Steps run in worker threads; a step that returns an awaitable (e.g. warm_client for an async client) is awaited
+      on the event loop
+    - warm_client opens pooled connections to every backend of a client (through the record / coalescing / router
+      wrappers) with a cheap request, and loads the client's chat resources
+    - Enabled with PREWARM=1 (see Prewarm.from_env)
+"""
+import asyncio
+import concurrent.futures
+import inspect
+import os
+import time
+from dotenv import load_dotenv
+import openai
+
+
+def client_backends(client):
+    """The OpenAI clients behind a client and its wrappers (cassette recording, coalescing, routing)."""
+    if client is None:
+        return []
+    router = getattr(client, "router", None)
+    if router is not None:
+        return [backend.client for backend in router.backends]
+    if isinstance(client, (openai.OpenAI, openai.AsyncOpenAI)):
+        return [client]
+    return client_backends(getattr(client, "client", None)) # wrappers keep the wrapped client in .client
+
+
+def warm_client(client, connections=1):
+    """
+    Open `connections` pooled connections to every backend of a client.
+    Any HTTP answer (even an error status) leaves a connection in the pool; connection errors are raised.
+
+    Returns:
+        None for sync clients (the connections are open on return), or an awaitable for async clients.
+    """
+    backends = client_backends(client)
+    for backend in backends:
+        backend.chat.completions # load the lazily imported chat resources
+
+    sync_backends = [backend for backend in backends if not isinstance(backend, openai.AsyncOpenAI)]
+    for backend in sync_backends:
+        with concurrent.futures.ThreadPoolExecutor(connections) as executor:
+            list(executor.map(lambda _: _list_models(backend), range(connections)))
+
+    async_backends = [backend for backend in backends if isinstance(backend, openai.AsyncOpenAI)]
+    if async_backends:
+        return _warm_async(async_backends, connections)
+    return None
+
+
+async def _warm_async(backends, connections):
+    await asyncio.gather(*(_list_models_async(backend) for backend in backends for _ in range(connections)))
+
+
+def _list_models(client):
+    try:
+        client.models.list()
+    except openai.APIStatusError:
+        pass
+
+
+async def _list_models_async(client):
+    try:
+        await client.models.list()
+    except openai.APIStatusError:
+        pass
+
+
+class Prewarm:
+    """
+    Warm-up steps of a flow.
+
+    Args:
+        enabled (bool): When False, run does nothing.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.steps = [] # (name, function, args)
+        self.timings = {} # name -> seconds, or the error message of a failed step
+
+    @classmethod
+    def from_env(cls):
+        """Enabled when PREWARM is set to 1 / true / yes."""
+        load_dotenv()
+        return cls(enabled=os.getenv("PREWARM", "").lower() in ("1", "true", "yes"))
+
+    def add(self, name, function, *args):
+        self.steps.append((name, function, args))
+        return self
+
+    async def _step(self, name, function, args):
+        start = time.perf_counter()
+        try:
+            result = await asyncio.to_thread(function, *args)
+            if inspect.isawaitable(result):
+                await result
+            self.timings[name] = time.perf_counter() - start
+        except Exception as e:
+            self.timings[name] = f"{type(e).__name__}: {e}"
+
+    async def run(self, verbose=True):
+        """
+        Run the steps in parallel.
+
+        Returns:
+            dict: name -> seconds, or the error message of a failed step.
+        """
+        if not self.enabled or not self.steps:
+            return {}
+        start = time.perf_counter()
+        await asyncio.gather(*(self._step(name, function, args) for name, function, args in self.steps))
+        if verbose:
+            print(self.report(time.perf_counter() - start))
+        return self.timings
+
+    def run_sync(self, verbose=True):
+        """Run the steps from synchronous code (steps returning an awaitable are awaited in a new event loop)."""
+        if not self.enabled or not self.steps:
+            return {}
+        return asyncio.run(self.run(verbose))
+
+    def report(self, elapsed):
+        steps = ", ".join(
+            f"{name} {value * 1000:.0f} ms" if isinstance(value, float) else f"{name} failed ({value})"
+            for name, value in self.timings.items()
+        )
+        return f"Prewarmed in {elapsed * 1000:.0f} ms: {steps}"
@@ -0,0 +1,264 @@
+"""
+    On-demand profiling of chat turns
+    - Wraps individual turns (or every Nth turn) with cProfile and tracemalloc
+    - Writes, per profiled turn and tagged with the session and turn id:
+        <session>_turn<N>.pstats       raw cProfile stats (open with pstats or snakeviz)
+        <session>_turn<N>.collapsed    collapsed stacks for flamegraph.pl / speedscope (microseconds)
+        <session>_turn<N>.txt          top functions by cumulative time and top allocations
+    - Note: in async flows cProfile sees everything that runs on the event loop during the turn; the reports are
+      written in a worker thread after the turn
+
+    Configuration (environment variables, also read from .env):
+        PROFILE_TURNS=N          profile every Nth turn (1 = every turn, 0 = off)
+        PROFILE_DIR=path         where the reports are written (default: output/profiles)
+
+    Commands (typed at the User:> prompt of the chat examples):
+        /profile next | on | off | every N
+"""
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import time
+import tracemalloc
+import uuid
+from collections import defaultdict
+from dotenv import load_dotenv
+
+
+def _func_label(func):
+    filename, lineno, name = func
+    if filename == "~":
+        # Built-in functions, e.g. <built-in method time.sleep>
+        return name.strip("<>")
+    return f"{os.path.basename(filename)}:{name}:{lineno}"
+
+
+def collapsed_stacks(profile, max_depth=64):
+    """
+    Build collapsed stacks ("root;child;leaf <microseconds>") from cProfile stats.
+    cProfile only records caller/callee edges, not full stacks, and enumerating every caller path
+    grows exponentially on real profiles. Instead, the self time of a function is split between its
+    direct callers in proportion to the time spent on each edge, and each caller is drawn with its
+    heaviest call path (following the caller with the most time on its edge, memoized per function),
+    so the work and the output are linear in the number of caller/callee edges.
+
+    Args:
+        profile (cProfile.Profile): A profile that has been disabled.
+        max_depth (int): The maximum stack depth drawn.
+
+    Returns:
+        list: The collapsed stack lines.
+    """
+    stats = pstats.Stats(profile).stats
+
+    def edge_weights(func):
+        callers = {caller: edge for caller, edge in stats[func][4].items() if caller != func and caller in stats}
+        weights = {caller: edge[3] for caller, edge in callers.items()}
+        if sum(weights.values()) <= 0:
+            weights = {caller: edge[1] for caller, edge in callers.items()} # no time recorded: by call count
+        return weights
+
+    heaviest_caller = {}
+    for func in stats:
+        weights = edge_weights(func)
+        heaviest_caller[func] = max(weights, key=weights.get) if weights and max(weights.values()) > 0 else None
+
+    paths = {} # func -> its heaviest call path, as a tuple of labels ending with the function
+
+    def heaviest_path(func):
+        if func in paths:
+            return paths[func]
+        chain = [func]
+        caller = heaviest_caller[func]
+        while caller is not None and caller not in paths and caller not in chain and len(chain) < max_depth:
+            chain.append(caller)
+            caller = heaviest_caller[caller]
+        prefix = paths[caller] if caller in paths else ()
+        for f in reversed(chain):
+            prefix = (prefix + (_func_label(f),))[-max_depth:]
+            paths[f] = prefix
+        return paths[func]
+
+    totals = defaultdict(float)
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        if tt <= 0:
+            continue
+        weights = {caller: weight for caller, weight in edge_weights(func).items() if weight > 0}
+        total = sum(weights.values())
+        if not total:
+            totals[";".join(heaviest_path(func))] += tt
+            continue
+        for caller, weight in weights.items():
+            stack = (heaviest_path(caller) + (_func_label(func),))[-max_depth:]
+            totals[";".join(stack)] += tt * weight / total
+
+    return [f"{stack} {round(seconds * 1e6)}" for stack, seconds in sorted(totals.items()) if seconds * 1e6 >= 1]
+
+
+class _TurnProfile:
+    """Context manager (sync or async) that profiles one turn and writes its reports."""
+
+    def __init__(self, profiler, turn_id):
+        self.profiler = profiler
+        self.turn_id = turn_id
+        self.profile = None
+        self.snapshot = None
+        self.started_tracemalloc = False
+        self.start = None
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.profiler.traceback_depth)
+            self.started_tracemalloc = True
+        self.snapshot = tracemalloc.take_snapshot()
+        self.profile = cProfile.Profile()
+        self.start = time.perf_counter()
+        self.profile.enable()
+        return self
+
+    def _stop(self):
+        """Stop profiling; returns the arguments of _write_reports."""
+        self.profile.disable()
+        elapsed = time.perf_counter() - self.start
+        snapshot = tracemalloc.take_snapshot()
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+        return self.turn_id, elapsed, self.profile, self.snapshot, snapshot
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler._write_reports(*self._stop())
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # The profile is stopped on the event loop's thread (cProfile profiles the thread that enabled it),
+        # the reports are written in a worker thread so the other sessions keep being served
+        await asyncio.to_thread(self.profiler._write_reports, *self._stop())
+        return False
+
+
+class _NoopTurnProfile:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_TURN_PROFILE = _NoopTurnProfile()
+
+
+class TurnProfiler:
+    """
+    Decides which turns to profile and writes the reports.
+
+    Args:
+        every (int): Profile every Nth turn (1 = every turn, 0 = only when requested with /profile next).
+        output_dir (str): Where the reports are written.
+        session_id (str, optional): Tag for the report files; a random id is used by default.
+        top (int): Number of functions and allocation sites listed in the text report.
+        traceback_depth (int): Frames kept per allocation by tracemalloc.
+    """
+
+    def __init__(self, every=0, output_dir="output/profiles", session_id=None, top=25, traceback_depth=1):
+        self.every = every
+        self.output_dir = output_dir
+        self.session_id = session_id or uuid.uuid4().hex[:8]
+        self.top = top
+        self.traceback_depth = traceback_depth
+        self.turn_count = 0
+        self.profile_next = False
+        self.reports = [] # paths of the text reports written so far
+
+    @classmethod
+    def from_env(cls, session_id=None):
+        load_dotenv()
+        return cls(
+            every=int(os.getenv("PROFILE_TURNS", "0") or 0),
+            output_dir=os.getenv("PROFILE_DIR", "output/profiles"),
+            session_id=session_id,
+        )
+
+    def handle_command(self, user_input):
+        """
+        Handle a /profile command typed by the user.
+
+        Returns:
+            bool: True if the input was a /profile command (and should not be sent to the model).
+        """
+        parts = user_input.strip().split()
+        if not parts or parts[0] != "/profile":
+            return False
+        argument = parts[1] if len(parts) > 1 else "next"
+        if argument == "next":
+            self.profile_next = True
+            print("Profiling the next turn.")
+        elif argument == "on":
+            self.every = 1
+            print("Profiling every turn.")
+        elif argument == "off":
+            self.every = 0
+            self.profile_next = False
+            print("Profiling off.")
+        elif argument == "every" and len(parts) > 2 and parts[2].isdigit():
+            self.every = int(parts[2])
+            print(f"Profiling every {self.every} turns.")
+        else:
+            print("Usage: /profile next | on | off | every N")
+        return True
+
+    def turn(self, turn_id=None):
+        """
+        Start a turn; profiles it if it is selected.
+        Use with `with` or `async with` around the work of the turn.
+        """
+        self.turn_count += 1
+        turn_id = turn_id if turn_id is not None else self.turn_count
+        selected = self.profile_next or (self.every > 0 and self.turn_count % self.every == 0)
+        if not selected:
+            return _NOOP_TURN_PROFILE
+        self.profile_next = False
+        return _TurnProfile(self, turn_id)
+
+    def _write_reports(self, turn_id, elapsed, profile, snapshot_before, snapshot_after):
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, f"{self.session_id}_turn{turn_id}")
+
+        profile.dump_stats(base + ".pstats")
+
+        with open(base + ".collapsed", "w") as file:
+            file.write("\n".join(collapsed_stacks(profile)) + "\n")
+
+        stats_text = io.StringIO()
+        pstats.Stats(profile, stream=stats_text).sort_stats("cumulative").print_stats(self.top)
+
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ]
+        allocation_diff = snapshot_after.filter_traces(filters).compare_to(
+            snapshot_before.filter_traces(filters), "lineno"
+        )
+        allocated = sum(stat.size_diff for stat in allocation_diff if stat.size_diff > 0)
+
+        with open(base + ".txt", "w") as file:
+            file.write(f"session: {self.session_id}\nturn: {turn_id}\nwall time: {elapsed:.3f}s\n")
+            file.write(f"net allocated: {allocated / 1024:.1f} KiB\n\n")
+            file.write(f"Top {self.top} allocation sites (size diff):\n")
+            for stat in allocation_diff[: self.top]:
+                file.write(f"  {stat}\n")
+            file.write(f"\nTop {self.top} functions by cumulative time:\n")
+            file.write(stats_text.getvalue())
+
+        self.reports.append(base + ".txt")
+        print(f"\n[profile] session {self.session_id} turn {turn_id}: {base}.txt")
@@ -0,0 +1,478 @@
+"""
+    Latency-aware routing across several backends
+    - RouterClient / AsyncRouterClient stand in for an OpenAI client and spread chat completion calls (create, and the
+      structured outputs beta.chat.completions.parse / stream) over a list of backends (Azure deployments or regions,
+      OpenAI, Ollama, or any OpenAI compatible server) read from a JSON file
+    - Every backend tracks its calls in flight and a rolling (exponentially weighted) time to first token and error rate
+    - Each call goes to the better of two backends picked at random in proportion to their weights
+      (power of two choices), scored by their expected time to first token under their current load
+    - Circuit breaker: after consecutive failures a backend is taken out of rotation; after a cool down a single
+      probe call is let through (half open), which closes the circuit again if it succeeds
+    - Calls that fail before any output (connection errors, timeouts, 429 and 5xx) are retried on another backend;
+      the model parameter of each call is replaced with the model / deployment of the backend it is sent to
+
+    Backends file (BACKENDS_FILE, e.g. backends.json):
+        [
+            {"name": "azure-eastus", "type": "azure", "endpoint": "https://....openai.azure.com",
+             "api_key_env": "AZURE_OPENAI_API_KEY", "api_version": "2024-08-01-preview", "model": "gpt-4o", "weight": 2},
+            {"name": "openai", "type": "openai", "api_key_env": "OPENAI_KEY", "model": "gpt-4o"},
+            {"name": "local", "type": "ollama", "model": "llama3.1"}
+        ]
+"""
+import json
+import os
+import random
+import threading
+import time
+import openai
+from dotenv import load_dotenv
+import metrics
+
+# Model name the examples use when routing; every call is sent with the model of the backend it goes to
+ROUTED_MODEL = "routed"
+
+# Errors after which a call is retried on another backend, and counted against the backend
+RETRYABLE_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError) # APIConnectionError includes APITimeoutError
+
+
+def make_client(config, asynchronous=False):
+    """
+    Create the client of a backend.
+
+    Args:
+        config (dict): The backend settings: type ("azure", "openai" or "ollama"), endpoint (azure), base_url,
+            api_key or api_key_env (the environment variable holding the key), api_version (azure), timeout.
+        asynchronous (bool): Create an async client.
+    """
+    kind = config.get("type", "openai")
+    api_key = config.get("api_key") or os.getenv(config.get("api_key_env", ""), "")
+    # The router retries on another backend, so the clients do not retry themselves
+    options = {"max_retries": config.get("max_retries", 0)}
+    if config.get("timeout") is not None:
+        options["timeout"] = config["timeout"]
+    if kind == "azure":
+        client_class = openai.AsyncAzureOpenAI if asynchronous else openai.AzureOpenAI
+        return client_class(azure_endpoint=config["endpoint"], api_key=api_key, api_version=config.get("api_version"), **options)
+    if kind == "ollama":
+        config = {"base_url": "http://localhost:11434/v1", **config}
+        api_key = api_key or "nokeyneeded"
+    elif kind != "openai":
+        raise ValueError("Unknown backend type: " + str(kind))
+    client_class = openai.AsyncOpenAI if asynchronous else openai.OpenAI
+    return client_class(base_url=config.get("base_url"), api_key=api_key, **options)
+
+
+class Backend:
+    """
+    A backend and its rolling health.
+
+    Args:
+        name (str): The name used in metrics and stats.
+        client: The (sync or async) OpenAI client of the backend.
+        model (str): The model or deployment name used on this backend.
+        weight (float): The relative share of the calls it is picked for.
+        alpha (float): Weight of the latest sample in the rolling averages.
+        failure_threshold (int): Consecutive failures that open the circuit.
+        cooldown (float): Seconds an open circuit waits before letting a probe call through.
+    """
+
+    def __init__(self, name, client, model, weight=1.0, alpha=0.2, failure_threshold=3, cooldown=30.0):
+        self.name = name
+        self.client = client
+        self.model = model
+        self.weight = weight
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.ttft = None # rolling time to first token (s), None until the first success
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.opened_at = None # when the circuit opened (time.monotonic), None while closed
+        self.probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.probing or time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def available(self, now):
+        """Whether a call can be sent: the circuit is closed, or cooled down and not already probed."""
+        return self.opened_at is None or (not self.probing and now - self.opened_at >= self.cooldown)
+
+    def score(self):
+        """
+        Expected time to first token under the current load, with the error rate counted as up to a second
+        of extra latency. Untried backends score 0, so they get tried.
+        """
+        return ((self.ttft or 0.0) + self.error_rate) * (1 + self.in_flight) / self.weight
+
+    def start(self):
+        self.in_flight += 1
+        if self.opened_at is not None:
+            self.probing = True
+
+    def finish(self):
+        self.in_flight -= 1
+
+    def success(self, ttft=None):
+        if ttft is not None:
+            self.ttft = ttft if self.ttft is None else self.alpha * ttft + (1 - self.alpha) * self.ttft
+            metrics.observe("backend_ttft_seconds", ttft, backend=self.name)
+        self.error_rate *= 1 - self.alpha
+        self.consecutive_failures = 0
+        if self.opened_at is not None:
+            metrics.increment("backend_circuit_closed_total", backend=self.name)
+        self.opened_at = None
+        self.probing = False
+
+    def failure(self):
+        self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+        self.consecutive_failures += 1
+        metrics.increment("backend_errors_total", backend=self.name)
+        if self.probing or (self.opened_at is None and self.consecutive_failures >= self.failure_threshold):
+            metrics.increment("backend_circuit_opened_total", backend=self.name)
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "state": self.state,
+            "ttft": self.ttft,
+            "error_rate": round(self.error_rate, 4),
+            "in_flight": self.in_flight,
+        }
+
+
+class Router:
+    """
+    Picks a backend for each call.
+
+    Args:
+        backends (list): The Backend objects.
+        max_attempts (int, optional): Backends tried per call; defaults to all of them.
+        seed (int, optional): Seed of the random picks.
+    """
+
+    def __init__(self, backends, max_attempts=None, seed=None):
+        if not backends:
+            raise ValueError("The router needs at least one backend")
+        self.backends = list(backends)
+        self.max_attempts = max_attempts or len(self.backends)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def choose(self, exclude=()):
+        """
+        Pick the backend for the next attempt of a call, and count it in flight.
+
+        Returns:
+            Backend: The better of two weighted random picks among the available backends, or None if every
+            backend was already tried. When every circuit is open, the backend whose circuit opened first is tried.
+        """
+        with self._lock:
+            now = time.monotonic()
+            remaining = [backend for backend in self.backends if backend not in exclude]
+            if not remaining:
+                return None
+            candidates = [backend for backend in remaining if backend.available(now)]
+            if not candidates:
+                backend = min(remaining, key=lambda backend: backend.opened_at)
+            elif len(candidates) == 1:
+                backend = candidates[0]
+            else:
+                first = self._random.choices(candidates, [b.weight for b in candidates])[0]
+                others = [b for b in candidates if b is not first]
+                second = self._random.choices(others, [b.weight for b in others])[0]
+                backend = min((first, second), key=Backend.score)
+            backend.start()
+            return backend
+
+    def record(self, backend, ttft=None, error=None):
+        """Record the outcome of a call: its time to first token on success, or a (retryable) error."""
+        with self._lock:
+            if error is not None:
+                backend.failure()
+            else:
+                backend.success(ttft)
+
+    def release(self, backend):
+        with self._lock:
+            backend.finish()
+
+    def stats(self):
+        with self._lock:
+            return [backend.stats() for backend in self.backends]
+
+
+class _RoutedStream:
+    """A streamed completion from a backend; records its time to first token and mid-stream errors."""
+
+    def __init__(self, stream, router, backend, start):
+        self._stream = stream
+        self._router = router
+        self._backend = backend
+        self._start = start
+        self._released = False
+
+    def __getattr__(self, name):
+        # e.g. get_final_completion() of a structured outputs stream
+        return getattr(self._stream, name)
+
+    def _chunk(self, first):
+        if first:
+            self._router.record(self._backend, ttft=time.perf_counter() - self._start)
+
+    def _error(self, e):
+        if isinstance(e, RETRYABLE_ERRORS):
+            self._router.record(self._backend, error=e)
+
+    def _release(self):
+        if not self._released:
+            self._released = True
+            self._router.release(self._backend)
+
+    def __iter__(self):
+        first = True
+        try:
+            for chunk in self._stream:
+                self._chunk(first)
+                first = False
+                yield chunk
+        except Exception as e:
+            self._error(e)
+            raise
+        finally:
+            self._release()
+
+    def close(self):
+        self._release()
+        self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class _AsyncRoutedStream(_RoutedStream):
+    async def __aiter__(self):
+        first = True
+        try:
+            async for chunk in self._stream:
+                self._chunk(first)
+                first = False
+                yield chunk
+        except Exception as e:
+            self._error(e)
+            raise
+        finally:
+            self._release()
+
+    async def close(self):
+        self._release()
+        await self._stream.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+class _RoutedStreamManager:
+    """
+    beta.chat.completions.stream through the router: the backend's stream manager is entered (which sends the
+    request) on a backend picked by the router, and retried on another one if that fails before any output.
+    """
+
+    def __init__(self, completions, kwargs):
+        self._completions = completions
+        self._kwargs = kwargs
+        self._manager = None
+        self._stream = None
+
+    def _stream_on(self, backend):
+        return self._completions._methods(backend).stream(**{**self._kwargs, "model": backend.model})
+
+    def __enter__(self):
+        tried = []
+        while True:
+            backend = self._completions._choose(tried)
+            start = time.perf_counter()
+            manager = self._stream_on(backend)
+            try:
+                stream = manager.__enter__()
+            except Exception as e:
+                self._completions._failed(backend, e, tried)
+                continue
+            self._manager = manager
+            self._stream = _RoutedStream(stream, self._completions._router, backend, start)
+            return self._stream
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stream._release()
+        return self._manager.__exit__(exc_type, exc, tb)
+
+
+class _AsyncRoutedStreamManager(_RoutedStreamManager):
+    async def __aenter__(self):
+        tried = []
+        while True:
+            backend = self._completions._choose(tried)
+            start = time.perf_counter()
+            manager = self._stream_on(backend)
+            try:
+                stream = await manager.__aenter__()
+            except Exception as e:
+                self._completions._failed(backend, e, tried)
+                continue
+            self._manager = manager
+            self._stream = _AsyncRoutedStream(stream, self._completions._router, backend, start)
+            return self._stream
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._stream._release()
+        return await self._manager.__aexit__(exc_type, exc, tb)
+
+
+class _RouterCompletions:
+    """chat.completions (or beta.chat.completions) of the router: create, parse and stream."""
+
+    def __init__(self, router, asynchronous, beta=False):
+        self._router = router
+        self._asynchronous = asynchronous
+        self._beta = beta
+
+    def _methods(self, backend):
+        return backend.client.beta.chat.completions if self._beta else backend.client.chat.completions
+
+    def create(self, **kwargs):
+        return self._call("create", kwargs)
+
+    def parse(self, **kwargs):
+        return self._call("parse", kwargs)
+
+    def stream(self, **kwargs):
+        return (_AsyncRoutedStreamManager if self._asynchronous else _RoutedStreamManager)(self, kwargs)
+
+    def _call(self, method, kwargs):
+        if self._asynchronous:
+            return self._call_async(method, kwargs)
+        tried = []
+        while True:
+            backend = self._choose(tried)
+            start = time.perf_counter()
+            try:
+                result = getattr(self._methods(backend), method)(**{**kwargs, "model": backend.model})
+            except Exception as e:
+                self._failed(backend, e, tried)
+                continue
+            return self._wrap(result, backend, start, kwargs)
+
+    async def _call_async(self, method, kwargs):
+        tried = []
+        while True:
+            backend = self._choose(tried)
+            start = time.perf_counter()
+            try:
+                result = await getattr(self._methods(backend), method)(**{**kwargs, "model": backend.model})
+            except Exception as e:
+                self._failed(backend, e, tried)
+                continue
+            return self._wrap(result, backend, start, kwargs)
+
+    def _choose(self, tried):
+        backend = self._router.choose([b for b, _ in tried]) if len(tried) < self._router.max_attempts else None
+        if backend is None:
+            raise tried[-1][1]
+        tried.append((backend, None))
+        metrics.increment("backend_requests_total", backend=backend.name)
+        return backend
+
+    def _failed(self, backend, e, tried):
+        """Record a failed attempt; re-raise errors that another backend would not fix (e.g. a bad request)."""
+        self._router.release(backend)
+        tried[-1] = (backend, e)
+        if not isinstance(e, RETRYABLE_ERRORS):
+            if isinstance(e, openai.APIStatusError):
+                self._router.record(backend) # the backend is up, the request is wrong
+            raise e
+        self._router.record(backend, error=e)
+        metrics.increment("backend_retries_total", backend=backend.name)
+
+    def _wrap(self, result, backend, start, request):
+        if request.get("stream"):
+            stream_class = _AsyncRoutedStream if self._asynchronous else _RoutedStream
+            return stream_class(result, self._router, backend, start)
+        self._router.record(backend, ttft=time.perf_counter() - start)
+        self._router.release(backend)
+        return result
+
+
+class _Namespace:
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+class RouterClient:
+    """
+    A stand-in for openai.OpenAI that routes chat completion calls across backends: chat.completions.create,
+    and the structured outputs calls beta.chat.completions.parse and stream.
+
+    Args:
+        backends (list): Backend objects with sync clients.
+        **options: Router options (max_attempts, seed).
+    """
+
+    asynchronous = False
+
+    def __init__(self, backends, **options):
+        self.router = Router(backends, **options)
+        self.chat = _Namespace(completions=_RouterCompletions(self.router, self.asynchronous))
+        self.beta = _Namespace(chat=_Namespace(completions=_RouterCompletions(self.router, self.asynchronous, beta=True)))
+
+    @classmethod
+    def from_configs(cls, configs, **options):
+        """Create the router from backend settings (see make_client; plus name, model, weight, failure_threshold, cooldown)."""
+        backends = []
+        for i, config in enumerate(configs):
+            backend_options = {key: config[key] for key in ("weight", "failure_threshold", "cooldown") if key in config}
+            backends.append(Backend(
+                config.get("name") or f"backend{i + 1}",
+                make_client(config, cls.asynchronous),
+                config["model"],
+                **backend_options,
+            ))
+        return cls(backends, **options)
+
+    @classmethod
+    def from_file(cls, path, **options):
+        with open(path, "r") as file:
+            return cls.from_configs(json.load(file), **options)
+
+    @classmethod
+    def from_env(cls):
+        """Create the router from the JSON file in BACKENDS_FILE (default backends.json)."""
+        load_dotenv()
+        return cls.from_file(os.getenv("BACKENDS_FILE") or "backends.json")
+
+    def stats(self):
+        return self.router.stats()
+
+    def close(self):
+        for backend in self.router.backends:
+            backend.client.close()
+
+
+class AsyncRouterClient(RouterClient):
+    """A stand-in for openai.AsyncOpenAI that routes chat completion calls across backends."""
+
+    asynchronous = True
+
+    async def close(self):
+        for backend in self.router.backends:
+            await backend.client.close()
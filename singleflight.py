@@ -0,0 +1,285 @@
+"""
+    Singleflight coalescing of identical in-flight completion requests
+    - CoalescingClient wraps an OpenAI client; concurrent calls with identical parameters (same canonical request hash)
+      share a single upstream call instead of each making their own
+    - Complete responses: every caller gets the same response object
+    - Streamed responses (async clients): the chunks are fanned out to every caller; a caller that joins while the
+      stream is running first gets the chunks already received, then the rest as they arrive
+    - Only in-flight calls are shared, nothing is cached: a request made after the shared call finished is sent again
+    - The shared call is cancelled (and its stream closed) only when every caller has cancelled or closed its stream
+    - Counters: upstream_calls and calls_saved, also recorded as metrics (singleflight_*_total)
+    - Exactly one caller owns a shared call's usage; the others get results marked as shared (see is_shared), which
+      the usage ledger counts as saved instead of billing the same call again
+    - Covers chat.completions.create and beta.chat.completions.parse; sync clients coalesce complete responses
+      across threads, sync streams are passed through
+    - Identical requests with a temperature above 0 all get the same sample; enable with COALESCE_REQUESTS=1
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import threading
+from dotenv import load_dotenv
+import openai
+import metrics
+from streams import aclose_stream
+
+
+def _to_json(obj):
+    if isinstance(obj, type) and hasattr(obj, "model_json_schema"): # a response_format model class
+        return {"model": obj.__qualname__, "schema": obj.model_json_schema()}
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(mode="json", exclude_unset=True)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def is_shared(result):
+    """True for a response or stream shared with another caller, whose usage that caller records."""
+    return getattr(result, "shared", False) is True
+
+
+def request_hash(method, request):
+    """Canonical hash of a call: the method name and its parameters."""
+    canonical = json.dumps([method, request], sort_keys=True, separators=(",", ":"), default=_to_json)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class _StreamFanout:
+    """Reads an upstream stream once and replays its chunks to every subscriber."""
+
+    def __init__(self, stream, on_done):
+        self._stream = stream
+        self._on_done = on_done
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._changed = asyncio.Event()
+        self._subscribers = []
+        self.owner = None # the subscriber that records the usage of the call
+        self._pump = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        try:
+            async for chunk in self._stream:
+                self.chunks.append(chunk)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+            self._on_done()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def subscribe(self):
+        stream = _FanoutStream(self)
+        self._subscribers.append(stream)
+        if self.owner is None:
+            self.owner = stream
+        return stream
+
+    async def unsubscribe(self, stream):
+        self._subscribers.remove(stream)
+        if self.owner is stream and self._subscribers and not stream.read_usage():
+            self.owner = self._subscribers[0] # the usage (in the last chunk) is recorded by a subscriber still reading
+        if not self._subscribers and not self.done:
+            # Nobody reads the stream anymore: stop the upstream generation (new requests get a new call)
+            self._on_done()
+            self._pump.cancel()
+            await asyncio.gather(self._pump, return_exceptions=True)
+            await aclose_stream(self._stream)
+
+
+class _FanoutStream:
+    """A subscriber's view of a shared stream; iterate and close it like the client's stream."""
+
+    def __init__(self, fanout):
+        self._fanout = fanout
+        self._closed = False
+        self._index = 0 # chunks read
+
+    def read_usage(self):
+        """Whether the chunk carrying the usage was read."""
+        return any(getattr(chunk, "usage", None) is not None for chunk in self._fanout.chunks[:self._index])
+
+    @property
+    def shared(self):
+        return self._fanout.owner is not self
+
+    async def __aiter__(self):
+        fanout = self._fanout
+        try:
+            while True:
+                changed = fanout._changed
+                if self._index < len(fanout.chunks):
+                    self._index += 1
+                    yield fanout.chunks[self._index - 1]
+                elif fanout.done:
+                    if fanout.error is not None:
+                        raise fanout.error
+                    return
+                else:
+                    await changed.wait()
+        finally:
+            await self.close()
+
+    async def close(self):
+        if not self._closed:
+            self._closed = True
+            await self._fanout.unsubscribe(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+class _Flight:
+    """An in-flight upstream call and the callers waiting for it."""
+
+    def __init__(self, call):
+        self.task = asyncio.ensure_future(call) if call is not None else None
+        self.waiters = 0
+        self.fanout = None # _StreamFanout, once a streamed call returned its stream
+        self.done = threading.Event() # sync calls
+        self.delivered = False # the result was returned to a caller, later callers get it marked as shared
+        self.result = None
+        self.error = None
+
+
+class _CoalescingMethod:
+    """Coalesces the calls of one client method (e.g. chat.completions.create)."""
+
+    def __init__(self, client, name, method, asynchronous):
+        self._client = client
+        self._name = name
+        self._method = method
+        self._asynchronous = asynchronous
+        self._flights = {} # request hash -> _Flight
+        self._lock = threading.Lock()
+
+    def __call__(self, **kwargs):
+        if self._asynchronous:
+            return self._call_async(kwargs)
+        if kwargs.get("stream"):
+            return self._method(**kwargs)
+        return self._call_sync(kwargs)
+
+    def _count(self, saved):
+        if saved:
+            self._client.calls_saved += 1
+            metrics.increment("singleflight_calls_saved_total", method=self._name)
+        else:
+            self._client.upstream_calls += 1
+            metrics.increment("singleflight_upstream_calls_total", method=self._name)
+
+    def _forget(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def _call_async(self, kwargs):
+        key = request_hash(self._name, kwargs)
+        flight = self._flights.get(key)
+        self._count(saved=flight is not None)
+        if flight is None:
+            flight = self._flights[key] = _Flight(self._method(**kwargs))
+            flight.task.add_done_callback(functools.partial(self._called, key, flight, bool(kwargs.get("stream"))))
+        elif flight.fanout is not None: # the shared stream is running: join it
+            return flight.fanout.subscribe()
+
+        flight.waiters += 1
+        try:
+            result = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel() # nobody waits for the call anymore
+            raise
+        flight.waiters -= 1
+        if flight.fanout is not None:
+            return flight.fanout.subscribe()
+        if flight.delivered:
+            return _Proxy(result, shared=True)
+        flight.delivered = True
+        return result
+
+    def _called(self, key, flight, stream, task):
+        if stream and not task.cancelled() and task.exception() is None:
+            # Keep the flight while its stream runs, so identical requests can join it
+            flight.fanout = _StreamFanout(task.result(), functools.partial(self._forget, key, flight))
+        else:
+            self._forget(key, flight)
+
+    def _call_sync(self, kwargs):
+        key = request_hash(self._name, kwargs)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight(None)
+        self._count(saved=not leader)
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return _Proxy(flight.result, shared=True)
+
+        try:
+            flight.result = self._method(**kwargs)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._forget(key, flight)
+            flight.done.set()
+
+
+class _Proxy:
+    """Delegates to target, except for the attributes given."""
+
+    def __init__(self, target, **attributes):
+        self._target = target
+        self.__dict__.update(attributes)
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+
+class CoalescingClient:
+    """
+    Wraps a (sync or async) OpenAI client so that concurrent identical requests share one upstream call.
+
+    Args:
+        client: The client to wrap.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.upstream_calls = 0
+        self.calls_saved = 0
+        # AsyncOpenAI includes AsyncAzureOpenAI; stand-in clients such as AsyncRouterClient declare it
+        self.asynchronous = isinstance(client, openai.AsyncOpenAI) or getattr(client, "asynchronous", False)
+        create = _CoalescingMethod(self, "chat.completions.create", client.chat.completions.create, self.asynchronous)
+        self.chat = _Proxy(client.chat, completions=_Proxy(client.chat.completions, create=create))
+        beta = getattr(client, "beta", None)
+        if beta is not None and hasattr(beta, "chat"):
+            parse = _CoalescingMethod(self, "beta.chat.completions.parse", beta.chat.completions.parse, self.asynchronous)
+            self.beta = _Proxy(beta, chat=_Proxy(beta.chat, completions=_Proxy(beta.chat.completions, parse=parse)))
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def from_env(client):
+    """Wrap the client in a CoalescingClient when COALESCE_REQUESTS is enabled."""
+    load_dotenv()
+    if client is None or os.getenv("COALESCE_REQUESTS", "").lower() not in ("1", "true", "yes"):
+        return client
+    return CoalescingClient(client)
@@ -0,0 +1,147 @@
+"""
+    SSE frame encoding
+    - Encodes ChatCompletionChunk deltas straight into Server-Sent Events frames (bytes)
+    - The per-stream fields (id, model, created, object) are serialized once into a precomputed envelope
+    - Content deltas are spliced between the envelope prefix and suffix, so no intermediate dicts are built per token
+    - Uses orjson as the JSON backend when it is installed, otherwise falls back to the standard json module
+"""
+import json
+
+SSE_DONE_FRAME = b"data: [DONE]\n\n"
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+try:
+    import orjson
+
+    _default_dumps = orjson.dumps
+    JSON_BACKEND = "orjson"
+except ImportError:
+    _default_dumps = _stdlib_dumps
+    JSON_BACKEND = "json"
+
+
+def get_json_dumps(backend=None):
+    """
+    Get a JSON serializer that returns bytes.
+
+    Args:
+        backend (str | callable, optional): "orjson", "json", a callable returning bytes,
+            or None to use the fastest backend available.
+
+    Returns:
+        callable: A function that serializes an object to UTF-8 encoded JSON bytes.
+    """
+    if backend is None:
+        return _default_dumps
+    if callable(backend):
+        return backend
+    if backend == "orjson":
+        import orjson
+        return orjson.dumps
+    if backend == "json":
+        return _stdlib_dumps
+    raise ValueError("Unknown JSON backend: " + str(backend))
+
+
+class StreamEnvelope:
+    """
+    Precomputed SSE envelope for a single stream.
+
+    The envelope matches the payload produced by format_stream_response:
+        {"id": ..., "model": ..., "created": ..., "object": ..., "choices": [{"messages": [...]}]}
+    Only the message inside "messages" changes from chunk to chunk.
+    """
+
+    def __init__(self, id, model, created, object="chat.completion.chunk", dumps=None):
+        self.dumps = dumps or _default_dumps
+        head = (
+            b'data: {"id":' + self.dumps(id)
+            + b',"model":' + self.dumps(model)
+            + b',"created":' + self.dumps(created)
+            + b',"object":' + self.dumps(object)
+            + b',"choices":[{"messages":[{"role":'
+        )
+        self._content_prefix = head + b'"assistant","content":'
+        self._tool_prefix = head + b'"tool","content":'
+        self._suffix = b"}]}]}\n\n"
+
+    @classmethod
+    def from_chunk(cls, chatCompletionChunk, dumps=None):
+        return cls(
+            chatCompletionChunk.id,
+            chatCompletionChunk.model,
+            chatCompletionChunk.created,
+            chatCompletionChunk.object,
+            dumps=dumps,
+        )
+
+    def encode_content(self, content):
+        """Encode an assistant content delta as an SSE frame."""
+        return self._content_prefix + self.dumps(content) + self._suffix
+
+    def encode_tool_context(self, context):
+        """Encode an 'On Your Data' style context delta as a tool message SSE frame."""
+        return self._tool_prefix + self.dumps(json.dumps(context)) + self._suffix
+
+
+class SSEStreamEncoder:
+    """
+    Encodes the chunks of one stream into SSE frames.
+
+    The envelope is built lazily from the first chunk that carries choices, because some
+    hosts (e.g. Azure content filter results) send a leading chunk with an empty id and model.
+    """
+
+    def __init__(self, dumps=None):
+        self.dumps = dumps or _default_dumps
+        self.envelope = None
+
+    def encode(self, chatCompletionChunk):
+        """
+        Encode a ChatCompletionChunk into an SSE frame.
+
+        Args:
+            chatCompletionChunk (ChatCompletionChunk): The chunk received from the model.
+
+        Returns:
+            bytes: The SSE frame, or b"" if the chunk carries nothing to send to the client.
+        """
+        choices = chatCompletionChunk.choices
+        if not choices:
+            return b""
+        delta = choices[0].delta
+        if delta is None:
+            return b""
+
+        envelope = self.envelope
+        if envelope is None:
+            envelope = self.envelope = StreamEnvelope.from_chunk(chatCompletionChunk, self.dumps)
+
+        # Pydantic keeps unknown fields such as "context" in model_extra; avoid hasattr on the hot path
+        extra = getattr(delta, "model_extra", None)
+        if extra and "context" in extra:
+            return envelope.encode_tool_context(extra["context"])
+
+        content = delta.content
+        if content:
+            return envelope.encode_content(content)
+        return b""
+
+
+def decode_sse_frame(frame):
+    """
+    Decode a single SSE frame produced by SSEStreamEncoder.
+
+    Args:
+        frame (bytes): The SSE frame, including the "data: " prefix.
+
+    Returns:
+        dict | None: The decoded payload, or None for the [DONE] frame.
+    """
+    if frame == SSE_DONE_FRAME:
+        return None
+    return json.loads(frame[len(b"data: "):])
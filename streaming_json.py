@@ -0,0 +1,511 @@
+"""
+    Incremental JSON parsing for streamed tool arguments
+    - IncrementalJSONParser is fed the argument fragments as they arrive and keeps a partially built value
+    - SchemaValidator checks the partial value against the tool's parameter schema while it is being generated
+    - ToolCallAccumulator replaces the tool call accumulation loop and aborts as soon as a violation is definitive
+"""
+import copy
+import json
+import re
+
+_STRING_SPECIAL = re.compile(r'["\\]')
+_SURROGATE = re.compile("[\ud800-\udfff]")
+_NUMBER_CHARS = frozenset("0123456789+-.eE")
+_WHITESPACE = frozenset(" \t\r\n")
+_LITERALS = {"t": ("true", True), "f": ("false", False), "n": ("null", None)}
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class ToolArgumentsError(ValueError):
+    """Base error for tool arguments rejected while streaming."""
+
+    def __init__(self, message, path=()):
+        super().__init__(message)
+        self.path = tuple(path)
+
+
+class JSONStreamError(ToolArgumentsError):
+    """The streamed text can no longer become valid JSON."""
+
+
+class SchemaViolation(ToolArgumentsError):
+    """The streamed value can no longer satisfy the schema."""
+
+
+class _Frame:
+    __slots__ = ("container", "state", "key")
+
+    def __init__(self, container, state):
+        self.container = container
+        self.state = state
+        self.key = None
+
+
+class IncrementalJSONParser:
+    """
+    A push parser for a single JSON document delivered in fragments.
+
+    The optional listener receives parse events as soon as they are known:
+        start_value(path, kind)        kind is one of object, array, string, number, boolean, null
+        object_key(path, key)          a key was read in the object at path
+        string_progress(path, text)    the string at path currently starts with text
+        end_value(path, value)         the value at path is complete
+
+    Args:
+        listener (object, optional): Receives the events above; any method may be omitted.
+    """
+
+    def __init__(self, listener=None):
+        self.listener = listener
+        self.root = None
+        self.done = False
+        self._stack = []
+        self._started = False
+        # Scalar token in progress ("string", "key", "number" or "literal") and its text so far
+        self._token = None
+        self._token_buffer = []
+        self._escape = None
+
+    # Events
+
+    def _emit(self, name, *args):
+        if self.listener is not None:
+            method = getattr(self.listener, name, None)
+            if method is not None:
+                method(*args)
+
+    def _path(self):
+        path = []
+        for frame in self._stack:
+            if isinstance(frame.container, dict):
+                path.append(frame.key)
+            else:
+                path.append(len(frame.container))
+        return tuple(path)
+
+    # Public API
+
+    def feed(self, text):
+        """
+        Feed the next fragment of the JSON document.
+
+        Raises:
+            JSONStreamError: If the text so far can no longer be valid JSON.
+            SchemaViolation: If the listener rejects the partial value.
+        """
+        i = 0
+        n = len(text)
+        while i < n:
+            token = self._token
+            if token == "string" or token == "key":
+                i = self._consume_string(text, i)
+                continue
+            ch = text[i]
+            if token == "number":
+                if ch in _NUMBER_CHARS:
+                    self._token_buffer.append(ch)
+                    i += 1
+                    continue
+                self._finish_number()
+                continue
+            if token == "literal":
+                self._consume_literal(ch)
+                i += 1
+                continue
+            if ch in _WHITESPACE:
+                i += 1
+                continue
+            self._consume_structural(ch)
+            i += 1
+
+    def close(self):
+        """
+        Signal the end of the document.
+
+        Returns:
+            The parsed value.
+
+        Raises:
+            JSONStreamError: If the document is incomplete.
+        """
+        if self._token == "number":
+            self._finish_number()
+        if not self.done:
+            raise JSONStreamError("Incomplete JSON document", self._path())
+        return self.root
+
+    def partial(self):
+        """
+        Get a snapshot of the partially parsed value.
+        Strings that are still being streamed are included with their current text.
+        """
+        snapshot = copy.deepcopy(self.root)
+        if self._token == "string" and self._stack:
+            parent = snapshot
+            for frame in self._stack[:-1]:
+                parent = parent[frame.key] if isinstance(frame.container, dict) else parent[-1]
+            value = "".join(self._token_buffer)
+            frame = self._stack[-1]
+            if isinstance(parent, dict):
+                parent[frame.key] = value
+            else:
+                parent.append(value)
+        elif self._token == "string":
+            snapshot = "".join(self._token_buffer)
+        return snapshot
+
+    # Tokens
+
+    def _consume_string(self, text, i):
+        buffer = self._token_buffer
+        n = len(text)
+        while i < n:
+            if self._escape is not None:
+                i = self._consume_escape(text, i)
+                continue
+            match = _STRING_SPECIAL.search(text, i)
+            end = match.start() if match else n
+            if end > i:
+                buffer.append(text[i:end])
+                if self._token == "string":
+                    self._emit("string_progress", self._path(), "".join(buffer))
+            if match is None:
+                return n
+            if text[end] == "\\":
+                self._escape = ""
+                i = end + 1
+                continue
+            # Closing quote
+            value = "".join(buffer)
+            if _SURROGATE.search(value):
+                # Join \uXXXX surrogate pairs the same way json.loads does
+                value = value.encode("utf-16", "surrogatepass").decode("utf-16")
+            self._token_buffer = []
+            if self._token == "key":
+                self._token = None
+                frame = self._stack[-1]
+                frame.key = value
+                frame.state = "colon"
+                self._emit("object_key", self._path()[:-1], value)
+            else:
+                self._token = None
+                self._complete_scalar(value)
+            return end + 1
+        return n
+
+    def _consume_escape(self, text, i):
+        escape = self._escape
+        ch = text[i]
+        if escape == "":
+            if ch == "u":
+                self._escape = "u"
+            elif ch in _ESCAPES:
+                self._token_buffer.append(_ESCAPES[ch])
+                self._escape = None
+            else:
+                raise JSONStreamError("Invalid escape sequence \\" + ch, self._path())
+            return i + 1
+        # Collecting the four hex digits of a \uXXXX escape
+        if ch not in "0123456789abcdefABCDEF":
+            raise JSONStreamError("Invalid unicode escape", self._path())
+        escape += ch
+        if len(escape) == 5:
+            self._token_buffer.append(chr(int(escape[1:], 16)))
+            self._escape = None
+        else:
+            self._escape = escape
+        return i + 1
+
+    def _consume_literal(self, ch):
+        buffer = self._token_buffer
+        buffer.append(ch)
+        word, value = _LITERALS[buffer[0]]
+        text = "".join(buffer)
+        if not word.startswith(text):
+            raise JSONStreamError("Invalid literal " + repr(text), self._path())
+        if text == word:
+            self._token = None
+            self._token_buffer = []
+            self._complete_scalar(value)
+
+    def _finish_number(self):
+        text = "".join(self._token_buffer)
+        self._token = None
+        self._token_buffer = []
+        try:
+            value = json.loads(text)
+        except ValueError:
+            raise JSONStreamError("Invalid number " + repr(text), self._path()) from None
+        if not isinstance(value, (int, float)):
+            raise JSONStreamError("Invalid number " + repr(text), self._path())
+        self._complete_scalar(value)
+
+    # Structure
+
+    def _consume_structural(self, ch):
+        if self.done:
+            raise JSONStreamError("Unexpected data after the end of the document", ())
+        if not self._stack:
+            if self._started:
+                raise JSONStreamError("Unexpected " + repr(ch), ())
+            self._start_value(ch)
+            return
+
+        frame = self._stack[-1]
+        state = frame.state
+        if isinstance(frame.container, dict):
+            if state in ("key_or_end", "key"):
+                if ch == '"':
+                    self._token = "key"
+                    self._token_buffer = []
+                elif ch == "}" and state == "key_or_end":
+                    self._end_container()
+                else:
+                    raise JSONStreamError("Expected an object key, got " + repr(ch), self._path()[:-1])
+            elif state == "colon":
+                if ch != ":":
+                    raise JSONStreamError("Expected ':', got " + repr(ch), self._path())
+                frame.state = "value"
+            elif state == "value":
+                self._start_value(ch)
+            elif state == "comma_or_end":
+                if ch == ",":
+                    frame.state = "key"
+                elif ch == "}":
+                    self._end_container()
+                else:
+                    raise JSONStreamError("Expected ',' or '}', got " + repr(ch), self._path()[:-1])
+        else:
+            if state == "value_or_end" and ch == "]":
+                self._end_container()
+            elif state in ("value_or_end", "value"):
+                self._start_value(ch)
+            elif state == "comma_or_end":
+                if ch == ",":
+                    frame.state = "value"
+                elif ch == "]":
+                    self._end_container()
+                else:
+                    raise JSONStreamError("Expected ',' or ']', got " + repr(ch), self._path()[:-1])
+
+    def _start_value(self, ch):
+        self._started = True
+        path = self._path()
+        if ch == "{" or ch == "[":
+            container = {} if ch == "{" else []
+            self._emit("start_value", path, "object" if ch == "{" else "array")
+            self._attach(container)
+            self._stack.append(_Frame(container, "key_or_end" if ch == "{" else "value_or_end"))
+        elif ch == '"':
+            self._emit("start_value", path, "string")
+            self._token = "string"
+            self._token_buffer = []
+            self._emit("string_progress", path, "")
+        elif ch == "-" or ch.isdigit():
+            self._emit("start_value", path, "number")
+            self._token = "number"
+            self._token_buffer = [ch]
+        elif ch in _LITERALS:
+            self._emit("start_value", path, "null" if ch == "n" else "boolean")
+            self._token = "literal"
+            self._token_buffer = [ch]
+        else:
+            raise JSONStreamError("Unexpected " + repr(ch), path)
+
+    def _attach(self, value):
+        if not self._stack:
+            self.root = value
+            return
+        frame = self._stack[-1]
+        if isinstance(frame.container, dict):
+            frame.container[frame.key] = value
+        else:
+            frame.container.append(value)
+
+    def _complete_scalar(self, value):
+        path = self._path()
+        self._attach(value)
+        self._emit("end_value", path, value)
+        self._after_value()
+
+    def _end_container(self):
+        frame = self._stack.pop()
+        path = self._path()
+        if self._stack and isinstance(self._stack[-1].container, list):
+            # The container was appended to its parent array when it started
+            path = path[:-1] + (path[-1] - 1,)
+        self._emit("end_value", path, frame.container)
+        self._after_value()
+
+    def _after_value(self):
+        if not self._stack:
+            self.done = True
+            return
+        self._stack[-1].state = "comma_or_end"
+
+
+_JSON_TYPES = {
+    "object": (dict,),
+    "array": (list,),
+    "string": (str,),
+    "number": (int, float),
+    "integer": (int,),
+    "boolean": (bool,),
+    "null": (type(None),),
+}
+
+
+class SchemaValidator:
+    """
+    Validates a streamed JSON value against a (subset of) JSON Schema.
+    - Checks type as soon as a value starts, and enum prefixes while a string is streamed
+    - Rejects unknown keys when additionalProperties is false
+    - Checks enums, integer types and required keys when a value completes
+
+    Args:
+        schema (dict): The JSON schema, e.g. the "parameters" of a tool definition.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema or {}
+
+    def schema_at(self, path):
+        schema = self.schema
+        for part in path:
+            if schema is None:
+                return None
+            if isinstance(part, int):
+                schema = schema.get("items")
+            else:
+                properties = schema.get("properties", {})
+                if part in properties:
+                    schema = properties[part]
+                else:
+                    additional = schema.get("additionalProperties")
+                    schema = additional if isinstance(additional, dict) else None
+        return schema
+
+    def start_value(self, path, kind):
+        schema = self.schema_at(path)
+        if not schema or "type" not in schema:
+            return
+        allowed = schema["type"] if isinstance(schema["type"], list) else [schema["type"]]
+        if kind in allowed or (kind == "number" and "integer" in allowed):
+            return
+        raise SchemaViolation(
+            f"Expected {' or '.join(allowed)} at {_format_path(path)}, got {kind}", path
+        )
+
+    def object_key(self, path, key):
+        schema = self.schema_at(path)
+        if not schema:
+            return
+        if schema.get("additionalProperties") is False and key not in schema.get("properties", {}):
+            raise SchemaViolation(f"Unexpected property {key!r} at {_format_path(path)}", path + (key,))
+
+    def string_progress(self, path, text):
+        schema = self.schema_at(path)
+        if not schema or "enum" not in schema:
+            return
+        if not any(isinstance(option, str) and option.startswith(text) for option in schema["enum"]):
+            raise SchemaViolation(
+                f"Value {text!r}... at {_format_path(path)} is not one of {schema['enum']}", path
+            )
+
+    def end_value(self, path, value):
+        schema = self.schema_at(path)
+        if not schema:
+            return
+        if "enum" in schema and value not in schema["enum"]:
+            raise SchemaViolation(f"Value {value!r} at {_format_path(path)} is not one of {schema['enum']}", path)
+        types = schema.get("type")
+        if types is not None:
+            types = types if isinstance(types, list) else [types]
+            if isinstance(value, bool) and "boolean" not in types:
+                raise SchemaViolation(f"Expected {' or '.join(types)} at {_format_path(path)}", path)
+            if not any(isinstance(value, _JSON_TYPES.get(t, object)) for t in types):
+                raise SchemaViolation(f"Expected {' or '.join(types)} at {_format_path(path)}", path)
+        if isinstance(value, dict):
+            missing = [name for name in schema.get("required", []) if name not in value]
+            if missing:
+                raise SchemaViolation(
+                    f"Missing required properties {missing} at {_format_path(path)}", path
+                )
+
+
+def _format_path(path):
+    return "$" + "".join(f"[{part}]" if isinstance(part, int) else f".{part}" for part in path)
+
+
+class ToolCallAccumulator:
+    """
+    Accumulates streamed tool call deltas into complete tool calls.
+    When tools are given, each tool call's arguments are parsed incrementally and
+    validated against that tool's parameter schema while the model is still generating.
+
+    Args:
+        tools (list, optional): The tool definitions sent to the model.
+
+    Raises (from add and finish):
+        ToolArgumentsError: As soon as a tool call can no longer be valid.
+    """
+
+    def __init__(self, tools=None):
+        self.tool_calls = []
+        self._schemas = None
+        if tools is not None:
+            self._schemas = {
+                tool["function"]["name"]: tool["function"].get("parameters") for tool in tools
+            }
+        self._parsers = []
+
+    def add(self, tc_chunk_list):
+        """Add the tool call deltas from one streamed chunk."""
+        tool_calls = self.tool_calls
+        for tc_chunk in tc_chunk_list:
+            while len(tool_calls) <= tc_chunk.index:
+                tool_calls.append({"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+                self._parsers.append(None)
+            tc = tool_calls[tc_chunk.index]
+
+            if tc_chunk.id:
+                tc["id"] += tc_chunk.id
+            if tc_chunk.function.name:
+                tc["function"]["name"] += tc_chunk.function.name
+            if tc_chunk.function.arguments:
+                tc["function"]["arguments"] += tc_chunk.function.arguments
+                if self._schemas is not None:
+                    self._parser_for(tc_chunk.index).feed(tc_chunk.function.arguments)
+
+    def _parser_for(self, index):
+        parser = self._parsers[index]
+        if parser is None:
+            name = self.tool_calls[index]["function"]["name"]
+            if name not in self._schemas:
+                raise SchemaViolation("Function " + name + " does not exist")
+            parser = IncrementalJSONParser(SchemaValidator(self._schemas[name]))
+            self._parsers[index] = parser
+        return parser
+
+    def partial_arguments(self, index):
+        """Get the partially parsed arguments of the tool call at index (None if not started)."""
+        if index >= len(self._parsers) or self._parsers[index] is None:
+            return None
+        return self._parsers[index].partial()
+
+    def finish(self):
+        """
+        Complete the validation of every tool call once the stream has ended.
+
+        Returns:
+            list: The accumulated tool calls.
+        """
+        if self._schemas is not None:
+            for index, tc in enumerate(self.tool_calls):
+                parser = self._parsers[index]
+                if parser is None:
+                    # A tool call without arguments is only valid if the schema requires nothing
+                    parser = self._parser_for(index)
+                    parser.feed(tc["function"]["arguments"] or "{}")
+                parser.close()
+        return self.tool_calls
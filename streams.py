@@ -0,0 +1,17 @@
+"""
+    Stream helpers shared by the stream wrappers (metrics, usage, backpressure, singleflight) and the tool loops
+"""
+import inspect
+
+
+async def aclose_stream(stream):
+    """
+    Close an async stream: an async generator, or an object with a close method such as openai's AsyncStream,
+    which releases its HTTP connection. Async generators are not closed when the loop consuming them stops early,
+    so stream wrappers call this when they are closed, to propagate the close down to the upstream response.
+    """
+    close = getattr(stream, "aclose", None) or getattr(stream, "close", None)
+    if close is not None:
+        result = close()
+        if inspect.isawaitable(result):
+            await result
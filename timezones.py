@@ -0,0 +1,172 @@
+"""
+    Timezone index for get_current_time
+    - Maps IANA zone names, their city names, countries (names and ISO codes) and common aliases to zones,
+      built once from the pytz database
+    - Lookups are case-insensitive, accept "City, Country" and unambiguous prefixes ("bangk" -> Asia/Bangkok)
+    - tzinfo objects are created once per zone and cached
+"""
+import bisect
+import re
+from datetime import datetime, timezone as dt_timezone
+import pytz
+
+# Cities and abbreviations that are not zone names themselves
+ALIASES = {
+    "san francisco": "America/Los_Angeles",
+    "sf": "America/Los_Angeles",
+    "la": "America/Los_Angeles",
+    "seattle": "America/Los_Angeles",
+    "san diego": "America/Los_Angeles",
+    "las vegas": "America/Los_Angeles",
+    "nyc": "America/New_York",
+    "washington": "America/New_York",
+    "washington dc": "America/New_York",
+    "boston": "America/New_York",
+    "miami": "America/New_York",
+    "atlanta": "America/New_York",
+    "philadelphia": "America/New_York",
+    "dallas": "America/Chicago",
+    "houston": "America/Chicago",
+    "austin": "America/Chicago",
+    "beijing": "Asia/Shanghai",
+    "mumbai": "Asia/Kolkata",
+    "bombay": "Asia/Kolkata",
+    "delhi": "Asia/Kolkata",
+    "new delhi": "Asia/Kolkata",
+    "bangalore": "Asia/Kolkata",
+    "osaka": "Asia/Tokyo",
+    "kyoto": "Asia/Tokyo",
+    "munich": "Europe/Berlin",
+    "frankfurt": "Europe/Berlin",
+    "milan": "Europe/Rome",
+    "barcelona": "Europe/Madrid",
+    "geneva": "Europe/Zurich",
+    "st petersburg": "Europe/Moscow",
+    "rio de janeiro": "America/Sao_Paulo",
+    "melbourne": "Australia/Melbourne",
+    "uk": "Europe/London",
+    "united kingdom": "Europe/London",
+    "england": "Europe/London",
+    "usa": "America/New_York",
+    "utc": "UTC",
+    "gmt": "UTC",
+}
+
+# Countries spanning several zones resolve to their most populous zone
+COUNTRY_ZONES = {
+    "US": "America/New_York",
+    "CA": "America/Toronto",
+    "AU": "Australia/Sydney",
+    "BR": "America/Sao_Paulo",
+    "RU": "Europe/Moscow",
+    "CN": "Asia/Shanghai",
+    "MX": "America/Mexico_City",
+    "ID": "Asia/Jakarta",
+}
+
+_SEPARATORS = re.compile(r"[\s_\-\.]+")
+
+
+def normalize(name):
+    """Normalize a location name for lookups: case-folded, with _ - . and runs of spaces as single spaces."""
+    return _SEPARATORS.sub(" ", name.casefold()).strip()
+
+
+class TimezoneIndex:
+    """
+    Index of location names to IANA zones.
+
+    Args:
+        aliases (dict, optional): Extra location names mapped to zones; defaults to ALIASES.
+    """
+
+    def __init__(self, aliases=None):
+        self.zones = {} # normalized name -> zone
+        self._tzinfos = {} # zone -> tzinfo
+
+        # Zone and city names ("America/New_York", "new york"), countries, then the legacy zones ("Japan"):
+        # earlier entries win, so the canonical zones take precedence over the legacy links
+        for zone in pytz.common_timezones:
+            self.zones.setdefault(normalize(zone), zone)
+            if "/" in zone:
+                self.zones.setdefault(normalize(zone.rsplit("/", 1)[1]), zone)
+        for code, country in pytz.country_names.items():
+            zones = pytz.country_timezones.get(code)
+            if zones:
+                zone = COUNTRY_ZONES.get(code, zones[0])
+                self.zones.setdefault(normalize(country), zone)
+                self.zones.setdefault(code.lower(), zone)
+        for zone in pytz.all_timezones:
+            self.zones.setdefault(normalize(zone), zone)
+            if "/" in zone:
+                self.zones.setdefault(normalize(zone.rsplit("/", 1)[1]), zone)
+        for alias, zone in (ALIASES if aliases is None else aliases).items():
+            self.zones[normalize(alias)] = zone
+
+        self._names = sorted(self.zones) # for prefix lookups
+
+    def resolve(self, location):
+        """
+        Resolve a location to its zone name.
+
+        Args:
+            location (str): A zone ("America/New_York"), city, "City, Country", country, ISO code, alias or prefix.
+
+        Returns:
+            str: The zone name, or None if the location is unknown or an ambiguous prefix.
+        """
+        key = normalize(location)
+        zone = self.zones.get(key)
+        if zone is not None:
+            return zone
+        # "Paris, France" -> try the parts, most specific first
+        if "," in key:
+            for part in key.split(","):
+                zone = self.zones.get(part.strip())
+                if zone is not None:
+                    return zone
+        return self._resolve_prefix(key) if len(key) >= 3 else None
+
+    def _resolve_prefix(self, prefix):
+        start = bisect.bisect_left(self._names, prefix)
+        end = bisect.bisect_left(self._names, prefix + "\uffff", start)
+        zones = {self.zones[name] for name in self._names[start:end]}
+        return zones.pop() if len(zones) == 1 else None
+
+    def tzinfo(self, zone):
+        tzinfo = self._tzinfos.get(zone)
+        if tzinfo is None:
+            tzinfo = self._tzinfos[zone] = pytz.timezone(zone)
+        return tzinfo
+
+    def now(self, location, now=None):
+        """
+        The current time at a location.
+
+        Args:
+            location (str): See resolve.
+            now (datetime, optional): The aware UTC time to convert; defaults to the current time.
+
+        Returns:
+            datetime: The local time, or None if the location is unknown.
+        """
+        zone = self.resolve(location)
+        if zone is None:
+            return None
+        return (now or datetime.now(dt_timezone.utc)).astimezone(self.tzinfo(zone))
+
+    def now_many(self, locations):
+        """The current time at many locations, all converted from the same instant; None for unknown locations."""
+        now = datetime.now(dt_timezone.utc)
+        return {location: self.now(location, now) for location in locations}
+
+
+# The index shared by the examples, built on first use
+_index = None
+
+
+def get_index():
+    global _index
+    if _index is None:
+        _index = TimezoneIndex()
+    return _index
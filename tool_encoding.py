@@ -0,0 +1,138 @@
+"""
+    Compact encoding of tool outputs
+    - Tool results are sent back to the model as prompt tokens; tabular results encoded as JSON repeat
+      every key (or row index) for every value
+    - ToolOutputEncoder renders a tool's raw output (DataFrame, list of records, dict, str) in a selectable format:
+        json     compact JSON
+        records  key-deduplicated JSON: {"columns": [...], "rows": [[...], ...]}
+        csv/tsv  a header row followed by one line per record
+    - Optionally rounds floats and keeps only some columns; more formats can be added with register_format
+    - count_tokens counts tokens with tiktoken when it is installed, otherwise estimates them (~4 characters per token)
+"""
+import csv
+import io
+import json
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+def _compact_json(data):
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _records_json(rows, columns):
+    return _compact_json({"columns": columns, "rows": [[row.get(column) for column in columns] for row in rows]})
+
+
+def _delimited(delimiter):
+    def encode(rows, columns):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=delimiter, lineterminator="\n")
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(["" if row.get(column) is None else row.get(column) for column in columns])
+        return buffer.getvalue().rstrip("\n")
+
+    return encode
+
+
+# Tabular formats, called with (rows, columns)
+FORMATS = {
+    "records": _records_json,
+    "csv": _delimited(","),
+    "tsv": _delimited("\t"),
+}
+
+
+def register_format(name, encode):
+    """Add a tabular format; encode(rows, columns) returns the encoded string."""
+    FORMATS[name] = encode
+
+
+def round_numbers(data, digits):
+    """Round the floats in nested lists / dicts."""
+    if isinstance(data, float):
+        return round(data, digits)
+    if isinstance(data, dict):
+        return {key: round_numbers(value, digits) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [round_numbers(value, digits) for value in data]
+    return data
+
+
+def to_records(data):
+    """
+    Convert tabular data to records.
+
+    Returns:
+        tuple: (rows, columns), or None if the data is not tabular.
+    """
+    if hasattr(data, "to_dict") and hasattr(data, "columns"): # pandas DataFrame
+        return data.to_dict("records"), [str(column) for column in data.columns]
+    if isinstance(data, list) and data and all(isinstance(row, dict) for row in data):
+        columns = list(dict.fromkeys(key for row in data for key in row))
+        return data, columns
+    return None
+
+
+class ToolOutputEncoder:
+    """
+    Encodes the raw output of a tool for the model.
+
+    Args:
+        format (str): "json", or a tabular format in FORMATS ("records", "csv", "tsv").
+            Non-tabular output falls back to compact JSON.
+        digits (int, optional): Round floats to this many digits.
+        columns (list, optional): Only keep these columns of tabular output.
+    """
+
+    def __init__(self, format="json", digits=None, columns=None):
+        if format != "json" and format not in FORMATS:
+            raise ValueError("Unknown tool output format: " + str(format))
+        self.format = format
+        self.digits = digits
+        self.columns = columns
+
+    def encode(self, data):
+        if isinstance(data, str):
+            return data
+        table = to_records(data)
+        if table is not None:
+            rows, columns = table
+            if self.columns is not None:
+                columns = [column for column in columns if column in self.columns]
+            if self.digits is not None:
+                rows = round_numbers(rows, self.digits)
+            if self.format in FORMATS:
+                return FORMATS[self.format](rows, columns)
+            return _compact_json([{column: row.get(column) for column in columns} for row in rows])
+        if self.digits is not None:
+            data = round_numbers(data, self.digits)
+        return _compact_json(data)
+
+
+DEFAULT_ENCODER = ToolOutputEncoder()
+
+
+def encode_tool_output(output, encoder=None):
+    """Encode a tool's output with its encoder (compact JSON by default); strings are passed through."""
+    return (encoder or DEFAULT_ENCODER).encode(output)
+
+
+def count_tokens(text, model="gpt-4o"):
+    """
+    Count the tokens of a text.
+
+    Returns:
+        tuple: (tokens, exact); exact is False when tiktoken is not installed and the count is estimated.
+    """
+    if tiktoken is not None:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+        return len(encoding.encode(text)), True
+    return (len(text) + 3) // 4, False
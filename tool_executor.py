@@ -0,0 +1,166 @@
+"""
+    Tool executor for the async flows
+    - Runs each tool according to its declared kind, so slow or CPU-heavy tools do not block the event loop:
+        inline   called on the event loop (for fast tools, or tools that update session state)
+        async    awaited (the tool is a coroutine function)
+        thread   run in a thread pool (I/O-bound tools)
+        process  run in a process pool (CPU-bound tools; the function and arguments must be picklable)
+    - Per-call timeouts: a tool that does not finish in time returns a structured error to the model
+      instead of hanging the turn
+    - Per-tool bulkheads: at most max_concurrency calls of a tool run at once; a slot is only released when
+      the call really finishes, so timed out calls still count until their thread / process is done
+"""
+import asyncio
+import concurrent.futures
+import functools
+import json
+import metrics
+
+KINDS = ("inline", "async", "thread", "process")
+
+
+class ToolSpec:
+    """
+    How a tool is executed.
+
+    Args:
+        kind (str): One of KINDS.
+        timeout (float, optional): Seconds before the call returns a timeout error; None waits forever.
+        max_concurrency (int, optional): Calls of this tool running at once; None is unlimited.
+    """
+
+    def __init__(self, kind="inline", timeout=None, max_concurrency=None):
+        if kind not in KINDS:
+            raise ValueError("Unknown tool kind: " + str(kind))
+        self.kind = kind
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+
+
+class ToolError(str):
+    """A structured JSON error returned to the model as the tool result."""
+
+
+def tool_error(tool, error, message, **details):
+    return ToolError(json.dumps({"error": error, "tool": tool, "message": message, **details}))
+
+
+def is_tool_error(output):
+    return isinstance(output, ToolError)
+
+
+class ToolExecutor:
+    """
+    Executes tools according to their ToolSpec.
+
+    Args:
+        specs (dict, optional): Tool name -> ToolSpec; tools without a spec use default_spec.
+        default_spec (ToolSpec, optional): Defaults to running inline without a timeout.
+        max_threads (int, optional): Size of the thread pool.
+        max_processes (int, optional): Size of the process pool, created on first use.
+    """
+
+    def __init__(self, specs=None, default_spec=None, max_threads=None, max_processes=None):
+        self.specs = dict(specs or {})
+        self.default_spec = default_spec or ToolSpec()
+        self.max_threads = max_threads
+        self.max_processes = max_processes
+        self._thread_pool = None
+        self._process_pool = None
+        self._bulkheads = {} # tool name -> asyncio.Semaphore
+
+    def spec(self, name):
+        return self.specs.get(name, self.default_spec)
+
+    def _executor(self, kind):
+        if kind == "thread":
+            if self._thread_pool is None:
+                self._thread_pool = concurrent.futures.ThreadPoolExecutor(self.max_threads, thread_name_prefix="tool")
+            return self._thread_pool
+        if self._process_pool is None:
+            self._process_pool = concurrent.futures.ProcessPoolExecutor(self.max_processes)
+        return self._process_pool
+
+    def _bulkhead(self, name, spec):
+        if spec.max_concurrency is None:
+            return None
+        bulkhead = self._bulkheads.get(name)
+        if bulkhead is None:
+            bulkhead = self._bulkheads[name] = asyncio.Semaphore(spec.max_concurrency)
+        return bulkhead
+
+    async def run(self, name, function, args):
+        """
+        Run a tool call.
+
+        Args:
+            name (str): The tool name, used to look up its spec.
+            function (callable): The tool function.
+            args (dict): The keyword arguments from the model.
+
+        Returns:
+            The tool output, or a ToolError if the call timed out, had to wait too long
+            for a free slot, or raised.
+        """
+        spec = self.spec(name)
+        loop = asyncio.get_running_loop()
+        deadline = None if spec.timeout is None else loop.time() + spec.timeout
+
+        bulkhead = self._bulkhead(name, spec)
+        if bulkhead is not None:
+            try:
+                await asyncio.wait_for(bulkhead.acquire(), spec.timeout)
+            except asyncio.TimeoutError:
+                metrics.increment("tool_rejections_total", tool=name)
+                return tool_error(name, "busy", f"Too many concurrent {name} calls, try again later",
+                                  max_concurrency=spec.max_concurrency)
+
+        try:
+            if spec.kind == "inline":
+                work = None
+                result = function(**args)
+            elif spec.kind == "async":
+                work = asyncio.ensure_future(function(**args))
+            else:
+                work = asyncio.wrap_future(self._executor(spec.kind).submit(functools.partial(function, **args)))
+        except Exception as e:
+            if bulkhead is not None:
+                bulkhead.release()
+            return self._exception(name, e)
+
+        if work is None:
+            if bulkhead is not None:
+                bulkhead.release()
+            return result
+
+        if bulkhead is not None:
+            work.add_done_callback(lambda _: bulkhead.release())
+        remaining = None if deadline is None else max(0.0, deadline - loop.time())
+        try:
+            # shield: on timeout stop waiting, but let the call finish (threads and processes cannot be interrupted)
+            return await asyncio.wait_for(asyncio.shield(work), remaining)
+        except asyncio.TimeoutError:
+            if spec.kind == "async":
+                work.cancel()
+            else:
+                # The result is dropped; retrieve its exception so it is not reported as never retrieved
+                work.add_done_callback(lambda future: future.cancelled() or future.exception())
+            metrics.increment("tool_timeouts_total", tool=name)
+            return tool_error(name, "timeout", f"{name} did not finish within {spec.timeout} seconds",
+                              timeout_seconds=spec.timeout)
+        except asyncio.CancelledError:
+            if spec.kind == "async":
+                work.cancel()
+            raise
+        except Exception as e:
+            return self._exception(name, e)
+
+    def _exception(self, name, e):
+        metrics.increment("tool_errors_total", tool=name)
+        return tool_error(name, "exception", str(e), type=type(e).__name__)
+
+    def shutdown(self, wait=True):
+        for pool in (self._thread_pool, self._process_pool):
+            if pool is not None:
+                pool.shutdown(wait=wait, cancel_futures=True)
+        self._thread_pool = self._process_pool = None
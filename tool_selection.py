@@ -0,0 +1,148 @@
+"""
+    Per-request tool selection
+    - Every tool schema sent with a request costs prompt tokens; with dozens of tools the schemas outweigh the
+      conversation, and most of them are irrelevant to the question
+    - ToolSelector scores the tools locally (no model call) and sends only the k most relevant ones:
+        BM25 over the words of each tool's name, description, parameter names, descriptions and enum values
+        (see history_search.py), against the recent user messages
+        plus a bonus for the tools called recently in the conversation, decaying with every older call
+    - Falls back to the full set when no tool matches the question; tools listed in `always` (e.g. fetch_more)
+      are always sent
+    - Counts the tokens of the full and the selected tool schemas (see tool_encoding.count_tokens) and reports the
+      tokens saved, also recorded as metrics (tool_schema_tokens_*)
+    - Configuration (environment variables, also read from .env): TOOL_SELECTION_K=n (0, the default, sends all tools)
+"""
+import json
+import os
+from dotenv import load_dotenv
+import metrics
+from history_search import BM25Index
+from tool_encoding import count_tokens
+
+
+def tool_text(tool):
+    """The searchable text of a tool schema."""
+    function = tool.get("function", tool)
+    parts = [function["name"].replace("_", " "), function.get("description", "")]
+
+    def add_schema(schema):
+        if not isinstance(schema, dict):
+            return
+        parts.append(schema.get("description", ""))
+        parts.extend(str(value) for value in schema.get("enum", []))
+        for name, property_schema in schema.get("properties", {}).items():
+            parts.append(name.replace("_", " "))
+            add_schema(property_schema)
+        add_schema(schema.get("items"))
+
+    add_schema(function.get("parameters"))
+    return " ".join(part for part in parts if part)
+
+
+def _get(message, key):
+    return message.get(key) if isinstance(message, dict) else getattr(message, key, None)
+
+
+def _called_tools(message):
+    """The names of the tools called in an assistant message (legacy function_call or tool_calls, dict or object)."""
+    if isinstance(message, dict) and message.get("function_call"):
+        return [message["function_call"]["name"]]
+    names = []
+    tool_calls = _get(message, "tool_calls") or []
+    for tool_call in tool_calls:
+        function = tool_call["function"] if isinstance(tool_call, dict) else tool_call.function
+        names.append(function["name"] if isinstance(function, dict) else function.name)
+    return names
+
+
+class ToolSelector:
+    """
+    Selects the tools to send with a request.
+
+    Args:
+        k (int): Most tools to send (besides `always`); 0 sends all tools.
+        always (list): Names of the tools that are always sent when present.
+        user_messages (int): How many of the latest user messages make up the query.
+        usage_weight (float): Bonus of the last tool called, relative to the best text score; halved per older call.
+    """
+
+    def __init__(self, k=0, always=("fetch_more",), user_messages=2, usage_weight=0.5):
+        self.k = k
+        self.always = set(always)
+        self.user_messages = user_messages
+        self.usage_weight = usage_weight
+        self.requests = 0
+        self.fallbacks = 0
+        self.full_tokens = 0
+        self.selected_tokens = 0
+        self._indexes = {} # tool names -> (BM25Index, tokens of each tool)
+
+    @classmethod
+    def from_env(cls):
+        load_dotenv()
+        return cls(k=int(os.getenv("TOOL_SELECTION_K", "0") or 0))
+
+    def _index(self, tools):
+        key = tuple(tool.get("function", tool)["name"] for tool in tools)
+        if key not in self._indexes:
+            index = BM25Index()
+            for tool in tools:
+                index.add(tool_text(tool))
+            self._indexes[key] = (index, [count_tokens(json.dumps(tool))[0] for tool in tools])
+        return self._indexes[key]
+
+    def scores(self, tools, messages):
+        """The relevance score of every tool for the next request."""
+        index, _ = self._index(tools)
+        user_contents = [_get(message, "content") for message in messages if _get(message, "role") == "user"]
+        query = " ".join(content for content in user_contents[-self.user_messages:] if isinstance(content, str))
+        scores = [0.0] * len(tools)
+        for score, document in index.search(query, k=len(tools)):
+            scores[document] = score
+
+        # Recently called tools are likely to be called again (e.g. the next step of a sequence)
+        names = [tool.get("function", tool)["name"] for tool in tools]
+        bonus = self.usage_weight * max(max(scores), 1.0)
+        called = [name for message in messages for name in _called_tools(message)]
+        for age, name in enumerate(reversed(called)):
+            if name in names:
+                scores[names.index(name)] += bonus / 2 ** age
+        return scores
+
+    def select(self, tools, messages):
+        """
+        Returns:
+            list: The tools to send, in their original order: the top k, or all of them when none is relevant.
+        """
+        if not self.k or len(tools) <= self.k:
+            return tools
+        _, tokens = self._index(tools)
+        scores = self.scores(tools, messages)
+        ranked = sorted(
+            (i for i, tool in enumerate(tools) if scores[i] > 0 and tool.get("function", tool)["name"] not in self.always),
+            key=lambda i: -scores[i],
+        )
+        if not ranked:
+            self.fallbacks += 1
+            metrics.increment("tool_selection_fallbacks_total")
+            selected = list(range(len(tools)))
+        else:
+            chosen = set(ranked[:self.k])
+            selected = [i for i, tool in enumerate(tools) if i in chosen or tool.get("function", tool)["name"] in self.always]
+
+        self.requests += 1
+        self.full_tokens += sum(tokens)
+        self.selected_tokens += sum(tokens[i] for i in selected)
+        metrics.increment("tool_schema_tokens_total", sum(tokens[i] for i in selected))
+        metrics.increment("tool_schema_tokens_saved_total", sum(tokens) - sum(tokens[i] for i in selected))
+        return [tools[i] for i in selected]
+
+    def report(self):
+        if not self.requests:
+            return "Tool selection: off" if not self.k else "Tool selection: no requests"
+        saved = self.full_tokens - self.selected_tokens
+        return (
+            f"Tool selection (top {self.k}): {self.requests} requests, {self.fallbacks} fell back to all tools, "
+            f"tool schemas {self.selected_tokens} tokens instead of {self.full_tokens} "
+            f"({saved} saved, {saved / self.full_tokens:.0%})"
+        )
@@ -0,0 +1,273 @@
+"""
+    Token usage and cost accounting
+    - Streaming calls request usage with stream_options={"include_usage": True}; the last chunk then carries the usage
+    - Every call's prompt, cached prompt and completion tokens are recorded in a running ledger
+    - The ledger aggregates per call, turn, session and flow, and prices the tokens with a configurable price table
+    - Responses shared with another caller (singleflight.is_shared) are not billed again: their usage is counted
+      as saved
+
+    Configuration (environment variables, also read from .env):
+        PRICE_TABLE=path    JSON file {"<model>": {"prompt": x, "cached_prompt": y, "completion": z}} in USD per 1M tokens
+"""
+import contextvars
+import json
+import os
+import threading
+from dotenv import load_dotenv
+import metrics
+from streams import aclose_stream
+
+STREAM_OPTIONS = {"include_usage": True}
+
+# USD per 1M tokens; models are matched exactly, then by the longest matching prefix
+DEFAULT_PRICES = {
+    "gpt-4o-mini": {"prompt": 0.15, "cached_prompt": 0.075, "completion": 0.60},
+    "gpt-4o": {"prompt": 2.50, "cached_prompt": 1.25, "completion": 10.00},
+    "gpt-4-turbo": {"prompt": 10.00, "cached_prompt": 10.00, "completion": 30.00},
+    "gpt-4": {"prompt": 30.00, "cached_prompt": 30.00, "completion": 60.00},
+    "gpt-35-turbo": {"prompt": 0.50, "cached_prompt": 0.50, "completion": 1.50},
+    "gpt-3.5-turbo": {"prompt": 0.50, "cached_prompt": 0.50, "completion": 1.50},
+}
+
+_current_turn = contextvars.ContextVar("current_turn", default=None)
+
+
+class UsageTotals:
+    """Token counts and cost for one aggregation bucket."""
+
+    __slots__ = ("calls", "first_prompt_tokens", "prompt_tokens", "cached_tokens", "completion_tokens", "cost")
+
+    def __init__(self):
+        self.calls = 0
+        self.first_prompt_tokens = 0 # prompt size of the first call, used to measure prompt growth
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+
+    def add(self, prompt_tokens, cached_tokens, completion_tokens, cost):
+        if self.calls == 0:
+            self.first_prompt_tokens = prompt_tokens
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.cached_tokens += cached_tokens
+        self.completion_tokens += completion_tokens
+        self.cost += cost
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "first_prompt_tokens": self.first_prompt_tokens,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.prompt_tokens + self.completion_tokens,
+            "cost": round(self.cost, 6),
+        }
+
+
+class _Turn:
+    """Context manager (sync or async) that attributes the calls made inside it to a session turn."""
+
+    def __init__(self, ledger, session, turn_id):
+        self.ledger = ledger
+        self.key = (session, turn_id)
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_turn.set(self.key)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_turn.reset(self._token)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+class UsageLedger:
+    """
+    Running ledger of token usage and cost.
+
+    Args:
+        prices (dict, optional): Price table in USD per 1M tokens; defaults to DEFAULT_PRICES.
+    """
+
+    def __init__(self, prices=None):
+        self.prices = dict(DEFAULT_PRICES if prices is None else prices)
+        self.calls = [] # one entry per recorded call, in order
+        self.turns = {} # (session, turn) -> UsageTotals
+        self.sessions = {} # session -> UsageTotals
+        self.flows = {} # flow -> UsageTotals
+        self.total = UsageTotals()
+        self.saved = UsageTotals() # usage of shared responses, billed once to the caller that owns them
+        self._turn_counts = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        load_dotenv()
+        prices = dict(DEFAULT_PRICES)
+        price_table = os.getenv("PRICE_TABLE")
+        if price_table:
+            with open(price_table, "r") as file:
+                prices.update(json.load(file))
+        return cls(prices)
+
+    def price_for(self, model):
+        if model in self.prices:
+            return self.prices[model]
+        matches = [name for name in self.prices if model and model.startswith(name)]
+        if matches:
+            return self.prices[max(matches, key=len)]
+        return None
+
+    def cost(self, model, prompt_tokens, cached_tokens, completion_tokens):
+        price = self.price_for(model)
+        if price is None:
+            return 0.0
+        uncached = prompt_tokens - cached_tokens
+        return (
+            uncached * price["prompt"]
+            + cached_tokens * price.get("cached_prompt", price["prompt"])
+            + completion_tokens * price["completion"]
+        ) / 1_000_000
+
+    def turn(self, session="default", turn_id=None):
+        """Attribute the calls made inside the returned context manager to a turn of the session."""
+        with self._lock:
+            if turn_id is None:
+                turn_id = self._turn_counts.get(session, 0) + 1
+            self._turn_counts[session] = max(turn_id, self._turn_counts.get(session, 0))
+        return _Turn(self, session, turn_id)
+
+    def record(self, usage, model, flow, call=None, shared=False):
+        """
+        Record the usage of one completion call.
+
+        Args:
+            usage (CompletionUsage): The usage returned by the API (None is ignored).
+            model (str): The model that served the call, used to look up the price.
+            flow (str): The example / tool loop that made the call.
+            call (str, optional): Which call of the turn, e.g. "initial" or "followup".
+            shared (bool): The response was shared with another caller that records its usage (see singleflight.py);
+                it is counted as saved instead.
+        """
+        if usage is None:
+            return
+        prompt_tokens = usage.prompt_tokens or 0
+        completion_tokens = usage.completion_tokens or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details else 0
+        cost = self.cost(model, prompt_tokens, cached_tokens, completion_tokens)
+        session, turn_id = _current_turn.get() or ("default", None)
+
+        if shared:
+            with self._lock:
+                self.saved.add(prompt_tokens, cached_tokens, completion_tokens, cost)
+            metrics.increment("shared_tokens_total", prompt_tokens + completion_tokens, flow=flow)
+            return
+
+        with self._lock:
+            self.calls.append({
+                "session": session,
+                "turn": turn_id,
+                "flow": flow,
+                "call": call,
+                "model": model,
+                "prompt_tokens": prompt_tokens,
+                "cached_tokens": cached_tokens,
+                "completion_tokens": completion_tokens,
+                "cost": cost,
+            })
+            for buckets, key in ((self.turns, (session, turn_id)), (self.sessions, session), (self.flows, flow)):
+                if key not in buckets:
+                    buckets[key] = UsageTotals()
+                buckets[key].add(prompt_tokens, cached_tokens, completion_tokens, cost)
+            self.total.add(prompt_tokens, cached_tokens, completion_tokens, cost)
+
+        metrics.increment("prompt_tokens_total", prompt_tokens, flow=flow)
+        metrics.increment("cached_tokens_total", cached_tokens, flow=flow)
+        metrics.increment("completion_tokens_total", completion_tokens, flow=flow)
+
+    def record_chunk(self, chatCompletionChunk, flow, call=None, model=None, shared=False):
+        """Record the usage carried by a streamed chunk (only the last chunk has it)."""
+        usage = getattr(chatCompletionChunk, "usage", None)
+        if usage is not None:
+            self.record(usage, chatCompletionChunk.model or model, flow, call, shared)
+
+    def track_stream(self, stream, flow, call=None, model=None):
+        """Wrap a completion stream so the usage in its last chunk is recorded (as saved if the stream is shared)."""
+        def generate():
+            for chatCompletionChunk in stream:
+                self.record_chunk(chatCompletionChunk, flow, call, model, getattr(stream, "shared", False) is True)
+                yield chatCompletionChunk
+
+        return generate()
+
+    def track_async_stream(self, stream, flow, call=None, model=None):
+        """Async version of track_stream; closing the wrapper closes the stream."""
+        async def generate():
+            try:
+                async for chatCompletionChunk in stream:
+                    self.record_chunk(chatCompletionChunk, flow, call, model, getattr(stream, "shared", False) is True)
+                    yield chatCompletionChunk
+            finally:
+                await aclose_stream(stream)
+
+        return generate()
+
+    def summary(self):
+        """
+        Summarize the ledger.
+
+        Returns:
+            dict: Totals overall and per session, turn and flow.
+        """
+        with self._lock:
+            return {
+                "total": self.total.to_dict(),
+                "sessions": {session: totals.to_dict() for session, totals in self.sessions.items()},
+                "turns": [
+                    dict(session=session, turn=turn_id, **totals.to_dict())
+                    for (session, turn_id), totals in self.turns.items()
+                ],
+                "flows": {flow: totals.to_dict() for flow, totals in self.flows.items()},
+                "saved": self.saved.to_dict(),
+            }
+
+    def report(self):
+        """Format the ledger as a human readable report, including the prompt growth between turns."""
+        summary = self.summary()
+        lines = ["Token usage:"]
+        previous_prompt = {}
+        for turn in summary["turns"]:
+            growth = ""
+            if turn["session"] in previous_prompt:
+                growth = f", prompt growth {turn['first_prompt_tokens'] - previous_prompt[turn['session']]:+d}"
+            previous_prompt[turn["session"]] = turn["first_prompt_tokens"]
+            lines.append(
+                f"  session {turn['session']} turn {turn['turn']}: {turn['calls']} calls, "
+                f"{turn['prompt_tokens']} prompt ({turn['cached_tokens']} cached), "
+                f"{turn['completion_tokens']} completion, ${turn['cost']:.6f}{growth}"
+            )
+        for flow, totals in summary["flows"].items():
+            lines.append(
+                f"  flow {flow}: {totals['calls']} calls, {totals['total_tokens']} tokens, ${totals['cost']:.6f}"
+            )
+        total = summary["total"]
+        lines.append(f"  total: {total['calls']} calls, {total['total_tokens']} tokens, ${total['cost']:.6f}")
+        saved = summary["saved"]
+        if saved["calls"]:
+            lines.append(
+                f"  shared, not billed again: {saved['calls']} calls, {saved['total_tokens']} tokens, ${saved['cost']:.6f} saved"
+            )
+        return "\n".join(lines)
+
+
+# The ledger shared by the examples
+ledger = UsageLedger.from_env()
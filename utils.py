@@ -1,8 +1,12 @@
+import functools
 import inspect
 import json
 import os
+import time
 from dotenv import load_dotenv
 import openai
+from openai.types.chat import ChatCompletionChunk
+from router import ROUTED_MODEL, AsyncRouterClient, RouterClient
 
 def check_args(function, args):
     """
@@ -58,10 +62,99 @@ def get_function_and_args(tool_call, available_functions):
 
     return function_to_call, function_args
 
+class _TemplateValues(dict):
+    def __missing__(self, key):
+        return ""
+
+
+class DirectReturnTool:
+    """
+    A tool whose output is the final answer of the turn.
+    - The tool loop renders the output locally instead of sending it back to the model for a second completion
+    - Calls are passed through to the wrapped function, and its signature is kept for check_args
+
+    Args:
+        function (callable): The tool function.
+        formatter (str or callable, optional): How to render the output.
+            A str is a template formatted with the tool arguments, {result} (the output) and,
+            when the output is a JSON object, its fields; missing fields render empty.
+            A callable is called as formatter(output, args).
+            Defaults to the output as is.
+    """
+
+    def __init__(self, function, formatter=None):
+        functools.update_wrapper(self, function)
+        self.function = function
+        self.formatter = formatter
+
+    def __call__(self, *args, **kwargs):
+        return self.function(*args, **kwargs)
+
+    def render(self, output, args):
+        if self.formatter is None:
+            return str(output)
+        if callable(self.formatter):
+            return self.formatter(output, args)
+        values = _TemplateValues(args)
+        try:
+            parsed = json.loads(output)
+        except (TypeError, ValueError):
+            parsed = None
+        if isinstance(parsed, dict):
+            values.update(parsed)
+        values["result"] = output
+        return self.formatter.format_map(values)
+
+
+def direct_return(function, formatter=None):
+    """
+    Register a tool in direct return mode, e.g.
+    available_functions = {"get_current_weather": direct_return(get_current_weather, "It is {temperature} degrees in {location}.")}.
+    Only for tools whose output answers the question as is: the model never sees it, so it cannot chain further calls.
+
+    Returns:
+        DirectReturnTool: The wrapped tool.
+    """
+    return DirectReturnTool(function, formatter)
+
+
+def is_direct_return(function):
+    return isinstance(function, DirectReturnTool)
+
+
+def render_direct_return(tool_results):
+    """
+    Render the final answer of a turn whose tools were all called in direct return mode.
+
+    Args:
+        tool_results (list): (function, output, args) for each tool call of the turn.
+
+    Returns:
+        str: The rendered outputs, one per line.
+    """
+    return "\n".join(function.render(output, args) for function, output, args in tool_results)
+
+
+def direct_return_chunk(content, model, completion_id="chatcmpl-direct-return"):
+    """
+    Build a completion chunk carrying a direct return answer, so streaming tool loops can return it as a stream.
+
+    Returns:
+        ChatCompletionChunk: A single chunk with the whole content and finish_reason "stop".
+    """
+    return ChatCompletionChunk(
+        id=completion_id,
+        model=model or "",
+        created=int(time.time()),
+        object="chat.completion.chunk",
+        choices=[{"index": 0, "delta": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+    )
+
 def setup_client():
     """
     Sets up the client based on the API_HOST environment variable.
-    - Setup the client to use either Azure, OpenAI or Ollama API
+    - Setup the client to use either Azure, OpenAI or Ollama API, or to route across several of them
+      (API_HOST=router, backends listed in BACKENDS_FILE, see router.py)
     - Uses the environment variables
     - Returns the client and deployment name
 
@@ -91,6 +184,9 @@ def setup_client():
             api_key="nokeyneeded",
         )
         DEPLOYMENT_NAME = os.getenv("OLLAMA_MODEL")
+    elif API_HOST == "router":
+        client = RouterClient.from_env()
+        DEPLOYMENT_NAME = ROUTED_MODEL
     
     if client is None or DEPLOYMENT_NAME is None:
         raise ValueError("Invalid API_HOST or missing environment variables")
@@ -100,7 +196,8 @@ def setup_client():
 def setup_async_client():
     """
     Sets up the async client based on the API_HOST environment variable.
-    - Setup the client to use either Azure, OpenAI or Ollama API
+    - Setup the client to use either Azure, OpenAI or Ollama API, or to route across several of them
+      (API_HOST=router, backends listed in BACKENDS_FILE, see router.py)
     - Uses the Async client to handle asynchronous requests
     - Uses the environment variables
     - Returns the client and deployment name
@@ -128,4 +225,7 @@ def setup_async_client():
             api_key="nokeyneeded",
         )
         DEPLOYMENT_NAME = os.getenv("OLLAMA_MODEL")
+    elif API_HOST == "router":
+        client = AsyncRouterClient.from_env()
+        DEPLOYMENT_NAME = ROUTED_MODEL
     return client, DEPLOYMENT_NAME
@@ -0,0 +1,173 @@
+"""
+    Vectorized arithmetic for the calculator tools
+    - batch_calculate applies arrays of binary operations in one NumPy pass per operator
+    - evaluate_expression evaluates an arithmetic expression without eval: the expression is parsed with ast,
+      only numbers, variables, arithmetic operators and a few math functions are allowed, and the variables
+      may be arrays, so one expression computes a whole column of results at once
+    - Results that are undefined (e.g. division by zero) are returned as None
+"""
+import ast
+import operator
+import numpy as np
+
+MAX_EXPRESSION_LENGTH = 1000
+MAX_BATCH_SIZE = 100_000
+
+BINARY_OPERATORS = {
+    "+": np.add,
+    "-": np.subtract,
+    "*": np.multiply,
+    "/": np.true_divide,
+    "**": np.power,
+    "sqrt": lambda num1, num2: np.sqrt(num1),
+}
+
+_AST_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide,
+    ast.FloorDiv: np.floor_divide,
+    ast.Mod: np.mod,
+    ast.Pow: np.power,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+FUNCTIONS = {
+    "sqrt": np.sqrt,
+    "abs": np.abs,
+    "exp": np.exp,
+    "log": np.log,
+    "log10": np.log10,
+    "round": lambda value, digits=0: np.round(value, int(digits)),
+    "min": np.minimum,
+    "max": np.maximum,
+}
+
+CONSTANTS = {"pi": np.pi, "e": np.e}
+
+
+class ExpressionError(ValueError):
+    """Raised for an expression that cannot be evaluated safely."""
+
+
+def to_results(values):
+    """Convert a NumPy result to a list of floats, with None for undefined (nan / inf) results."""
+    values = np.atleast_1d(np.asarray(values, dtype=float))
+    return [value if np.isfinite(value) else None for value in values.tolist()]
+
+
+def to_array(value, name):
+    """
+    Convert an operand (a number or a flat list of numbers) to a 0 or 1 dimensional float array.
+    Anything else is rejected before any computation: nested lists would broadcast against each other
+    into arrays of size N * N.
+
+    Raises:
+        ValueError: If the value is not a number or a flat list of numbers, or has more than MAX_BATCH_SIZE values.
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float, list, tuple)):
+        raise ValueError(f"{name} must be a number or a list of numbers")
+    if isinstance(value, (list, tuple)):
+        if len(value) > MAX_BATCH_SIZE:
+            raise ValueError(f"{name} has more than {MAX_BATCH_SIZE} values")
+        if any(isinstance(item, bool) or not isinstance(item, (int, float)) for item in value):
+            raise ValueError(f"{name} must be a number or a flat list of numbers")
+    return np.asarray(value, dtype=float)
+
+
+def batch_calculate(num1, num2, operators):
+    """
+    Apply a batch of binary operations.
+
+    Args:
+        num1 (list): The first operands.
+        num2 (list): The second operands (ignored by sqrt); a single number is broadcast.
+        operators (str or list): One operator per operation, or a single operator applied to all.
+
+    Returns:
+        list: The results in order.
+    """
+    num1 = np.atleast_1d(to_array(num1, "num1"))
+    num2 = to_array(num2, "num2")
+    if isinstance(operators, str):
+        operators = [operators]
+    if not isinstance(operators, (list, tuple)) or not all(isinstance(symbol, str) for symbol in operators):
+        raise ValueError("operator must be an operator or a flat list of operators")
+    try:
+        num2 = np.broadcast_to(num2, num1.shape)
+        operators = np.broadcast_to(np.array(operators, dtype=object), num1.shape)
+    except ValueError:
+        raise ValueError("num1, num2 and operator must have the same length (or be a single value)") from None
+    invalid = set(operators.tolist()) - BINARY_OPERATORS.keys()
+    if invalid:
+        raise ValueError("Invalid operator: " + ", ".join(sorted(map(str, invalid))))
+
+    results = np.full(num1.shape, np.nan)
+    with np.errstate(all="ignore"):
+        for symbol, function in BINARY_OPERATORS.items():
+            mask = operators == symbol
+            if mask.any():
+                results[mask] = function(num1[mask], num2[mask])
+    return to_results(results)
+
+
+def evaluate_expression(expression, variables=None):
+    """
+    Evaluate an arithmetic expression, e.g. "(close - open) / open * 100".
+
+    Args:
+        expression (str): The expression; numbers, variable names, + - * / // % **, parentheses
+            and the functions in FUNCTIONS are allowed.
+        variables (dict, optional): Variable values, numbers or equally long flat lists of numbers.
+
+    Returns:
+        list: The results; one per element when the variables are lists, otherwise a single result.
+
+    Raises:
+        ExpressionError: If the expression is invalid or uses anything else.
+    """
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        raise ExpressionError(f"Expression longer than {MAX_EXPRESSION_LENGTH} characters")
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError as e:
+        raise ExpressionError(f"Invalid expression: {e.msg}") from None
+    except (MemoryError, RecursionError):
+        raise ExpressionError("Expression is nested too deeply") from None
+
+    if variables is not None and not isinstance(variables, dict):
+        raise ExpressionError("variables must be an object mapping names to numbers or lists of numbers")
+    values = dict(CONSTANTS)
+    for name, value in (variables or {}).items():
+        try:
+            values[name] = to_array(value, f"Variable {name}")
+        except ValueError as e:
+            raise ExpressionError(str(e)) from None
+
+    with np.errstate(all="ignore"):
+        try:
+            return to_results(_evaluate(tree.body, values))
+        except (TypeError, ValueError) as e: # wrong number of arguments, operands of different lengths
+            raise ExpressionError(str(e)) from None
+        except RecursionError:
+            raise ExpressionError("Expression is nested too deeply") from None
+
+
+def _evaluate(node, values):
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return np.float64(node.value)
+    if isinstance(node, ast.Name):
+        if node.id not in values:
+            raise ExpressionError(f"Unknown variable: {node.id}")
+        return values[node.id]
+    if isinstance(node, ast.BinOp) and type(node.op) in _AST_OPERATORS:
+        return _AST_OPERATORS[type(node.op)](_evaluate(node.left, values), _evaluate(node.right, values))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _AST_OPERATORS:
+        return _AST_OPERATORS[type(node.op)](_evaluate(node.operand, values))
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+        if node.func.id not in FUNCTIONS:
+            raise ExpressionError(f"Unknown function: {node.func.id}")
+        return FUNCTIONS[node.func.id](*(_evaluate(arg, values) for arg in node.args))
+    raise ExpressionError(f"Unsupported syntax: {ast.dump(node)[:60]}")